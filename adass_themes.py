@@ -4,11 +4,25 @@ pretalx.adass2020.es, organise them in themes and make sure that the groups are
 more or less equal in size.
 
 Some abstracts are associated to more than one theme. We use those to fill the
-groups that are a bit under-represented.
+groups that are a bit under-represented: by default greedily (always give the
+smallest theme one of the abstracts that could go there) or, with --exact, by
+solving the assignment as a flow problem so that the largest theme is as small
+as possible and then the smallest theme as large as possible. Theme sizes can
+be weighted with --target THEME_ID=N (e.g. the number of available slots).
+
+The output only depends on the abstracts, not on the order they come in.
 """
+import argparse
+from collections import defaultdict
+import csv
 from dataclasses import dataclass, field
+from fractions import Fraction
+import heapq
+import json
+import sys
 from typing import List
-import psycopg2
+
+import pretalx_db
 
 
 # These come from the raw database
@@ -68,66 +82,294 @@ class Abstract:
     themes: List[str] = field(default_factory=list)
 
 
-conn = psycopg2.connect(database="pretalx",
-                        user="pretalx",
-                        password="",
-                        host="localhost",
-                        port="5432")
-cur = conn.cursor()
-cur.execute(SQL)
-
-title_maxlen = 0
-abstracts = {}
-for row in cur:
-    (pk, title, type_id, theme_id) = row
-    if pk not in abstracts:
-        abstracts[pk] = Abstract(pk, title, type_id, themes=[theme_id, ])
-        title_maxlen = max(title_maxlen, len(title))
-    else:
-        assert abstracts[pk].title == title, f'Ops! issues with titles {pk}'
-        abstracts[pk].themes.append(theme_id)
-
-# Let's first distribute abstract with on;ly one theme to themes:
-spares = []
-themes = {pk: [] for pk in THEMES}
-for abstract in abstracts.values():
-    if len(abstract.themes) == 0:
-        raise Exception(f'Abstract {abstract.pk} has no theme!')
-    elif len(abstract.themes) > 1:
-        spares.append(abstract)
-        continue
-
-    themes[abstract.themes[0]].append(abstract.pk)
-
-# n = 0
-# for theme_id in themes:
-#     m = len(themes[theme_id])
-#     print(f'{THEMES[theme_id]}: {m}')
-#     n += m
-# print(f'Total: {n} abstracts plus {len(spares)} not assigned yet')
-
-# Now the ones where we could choose either way
-while spares:
-    a = spares.pop()
-    poorest = sorted((len(vals), _id) for _id, vals in themes.items()
-                     if _id in a.themes)[0][1]
-    themes[poorest].append(a.pk)
-
-# n = 0
-# for theme_id in themes:
-#     m = len(themes[theme_id])
-#     print(f'{THEMES[theme_id]}: {m}')
-#     n += m
-# print(f'Total: {n} abstracts plus {len(spares)} not assigned yet')
-
-# Reassign an id to the themes so that they are all single digit
-new_tid = 0
-print('# ID, Title; PID')
-for old_tid, alist in themes.items():
-    new_tid += 1
-    print(f'# Theme {new_tid}: {THEMES[old_tid]}')
-    for aid in alist:
-        a = abstracts[aid]
-        qtitle = f'"{a.title}"'
-        print(f'{a.pk:3}, {qtitle:{title_maxlen}}; ' +
-              f'{CODES[a.type_id]}{new_tid}-{a.pk}')
+def fetch_abstracts():
+    abstracts = {}
+    for row in pretalx_db.iter_query(SQL):
+        (pk, title, type_id, theme_id) = row
+        if pk not in abstracts:
+            abstracts[pk] = Abstract(pk, title, type_id, themes=[theme_id, ])
+        else:
+            assert abstracts[pk].title == title, \
+                f'Ops! issues with titles {pk}'
+            abstracts[pk].themes.append(theme_id)
+    return abstracts
+
+
+def split_spares(abstracts, theme_ids):
+    """
+    Distribute the abstracts with only one theme. Return theme -> [pk, ...]
+    and the list of spare abstracts (the ones with more than one theme).
+    """
+    spares = []
+    themes = {pk: [] for pk in theme_ids}
+    for abstract in abstracts.values():
+        if len(abstract.themes) == 0:
+            raise Exception(f'Abstract {abstract.pk} has no theme!')
+        elif len(abstract.themes) > 1:
+            spares.append(abstract)
+            continue
+
+        themes[abstract.themes[0]].append(abstract.pk)
+    return themes, spares
+
+
+def balance_greedy(themes, spares, targets):
+    """
+    Return spare pk -> theme. Keep the themes in a heap by relative size
+    (size / target) and give the smallest one the least flexible spare that
+    can go there, until all spares are assigned.
+    """
+    # theme -> spares that could go there, least flexible first
+    candidates = defaultdict(list)
+    for a in sorted(spares, key=lambda a: (len(set(a.themes)), a.pk)):
+        for tid in set(a.themes):
+            candidates[tid].append(a.pk)
+    for tid in candidates:
+        candidates[tid].reverse()   # pop() from the end
+
+    sizes = {tid: len(pks) for tid, pks in themes.items()}
+    heap = [(Fraction(sizes[tid], targets[tid]), tid) for tid in candidates]
+    heapq.heapify(heap)
+    assignment = {}
+    while heap:
+        _, tid = heapq.heappop(heap)
+        todo = candidates[tid]
+        while todo and todo[-1] in assignment:
+            todo.pop()
+        if not todo:
+            continue        # nothing left for this theme: drop it
+        assignment[todo.pop()] = tid
+        sizes[tid] += 1
+        heapq.heappush(heap, (Fraction(sizes[tid], targets[tid]), tid))
+    return assignment
+
+
+def _max_flow(graph, source, sink):
+    """
+    Dinic max flow. `graph` is node -> {node: capacity} and is turned into
+    the residual graph. Return the flow value.
+    """
+    for u in list(graph):
+        for v in list(graph[u]):
+            graph.setdefault(v, {}).setdefault(u, 0)
+    flow = 0
+    while True:
+        level = {source: 0}
+        queue = [source]
+        for u in queue:
+            for v, cap in graph[u].items():
+                if cap > 0 and v not in level:
+                    level[v] = level[u] + 1
+                    queue.append(v)
+        if sink not in level:
+            return flow
+        edges = {u: list(graph[u]) for u in graph}
+
+        def push(u, limit):
+            if u == sink:
+                return limit
+            pushed = 0
+            while edges[u] and pushed < limit:
+                v = edges[u][-1]
+                cap = graph[u][v]
+                if cap > 0 and level.get(v) == level[u] + 1:
+                    f = push(v, min(cap, limit - pushed))
+                    if f:
+                        graph[u][v] -= f
+                        graph[v][u] += f
+                        pushed += f
+                        continue
+                edges[u].pop()
+            return pushed
+
+        flow += push(source, float('inf'))
+
+
+def _assign(groups, free, lower, upper):
+    """
+    Assign the spares so that theme t gets between lower[t] and upper[t] of
+    them. `groups` is {theme set: number of spares}, `free` the themes. Return
+    {(theme set, theme): count} or None if that is not possible.
+
+    This is a circulation with lower bounds (on the theme -> sink and
+    source -> group edges), checked as a max flow from S' to T'.
+    """
+    if any(lower[t] > upper[t] for t in free):
+        return None
+    inf = float('inf')
+    graph = defaultdict(dict)
+    total = sum(groups.values())
+    for g, n in groups.items():
+        graph["S'"][g] = n
+        for t in g:
+            graph[g][('t', t)] = inf
+    graph["S'"]['sink'] = sum(lower.values())
+    graph['source']["T'"] = total
+    for t in free:
+        graph[('t', t)]['sink'] = upper[t] - lower[t]
+        graph[('t', t)]["T'"] = lower[t]
+    graph['sink']['source'] = inf
+
+    if _max_flow(graph, "S'", "T'") < total + sum(lower.values()):
+        return None
+    # The flow on g -> t is the residual capacity of t -> g
+    return {(g, t): graph[('t', t)][g] for g in groups for t in g
+            if graph[('t', t)][g]}
+
+
+def balance_exact(themes, spares, targets):
+    """
+    Return spare pk -> theme minimising the largest relative theme size
+    (size / target) and then maximising the smallest one.
+    """
+    groups = defaultdict(list)
+    for a in sorted(spares, key=lambda a: a.pk):
+        groups[frozenset(a.themes)].append(a.pk)
+    counts = {g: len(pks) for g, pks in groups.items()}
+    free = sorted(set().union(*groups)) if groups else []
+    fixed = {tid: len(themes[tid]) for tid in free}
+    n = len(spares)
+
+    def upper_for(u):
+        return {t: int(u * targets[t]) - fixed[t] for t in free}
+
+    def lower_for(lo_frac):
+        # ceil(lo_frac * target) spares at least, minus what it already has
+        return {
+            t: min(n, max(0, -(-lo_frac.numerator * targets[t]
+                               // lo_frac.denominator) - fixed[t]))
+            for t in free
+        }
+
+    # Possible relative sizes of the themes that can take spares
+    values = sorted(set(Fraction(fixed[t] + k, targets[t])
+                        for t in free for k in range(n + 1)))
+    # The largest one can't be smaller than what the themes already hold
+    floor = max((Fraction(len(pks), targets[tid])
+                 for tid, pks in themes.items()), default=0)
+    uppers = [floor] + [v for v in values if v > floor]
+
+    def search(values, feasible):
+        # smallest index in values for which feasible() is true
+        lo, hi = 0, len(values) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if feasible(values[mid]):
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    zero = dict.fromkeys(free, 0)
+    u = uppers[search(uppers, lambda u: _assign(counts, free, zero,
+                                                upper_for(u)) is not None)]
+    upper = upper_for(u)
+    # largest l that is still feasible
+    values.reverse()
+    lo_frac = values[search(
+        values,
+        lambda v: _assign(counts, free, lower_for(v), upper) is not None
+    )] if values else 0
+    flows = _assign(counts, free, lower_for(lo_frac), upper)
+
+    assignment = {}
+    for g, pks in groups.items():
+        pks = iter(pks)
+        for t in sorted(g):
+            for _ in range(flows.get((g, t), 0)):
+                assignment[next(pks)] = t
+    return assignment
+
+
+def balance(themes, spares, targets=None, exact=False):
+    """
+    Add the spare abstracts to `themes` (theme -> [pk, ...], modified in
+    place, each list sorted by pk) and return it.
+    """
+    targets = {tid: (targets or {}).get(tid, 1) for tid in themes}
+    engine = balance_exact if exact else balance_greedy
+    for pk, tid in engine(themes, spares, targets).items():
+        themes[tid].append(pk)
+    for pks in themes.values():
+        pks.sort()
+    return themes
+
+
+def paper_records(themes, abstracts):
+    """Yield a dict (id, title, pid, theme) per abstract."""
+    # Reassign an id to the themes so that they are all single digit
+    for new_tid, (old_tid, alist) in enumerate(themes.items(), 1):
+        for aid in alist:
+            a = abstracts[aid]
+            yield {'id': a.pk, 'title': a.title,
+                   'pid': f'{CODES[a.type_id]}{new_tid}-{a.pk}',
+                   'theme': THEMES[old_tid]}
+
+
+def print_themes(themes, abstracts, fmt='text'):
+    if fmt == 'csv':
+        writer = csv.DictWriter(sys.stdout,
+                                fieldnames=['id', 'title', 'pid', 'theme'])
+        writer.writeheader()
+        writer.writerows(paper_records(themes, abstracts))
+        return
+    if fmt == 'json':
+        json.dump(list(paper_records(themes, abstracts)), sys.stdout,
+                  indent=1)
+        print()
+        return
+
+    title_maxlen = max((len(a.title) for a in abstracts.values()), default=0)
+    # Reassign an id to the themes so that they are all single digit
+    new_tid = 0
+    print('# ID, Title; PID')
+    for old_tid, alist in themes.items():
+        new_tid += 1
+        print(f'# Theme {new_tid}: {THEMES[old_tid]}')
+        for aid in alist:
+            a = abstracts[aid]
+            qtitle = f'"{a.title}"'
+            print(f'{a.pk:3}, {qtitle:{title_maxlen}}; ' +
+                  f'{CODES[a.type_id]}{new_tid}-{a.pk}')
+
+
+def _target(value):
+    try:
+        tid, n = value.split('=')
+        tid, n = int(tid), int(n)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'{value!r} is not THEME_ID=N')
+    if n <= 0:
+        raise argparse.ArgumentTypeError(f'{value!r}: N must be positive')
+    return tid, n
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--exact', action='store_true',
+                        help='optimal instead of greedy balancing')
+    parser.add_argument('--target', type=_target, action='append',
+                        default=[], metavar='THEME_ID=N',
+                        help='relative size of the theme (repeatable) [1]')
+    parser.add_argument('--format', type=str, default='text',
+                        choices=('text', 'csv', 'json'),
+                        help='output format (load_pids.py reads them all)')
+    parser.add_argument('--summary', action='store_true',
+                        help='print the theme sizes to STDERR')
+    parser.add_argument('--snapshot', type=str, metavar='PATH',
+                        help='read from this pretalx_snapshot.py SQLite '
+                             'file instead of the database')
+    args = parser.parse_args()
+
+    if args.snapshot:
+        pretalx_db.use_snapshot(args.snapshot)
+    abstracts = fetch_abstracts()
+
+    themes, spares = split_spares(abstracts, THEMES)
+    balance(themes, spares, targets=dict(args.target), exact=args.exact)
+    if args.summary:
+        for theme_id, pks in themes.items():
+            print(f'{THEMES[theme_id]}: {len(pks)}', file=sys.stderr)
+        print(f'Total: {sum(len(pks) for pks in themes.values())} abstracts '
+              f'({len(spares)} with more than one theme)', file=sys.stderr)
+    print_themes(themes, abstracts, args.format)
@@ -0,0 +1,290 @@
+"""
+Benchmark the schedule pipeline (see schedule_pipeline.py) on fake
+conferences of increasing size (see fake_pretalx.py) and report the wall time
+and peak RSS of each stage:
+
+    generate                      fake_pretalx.generate()
+    load program                  pretalx_model.Program.load() (SQLite)
+    fix titles and authors        fix_titles_authors.py
+    fix calendars                 fix_calendars.py
+    fix calendars (again)           ... with nothing left to do
+    remove rooms from calendars   remove_room_from_cals.py
+    populate PDF/MP4 paths        populate_pdf_video_paths.py
+    populate PDF/MP4 paths (again)  ... with nothing left to do
+
+Stages run in this order on the same tree, like in the pipeline, each in a
+fresh process so that its peak RSS is its own. The peak RSS includes the
+setup of the stage (e.g. the program for the populate stages) and, for the
+stages using worker processes, the largest worker is reported separately.
+
+With --output the results are saved as JSON; with --baseline (a previous
+--output) every stage that got slower or bigger than --tolerance is reported
+and the exit status is 1.
+
+Usage:
+    benchmark.py --sizes 100 1000 5000 --output bench.json
+    benchmark.py --sizes 100 1000 5000 --baseline bench.json
+"""
+import argparse
+from functools import partial
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import types
+
+import fake_pretalx
+import fix_calendars
+import fix_titles_authors
+import pretalx_db
+import pretalx_model
+import remove_room_from_cals
+import schedule_pipeline
+
+
+log = logging.getLogger(__name__)
+
+SIZES = (100, 1000, 5000)
+TOLERANCE = 0.25
+# Differences below these are just noise
+MIN_SECONDS = 0.05
+MIN_RSS_MB = 5
+# fix_titles_authors.py reads the SVGs from the current directory
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# Stages: setup(conf) does whatever is not measured and returns what is.
+def _paths(conf):
+    return fake_pretalx.output_paths(conf['out'])
+
+
+def _program(conf):
+    pretalx_db.use_snapshot(str(_paths(conf)['sqlite']))
+    return pretalx_model.Program.load()
+
+
+def setup_generate(conf):
+    return partial(fake_pretalx.generate, conf['out'], conf['talks'],
+                   conf['rooms'], conf['days'], conf['seed'], conf['event'])
+
+
+def setup_load_program(conf):
+    return partial(_program, conf)
+
+
+def setup_fix_titles(conf):
+    program = _program(conf)
+    return partial(schedule_pipeline.fix_titles, program,
+                   str(_paths(conf)['html']), conf['event'], conf['engine'])
+
+
+def setup_fix_calendars(conf):
+    return partial(fix_calendars.fix_calendars, str(_paths(conf)['html']),
+                   conf['event'],
+                   state_path=os.path.join(conf['out'], 'calendars.json'),
+                   jobs=conf['jobs'], rebuild=conf['rebuild_ics'])
+
+
+def setup_remove_rooms(conf):
+    cal_files = glob.glob(os.path.join(_paths(conf)['html'], conf['event'],
+                                       'schedule', 'export', 'schedule.*'))
+    return partial(remove_room_from_cals.process, cal_files,
+                   rooms=schedule_pipeline.ROOMS_TO_REMOVE)
+
+
+def setup_populate(conf, force):
+    program = _program(conf)
+    args = types.SimpleNamespace(
+        ftp_root=str(_paths(conf)['ftp']),
+        media_url_root=conf['media_url_root'],
+        manifest=os.path.join(conf['out'], 'manifest.json'),
+        force=force,
+        jobs=conf['jobs'],
+    )
+
+    def run():
+        # The fake DB already has the paths: no UPDATE, so SQLite is enough.
+        with pretalx_db.connection() as conn:
+            schedule_pipeline.populate_media(conn, program,
+                                             str(_paths(conf)['html']),
+                                             conf['event'], args)
+    return run
+
+
+STAGES = {
+    'generate': setup_generate,
+    'load program': setup_load_program,
+    'fix titles and authors': setup_fix_titles,
+    'fix calendars': setup_fix_calendars,
+    'fix calendars (again)': setup_fix_calendars,
+    'remove rooms from calendars': setup_remove_rooms,
+    'populate PDF/MP4 paths': partial(setup_populate, force=True),
+    'populate PDF/MP4 paths (again)': partial(setup_populate, force=False),
+}
+
+
+def _max_rss_mb(who):
+    rss = resource.getrusage(who).ru_maxrss
+    # kB on Linux, bytes on macOS
+    if sys.platform == 'darwin':
+        rss /= 1024
+    return rss / 1024
+
+
+def _stage_process(name, conf, pipe):
+    os.chdir(TOOLS_DIR)
+    # The populate stages log every page they touch.
+    logging.disable(logging.WARNING)
+    try:
+        run = STAGES[name](conf)
+        tick = time.perf_counter()
+        run()
+        pipe.send({
+            'seconds': time.perf_counter() - tick,
+            'rss_mb': _max_rss_mb(resource.RUSAGE_SELF),
+            'workers_rss_mb': _max_rss_mb(resource.RUSAGE_CHILDREN),
+        })
+    except BaseException as e:
+        pipe.send({'error': f'{type(e).__name__}: {e}'})
+        raise
+
+
+def run_stage(name, conf):
+    """Run the stage `name` in a new process and return its measurements."""
+    ctx = multiprocessing.get_context('spawn')
+    parent, child = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_stage_process, args=(name, conf, child))
+    proc.start()
+    child.close()
+    try:
+        result = parent.recv()
+    except EOFError:
+        result = {'error': f'exit status {proc.exitcode}'}
+    proc.join()
+    if 'error' in result:
+        raise RuntimeError(f'{name}: {result["error"]}')
+    return result
+
+
+def benchmark(sizes=SIZES, rooms=1, days=5, seed=0, engine='bs4', jobs=None,
+              rebuild_ics=False, workdir=None, keep=False):
+    """Return one dict per (size, stage) with its measurements."""
+    results = []
+    for size in sizes:
+        out = tempfile.mkdtemp(prefix=f'bench_{size}_', dir=workdir)
+        conf = {
+            'out': out,
+            'talks': size,
+            'rooms': rooms,
+            'days': days,
+            'seed': seed,
+            'event': fake_pretalx.EVENT,
+            'engine': engine,
+            'jobs': jobs or os.cpu_count(),
+            'rebuild_ics': rebuild_ics,
+            'media_url_root':
+                schedule_pipeline.populate_pdf_video_paths.MEDIA_URL_ROOT,
+        }
+        try:
+            for name in STAGES:
+                result = dict(talks=size, stage=name, **run_stage(name, conf))
+                log.info(f'{size:>7} {name:32} {result["seconds"]:8.3f}s '
+                         f'{result["rss_mb"]:8.1f} MB')
+                results.append(result)
+        finally:
+            if keep:
+                log.info(f'kept {out}')
+            else:
+                shutil.rmtree(out)
+    return results
+
+
+def regressions(results, baseline, tolerance=TOLERANCE):
+    """Human readable list of the results worse than `baseline`."""
+    old = {(r['talks'], r['stage']): r for r in baseline}
+    problems = []
+    for r in results:
+        b = old.get((r['talks'], r['stage']))
+        if b is None:
+            continue
+        for key, unit, floor in (('seconds', 's', MIN_SECONDS),
+                                 ('rss_mb', ' MB', MIN_RSS_MB),
+                                 ('workers_rss_mb', ' MB', MIN_RSS_MB)):
+            if r[key] > b[key] * (1 + tolerance) and r[key] - b[key] > floor:
+                problems.append(
+                    f'{r["talks"]} talks, {r["stage"]}: {key} '
+                    f'{b[key]:.3f}{unit} -> {r[key]:.3f}{unit}'
+                )
+    return problems
+
+
+def print_results(results, out=sys.stdout):
+    print(f'{"talks":>7} {"stage":32} {"seconds":>9} {"RSS MB":>9} '
+          f'{"workers MB":>10}', file=out)
+    for r in results:
+        print(f'{r["talks"]:>7} {r["stage"]:32} {r["seconds"]:9.3f} '
+              f'{r["rss_mb"]:9.1f} {r["workers_rss_mb"]:10.1f}', file=out)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES,
+                        help='numbers of talks')
+    parser.add_argument('--rooms', type=int, default=1)
+    parser.add_argument('--days', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--engine', type=str, default='bs4',
+                        choices=list(fix_titles_authors.ENGINES),
+                        help='HTML engine used to fix titles and authors')
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count(),
+                        help='worker processes of the parallel stages')
+    parser.add_argument('--rebuild-ics', action='store_true',
+                        help='also rebuild schedule.ics (needs '
+                             'schedule_convert)')
+    parser.add_argument('--workdir', type=str,
+                        help='where to generate the conferences '
+                             '[default: system temp dir]')
+    parser.add_argument('--keep', action='store_true',
+                        help='do not delete the conferences at the end')
+    parser.add_argument('--output', '-o', type=str,
+                        help='save the results to this JSON file')
+    parser.add_argument('--baseline', type=str,
+                        help='compare with these (--output) results')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help='relative slowdown/growth that is a regression')
+    args = parser.parse_args()
+
+    results = benchmark(args.sizes, args.rooms, args.days, args.seed,
+                        args.engine, args.jobs, args.rebuild_ics,
+                        args.workdir, args.keep)
+    print_results(results)
+
+    if args.output:
+        report = {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'args': {k: v for k, v in vars(args).items()
+                     if k not in ('output', 'baseline')},
+            'results': results,
+        }
+        tmp_path = f'{args.output}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(report, f, indent=1)
+        os.replace(tmp_path, args.output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems = regressions(results, json.load(f)['results'],
+                                   args.tolerance)
+        for problem in problems:
+            print(f'REGRESSION {problem}', file=sys.stderr)
+        sys.exit(1 if problems else 0)
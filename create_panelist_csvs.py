@@ -1,49 +1,92 @@
 """
 For each day and time slot create a CSV of all panelists for that slot.
+
+The sessions (name -> start, end, in the given timezone) are read from a JSON
+file (panelist_sessions.json by default):
+
+    {
+      "timezone": "Europe/Madrid",
+      "sessions": {
+        "Sunday-morning": ["2020-11-08T05:50", "2020-11-08T09:30"],
+        ...
+      }
+    }
+
+All talks of the latest schedule, in all rooms, are fetched together with
+their main author in one query and every CSV is written in one go.
 """
+import argparse
+from bisect import bisect_right
+from collections import defaultdict
 import csv
-from datetime import datetime
+from datetime import datetime, timezone
+import json
 import os
-import psycopg2
-
-
-# Just the start times
-DAYS = {
-    'Sunday-morning': (datetime(2020, 11, 8, 5, 50),
-                       datetime(2020, 11, 8, 9, 30)),
-    'Sunday-afternoon': (datetime(2020, 11, 8, 10, 40),
-                         datetime(2020, 11, 8, 14, 45)),
-    'Sunday-evening': (datetime(2020, 11, 8, 16, 40),
-                       datetime(2020, 11, 8, 20, 30)),
-
-    'Monday-morning': (datetime(2020, 11, 9, 5, 50),
-                       datetime(2020, 11, 9, 9, 30)),
-    'Monday-afternoon': (datetime(2020, 11, 9, 10, 40),
-                         datetime(2020, 11, 9, 14, 45)),
-    'Monday-evening': (datetime(2020, 11, 9, 16, 40),
-                       datetime(2020, 11, 9, 20, 30)),
-
-    'Tuesday-morning': (datetime(2020, 11, 10, 5, 50),
-                        datetime(2020, 11, 10, 9, 30)),
-    'Tuesday-afternoon': (datetime(2020, 11, 10, 10, 40),
-                          datetime(2020, 11, 10, 14, 45)),
-    'Tuesday-evening': (datetime(2020, 11, 10, 16, 40),
-                        datetime(2020, 11, 10, 20, 30)),
-
-    'Wednesday-morning': (datetime(2020, 11, 11, 5, 50),
-                          datetime(2020, 11, 11, 9, 30)),
-    'Wednesday-afternoon': (datetime(2020, 11, 11, 10, 40),
-                            datetime(2020, 11, 11, 14, 45)),
-    'Wednesday-evening': (datetime(2020, 11, 11, 16, 20),
-                          datetime(2020, 11, 11, 21, 30)),
-
-    'Thursday-morning': (datetime(2020, 11, 12, 5, 50),
-                         datetime(2020, 11, 12, 9, 30)),
-    'Thursday-afternoon': (datetime(2020, 11, 12, 10, 40),
-                           datetime(2020, 11, 12, 14, 45)),
-    'Thursday-evening': (datetime(2020, 11, 12, 16, 40),
-                         datetime(2020, 11, 12, 20, 30)),
-}
+from zoneinfo import ZoneInfo
+
+import pretalx_db
+
+
+SESSIONS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'panelist_sessions.json')
+
+# All the slots of the latest schedule version, excluding breaks.
+SQL = '''
+select
+    t.start,
+    r.name,
+    u.email,
+    u.name
+from
+    schedule_talkslot t
+    join submission_submission s on t.submission_id = s.id
+    join person_user u on s.main_author_id = u.id
+    left join schedule_room r on t.room_id = r.id
+where
+    t.schedule_id = (select max(schedule_id) from schedule_talkslot) and
+    t.is_visible = true and
+    t.description is null
+order by t.start, t.room_id'''
+
+
+class Sessions:
+    """Sorted, non overlapping sessions, searchable by time."""
+    def __init__(self, sessions, tz):
+        self.tz = tz
+        self.names = []
+        self.starts = []
+        self.ends = []
+        for name, (start, end) in sorted(sessions.items(),
+                                         key=lambda item: item[1][0]):
+            if self.ends and start <= self.ends[-1]:
+                raise Exception(f'Session {name} overlaps with '
+                                f'{self.names[-1]}')
+            self.names.append(name)
+            self.starts.append(start)
+            self.ends.append(end)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            config = json.load(f)
+        tz = ZoneInfo(config['timezone'])
+        sessions = {
+            name: tuple(datetime.fromisoformat(t).replace(tzinfo=tz)
+                        for t in times)
+            for name, times in config['sessions'].items()
+        }
+        return cls(sessions, tz)
+
+    def find(self, start):
+        """Return the name of the session `start` is in, or None."""
+        if start.tzinfo is None:
+            # The database times are UTC
+            start = start.replace(tzinfo=timezone.utc)
+        start = start.astimezone(self.tz)
+        i = bisect_right(self.starts, start) - 1
+        if i < 0 or start > self.ends[i]:
+            return None
+        return self.names[i]
 
 
 def write_csv(root_name, authors):
@@ -58,71 +101,44 @@ def write_csv(root_name, authors):
             writer.writerow(row)
 
 
-def find_authors(talk_ids, conn):
-    print(f'finding authors for {talk_ids}')
-    cur = conn.cursor()
-    cur.execute('''
-select
-    u.email,
-    u.name
-from
-    person_user u,
-    submission_submission s
-where
-    s.id in ({}) and
-    s.main_author_id=u.id'''.format(','.join(str(i) for i in talk_ids)))
-    return cur.fetchall()
-
-
-def _fetch_n_fix_record(cur):
-    start, talk_id = next(cur)
-    # there is a problem with the pretalx database: its times should be
-    # UTC but they actually have a 1 our shift!
-    start = datetime(
-        start.year,
-        start.month,
-        start.day,
-        hour=start.hour + 1,
-        minute=start.minute
-    )
-    return start, talk_id
+def group_panelists(rows, sessions, by_room=False):
+    """
+    Return CSV name -> [(email, name), ...] for all sessions (and rooms)
+    out of the (start, room, email, name) rows of SQL.
+    """
+    panelists = defaultdict(list)
+    for start, room, email, name in rows:
+        session = sessions.find(start)
+        if session is None:
+            print(f'{start} ({room}) is not in any session: skipped')
+            continue
+        key = f'{session}-{room}' if by_room else session
+        panelists[key].append((email, name))
+    if not by_room:
+        # Empty sessions get an empty CSV, as they always did.
+        for session in sessions.names:
+            panelists.setdefault(session, [])
+    return panelists
 
 
 if __name__ == '__main__':
-    conn = psycopg2.connect(database="pretalx",
-                            user="pretalx",
-                            password="",
-                            host="localhost",
-                            port="5432")
-    cur = conn.cursor()
-
-    # Step 1: find all the slots of the latest schedule version, excluding
-    # breaks.
-    cur.execute('''
-select
-    start, submission_id
-from
-    schedule_talkslot
-where
-    room_id = 1 and
-    schedule_id = (select max(schedule_id) from schedule_talkslot) and
-    is_visible = true and
-    description is null
-order by start''')
-
-    # Dictionaries are insertion-ordered in python 3.6+ :-)
-    talk_ids = []
-    start, talk_id = _fetch_n_fix_record(cur)
-    for slot_name, (slot_start, slot_end) in DAYS.items():
-        while slot_start <= start <= slot_end:
-            # Still in this slot
-            print(f'{start} between {slot_start} and {slot_end}')
-            talk_ids.append(talk_id)
-            try:
-                start, talk_id = _fetch_n_fix_record(cur)
-            except StopIteration:
-                break
-
-        # Next time slot: close the current one and reset talk_ids
-        write_csv(slot_name, find_authors(talk_ids, conn))
-        talk_ids = []
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sessions', type=str, default=SESSIONS_PATH,
+                        help='JSON file with the sessions '
+                             f'[{os.path.basename(SESSIONS_PATH)}]')
+    parser.add_argument('--by-room', action='store_true',
+                        help='one CSV per session and room')
+    parser.add_argument('--snapshot', type=str, metavar='PATH',
+                        help='read from this pretalx_snapshot.py SQLite '
+                             'file instead of the database')
+    args = parser.parse_args()
+    if args.snapshot:
+        pretalx_db.use_snapshot(args.snapshot)
+
+    sessions = Sessions.load(args.sessions)
+
+    rows = pretalx_db.query(SQL)
+
+    panelists = group_panelists(rows, sessions, args.by_room)
+    for name, authors in panelists.items():
+        write_csv(name, authors)
@@ -0,0 +1,86 @@
+"""
+Send all the emails spooled by email_groups.py --spool.
+
+Usage:
+    % deliver_spool.py /path/to/spool
+
+The spool is drained as emails get delivered, so it can simply be run again
+after an interruption: it will only send what is left. Each email is also
+logged in the email_groups.py journal: emails already sent (e.g. spooled
+twice) are dropped from the spool without sending them again.
+"""
+import argparse
+import sys
+from email import message_from_bytes, policy
+
+from email_groups import (CAMPAIGN_HEADER, JOURNAL_PATH, SENDING, SENT,
+                          SMTP_CONNECTIONS, SendJournal, open_spool,
+                          recipient_key, send_all)
+
+
+def drain(spool, journal, connections=SMTP_CONNECTIONS, delay=0.,
+          resend_uncertain=False):
+    mbox = open_spool(spool)
+    mbox.lock()
+    try:
+        statuses = {}
+        jobs = []
+        # Iterate over a copy of the keys: we discard messages as we go and
+        # mailbox.mbox does not allow that while iterating over it.
+        for key in list(mbox.keys()):
+            raw = mbox.get_bytes(key)
+            message = message_from_bytes(raw, policy=policy.SMTP)
+            campaign = message[CAMPAIGN_HEADER]
+            if campaign not in statuses:
+                statuses[campaign] = journal.statuses(campaign)
+            status = statuses[campaign].get(recipient_key(message))
+            if status == SENT:
+                print(f'{message["To"]}: already sent: DROPPED',
+                      file=sys.stderr)
+                mbox.discard(key)
+                continue
+            if status == SENDING and not resend_uncertain:
+                print(f'{message["To"]}: might have been sent already in an '
+                      'interrupted run: SKIPPED', file=sys.stderr)
+                continue
+
+            del message[CAMPAIGN_HEADER]
+            jobs.append((campaign, message, key))
+
+        for key, error in send_all(jobs, connections=connections,
+                                   delay=delay, journal=journal):
+            if error is not None:
+                print(f'{key}: NOT SENT: {error}', file=sys.stderr)
+                continue
+            mbox.discard(key)
+    finally:
+        mbox.flush()
+        mbox.unlock()
+        mbox.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('spool', metavar='SPOOL', nargs=1,
+                        help='Maildir (or .mbox) written by email_groups.py')
+    parser.add_argument('--journal', '-J', required=False, type=str,
+                        default=JOURNAL_PATH,
+                        help=f'journal of sent emails [{JOURNAL_PATH}]')
+    parser.add_argument('--resend-uncertain', action='store_true',
+                        help='also resend the emails of an interrupted run '
+                             'that might or might not have been delivered')
+    parser.add_argument('--connections', '-n', type=int,
+                        default=SMTP_CONNECTIONS,
+                        help='number of parallel SMTP connections '
+                             f'[defaults to {SMTP_CONNECTIONS}]')
+    parser.add_argument('--delay', type=float, default=0.,
+                        help='initial delay between emails in seconds; it '
+                             'adapts to the server replies [defaults to 0]')
+    args = parser.parse_args()
+
+    journal = SendJournal(args.journal)
+    try:
+        drain(args.spool[0], journal, connections=args.connections,
+              delay=args.delay, resend_uncertain=args.resend_uncertain)
+    finally:
+        journal.close()
@@ -12,42 +12,186 @@ To specify more than one group, simply repeat -g GROUP
 Two groups deserve special mention: all and attendee.
 
 all means everybody
-attendee = all - (speaker + trainer + admin + loc + poc _ volunteer)
+attendee = all - (speaker + trainer + posterauth + admin + loc + poc +
+                  volunteer)
 
 The special group all is the only one that cannot be used in conjuction with
 any other group (to avoid easy mistakes).
 
-Special care is taken to avoid sending duplicate emails.
+More complex audiences can be selected with an expression instead, e.g.
+
+    % email_groups.py -x 'speaker & !trainer | (loc & volunteer)' REG_CSV
+
+where ! (not) binds tighter than & (and), which binds tighter than | (or).
+
+Special care is taken to avoid sending duplicate emails: every email sent is
+logged in a journal (sent_emails.sqlite) under its campaign (by default, the
+email subject). Running the same command again only emails the people that
+did not get it yet, which also resumes interrupted runs.
 """
 import argparse
+from concurrent.futures import (ProcessPoolExecutor, ThreadPoolExecutor,
+                                as_completed)
+from contextlib import contextmanager
 import csv
 from email.message import EmailMessage
+from email.utils import parseaddr
+from functools import partial
+import mailbox
 import os
+import queue
 import smtplib
+import sqlite3
 import sys
+import threading
 import time
 
 
-def isattendee(record, operator=all):
-    keys = ('isspeaker', 'istrainer', 'isposterauth', 'isadmin', 'isloc',
-            'ispoc', 'isvolunteer')
-    return operator(record[key].lower() == 'false' for key in keys)
-
-
-# The values of GROUPS are function that operate on a single element. They are
-# ANDed together in a call to filter(fn, records) where records: List[record]
-# and record is a dict containing a single row of the input CSV.
-GROUPS = {
-    'speaker': lambda rec: rec['isspeaker'].lower() == 'true',
-    'trainer': lambda rec: rec['istrainer'].lower() == 'true',
-    'posterauth': lambda rec: rec['isposterauth'].lower() == 'true',
-    'admin': lambda rec: rec['isadmin'].lower() == 'true',
-    'loc': lambda rec: rec['isloc'].lower() == 'true',
-    'poc': lambda rec: rec['ispoc'].lower() == 'true',
-    'volunteer': lambda rec: rec['isvolunteer'].lower() == 'true',
-    'attendee': isattendee,
-    'all': lambda rec: True
+# Group name -> registration CSV column. Each column is loaded once as a
+# bitmap (a Python int, one bit per CSV row): selecting people is then just a
+# few bitwise operations on those.
+ROLES = {
+    'speaker': 'isspeaker',
+    'trainer': 'istrainer',
+    'posterauth': 'isposterauth',
+    'admin': 'isadmin',
+    'loc': 'isloc',
+    'poc': 'ispoc',
+    'volunteer': 'isvolunteer',
 }
+GROUPS = list(ROLES) + ['attendee', 'all']
+
+
+class Registrations:
+    """The registration CSV records plus one bitmap per group."""
+    def __init__(self, records):
+        self.records = records
+        self.bitmaps = {
+            group: self._bitmap(column) for group, column in ROLES.items()
+        }
+        everybody = (1 << len(records)) - 1
+        # Attendees have all the role columns explicitly set to 'false'
+        # (blank cells do not count).
+        attendee = everybody
+        for column in ROLES.values():
+            attendee &= self._bitmap(column, 'false')
+        self.bitmaps['all'] = everybody
+        self.bitmaps['attendee'] = attendee
+
+    @classmethod
+    def load(cls, regfile):
+        with open(regfile) as f:
+            return cls(list(csv.DictReader(f)))
+
+    def _bitmap(self, column, value='true'):
+        # Bit i is record i: build the binary representation from the end.
+        digits = ''.join('1' if rec[column].lower() == value else '0'
+                         for rec in reversed(self.records))
+        return int(digits or '0', 2)
+
+    def select(self, expression):
+        """
+        Lazily yield the records matching `expression` (a string or a compiled
+        expression), skipping duplicated emails.
+        """
+        if isinstance(expression, str):
+            expression = compile_selection(expression)
+        mask = expression(self.bitmaps)
+        emails = set()
+        for i, bit in enumerate(reversed(bin(mask)[2:])):
+            if bit != '1':
+                continue
+            record = self.records[i]
+            key = email_key(record)
+            if key not in emails:
+                emails.add(key)
+                yield record
+
+
+def _tokenize(expression):
+    tokens = []
+    i = 0
+    while i < len(expression):
+        c = expression[i]
+        if c.isspace():
+            i += 1
+        elif c in '&|!()':
+            tokens.append(c)
+            i += 1
+        elif c.isalpha():
+            j = i
+            while j < len(expression) and expression[j].isalnum():
+                j += 1
+            tokens.append(expression[i:j])
+            i = j
+        else:
+            raise ValueError(f'Unexpected {c!r} at position {i}')
+    return tokens
+
+
+def compile_selection(expression):
+    """
+    Compile a selection expression like `speaker & !trainer | (loc &
+    volunteer)` into a function of the group bitmaps returning the bitmap of
+    the selected records.
+
+    Grammar (usual precedence: ! over & over |):
+        expr   := term ('|' term)*
+        term   := factor ('&' factor)*
+        factor := '!' factor | '(' expr ')' | GROUP
+    """
+    tokens = _tokenize(expression)
+    pos = 0
+
+    def peek():
+        return tokens[pos] if pos < len(tokens) else None
+
+    def take(expected=None):
+        nonlocal pos
+        token = peek()
+        if token is None or (expected and token != expected):
+            raise ValueError(f'Expected {expected or "a group"} in '
+                             f'{expression!r}')
+        pos += 1
+        return token
+
+    def parse_expr():
+        fn = parse_term()
+        while peek() == '|':
+            take('|')
+            fn = (lambda lhs, rhs: lambda bm: lhs(bm) | rhs(bm))(
+                fn, parse_term())
+        return fn
+
+    def parse_term():
+        fn = parse_factor()
+        while peek() == '&':
+            take('&')
+            fn = (lambda lhs, rhs: lambda bm: lhs(bm) & rhs(bm))(
+                fn, parse_factor())
+        return fn
+
+    def parse_factor():
+        token = take()
+        if token == '!':
+            fn = parse_factor()
+            # Restrict the complement to the actual records.
+            return lambda bm: bm['all'] & ~fn(bm)
+        if token == '(':
+            fn = parse_expr()
+            take(')')
+            return fn
+        if token not in GROUPS:
+            raise ValueError(f'Unknown group {token!r}: use one of '
+                             f'{", ".join(GROUPS)}')
+        return lambda bm: bm[token]
+
+    fn = parse_expr()
+    if peek() is not None:
+        raise ValueError(f'Unexpected {peek()!r} in {expression!r}')
+    return fn
+
+
 # Email
 EMAIL_SUBJECT = 'ADASS 2020 Registration Information'
 EMAIL_REPLY_TO = 'ADASS LOC <adass2020@iram.es>'
@@ -87,53 +231,379 @@ contact the LOC (adass2020@iram.es) ;-)
 Thanks and see you soon!
 The ADASS 2020 LOC
 '''
-SMTP_HOST = os.environ['SMTP_HOST']
-SMTP_PORT = os.environ['SMTP_PORT']
-SMTP_USER = os.environ['SMTP_USER']
-SMTP_PASSWD = os.environ['SMTP_PASSWD']
+# Only needed to actually send emails (i.e. not for dry runs and spooling)
+SMTP_HOST = os.environ.get('SMTP_HOST')
+SMTP_PORT = os.environ.get('SMTP_PORT')
+SMTP_USER = os.environ.get('SMTP_USER')
+SMTP_PASSWD = os.environ.get('SMTP_PASSWD')
+
+
+SMTP_CONNECTIONS = 4           # size of the SMTP connection pool
+SMTP_RETRIES = 5               # attempts per message
+SMTP_TIMEOUT = 60
+
+# Journal of all the emails sent so far
+JOURNAL_PATH = 'sent_emails.sqlite'
+SENDING = 'sending'            # handed to the SMTP server, no answer yet
+SENT = 'sent'                  # accepted by the SMTP server
+SPOOLED = 'spooled'            # waiting in a spool (see deliver_spool.py)
+FAILED = 'failed'              # refused by the SMTP server
+
+# Campaign of the spooled messages (removed when they are delivered)
+CAMPAIGN_HEADER = 'X-ADASS-Campaign'
+
+
+def email_key(rec):
+    return rec['email'].strip().lower()
+
+
+class SendJournal:
+    """
+    Append-only journal (SQLite) of the emails sent for each campaign, keyed by
+    (campaign, email). Each message is logged as SENDING right before handing
+    it to the SMTP server and as SENT (or FAILED) as soon as we have the server
+    answer. Every entry is committed right away, so that an interrupted run can
+    be resumed without sending anything twice: a message left in the SENDING
+    state might or might not have been delivered.
+    """
+    def __init__(self, path=JOURNAL_PATH):
+        self.db = sqlite3.connect(path, check_same_thread=False,
+                                  isolation_level=None)
+        self.db.execute('PRAGMA journal_mode = WAL')
+        self.db.execute('PRAGMA synchronous = FULL')
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS journal (
+                campaign TEXT NOT NULL,
+                email TEXT NOT NULL,
+                status TEXT NOT NULL,
+                timestamp TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )''')
+        self.db.execute('''
+            CREATE INDEX IF NOT EXISTS journal_campaign_email
+            ON journal (campaign, email)''')
+        self.lock = threading.Lock()
+
+    def statuses(self, campaign):
+        """Return the email -> latest status dict for `campaign`."""
+        cur = self.db.execute(
+            'SELECT email, status FROM journal WHERE campaign = ? '
+            'ORDER BY rowid', (campaign, )
+        )
+        return dict(cur.fetchall())
+
+    def log(self, campaign, email, status):
+        with self.lock:
+            self.db.execute(
+                'INSERT INTO journal (campaign, email, status) '
+                'VALUES (?, ?, ?)', (campaign, email, status)
+            )
+
+    def log_many(self, campaign, emails, status):
+        """Log the same `status` for all `emails` in a single transaction."""
+        with self.lock:
+            self.db.execute('BEGIN')
+            self.db.executemany(
+                'INSERT INTO journal (campaign, email, status) '
+                'VALUES (?, ?, ?)',
+                ((campaign, email, status) for email in emails)
+            )
+            self.db.execute('COMMIT')
+
+    def close(self):
+        self.db.close()
+
+
+class SMTPPool:
+    """
+    A small, thread-safe pool of authenticated SMTP_SSL connections. Broken
+    connections are dropped and replaced by new ones on demand.
+    """
+    def __init__(self, host, port, user, passwd, size=SMTP_CONNECTIONS):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.passwd = passwd
+        self.idle = queue.LifoQueue(maxsize=size)
+
+    def _connect(self):
+        s = smtplib.SMTP_SSL(self.host, self.port, timeout=SMTP_TIMEOUT)
+        s.login(self.user, self.passwd)
+        return s
+
+    @contextmanager
+    def connection(self):
+        try:
+            s = self.idle.get_nowait()
+        except queue.Empty:
+            s = self._connect()
+        try:
+            yield s
+        except smtplib.SMTPServerDisconnected:
+            # Do not put it back: the next user will open a new one.
+            _quit(s)
+            raise
+        except smtplib.SMTPException:
+            # The server refused the message but the connection is fine.
+            self.idle.put(s)
+            raise
+        except OSError:
+            _quit(s)
+            raise
+        self.idle.put(s)
+
+    def close(self):
+        while True:
+            try:
+                _quit(self.idle.get_nowait())
+            except queue.Empty:
+                break
+
+
+def _quit(s):
+    try:
+        s.quit()
+    except (smtplib.SMTPException, OSError):
+        s.close()
+
+
+class Throttle:
+    """
+    Adaptive delay between messages: it doubles every time the server answers
+    with a temporary (4xx) error or drops the connection and halves after each
+    success.
+    """
+    def __init__(self, delay=0., min_delay=0., max_delay=60.):
+        self.delay = delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self.next_time = time.monotonic()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            t = max(now, self.next_time)
+            self.next_time = t + self.delay
+        if t > now:
+            time.sleep(t - now)
+
+    def success(self):
+        with self.lock:
+            self.delay = max(self.min_delay, self.delay / 2)
+            if self.delay < .01:
+                self.delay = self.min_delay
+
+    def backoff(self):
+        with self.lock:
+            self.delay = min(self.max_delay, max(self.delay * 2, .5))
+
+
+def _smtp_code(exc):
+    """Return the SMTP reply code of `exc`, if any."""
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        return min(code for code, _ in exc.recipients.values())
+    return getattr(exc, 'smtp_code', None)
+
+
+def make_message(rec, subject=EMAIL_SUBJECT, body=EMAIL_BODTY,
+                 sender=EMAIL_FROM, replyto=EMAIL_REPLY_TO):
+    message = EmailMessage()
+    message.set_content(body.format(name=rec['name'],
+                                    reg_code=rec['ticket_id']))
+    message['Subject'] = subject
+    message['From'] = sender
+    message['Reply-To'] = replyto
+    message['To'] = f'{rec["name"]} <{rec["email"]}>'
+    return message
+
+
+def recipient_key(message):
+    return parseaddr(message['To'])[1].strip().lower()
+
+
+def deliver(message, pool, throttle, retries=SMTP_RETRIES):
+    """
+    Send `message` through one of the `pool` connections, retrying on
+    dropped connections and temporary errors. Raise the last error if the
+    message could not be delivered.
+    """
+    for attempt in range(retries):
+        throttle.wait()
+        try:
+            with pool.connection() as s:
+                s.send_message(message)
+        except smtplib.SMTPServerDisconnected as e:
+            throttle.backoff()
+            error = e
+        except smtplib.SMTPException as e:
+            code = _smtp_code(e)
+            if code is None or not 400 <= code < 500:
+                # Permanent failure: no point in retrying.
+                raise
+            throttle.backoff()
+            error = e
+        except OSError as e:
+            # Network errors (note that SMTPException is an OSError too)
+            throttle.backoff()
+            error = e
+        else:
+            throttle.success()
+            return
+        print(f'{message["To"]}: attempt {attempt + 1} failed: {error}',
+              file=sys.stderr)
+    raise error
+
+
+def send_all(jobs, host=SMTP_HOST, port=SMTP_PORT, user=SMTP_USER,
+             passwd=SMTP_PASSWD, connections=SMTP_CONNECTIONS, delay=0.,
+             journal=None):
+    """
+    Deliver the (campaign, message, tag) `jobs` and yield (tag, error) as soon
+    as each message has been accepted by the server (error is None) or given
+    up on. If given, every message is logged in `journal` under its campaign.
+    """
+    if not all((host, port, user, passwd)):
+        raise RuntimeError('Please define SMTP_HOST, SMTP_PORT, SMTP_USER '
+                           'and SMTP_PASSWD in the environment')
+
+    pool = SMTPPool(host, port, user, passwd, size=connections)
+    throttle = Throttle(delay)
+
+    def send_one(campaign, message):
+        if journal is None:
+            return deliver(message, pool, throttle)
+
+        key = recipient_key(message)
+        journal.log(campaign, key, SENDING)
+        try:
+            deliver(message, pool, throttle)
+        except (smtplib.SMTPException, OSError):
+            journal.log(campaign, key, FAILED)
+            raise
+        journal.log(campaign, key, SENT)
+
+    sent = failed = 0
+    tick = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=connections) as executor:
+            futures = {executor.submit(send_one, campaign, message): tag
+                       for campaign, message, tag in jobs}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except (smtplib.SMTPException, OSError) as e:
+                    failed += 1
+                    yield futures[future], e
+                    continue
+                sent += 1
+                yield futures[future], None
+    finally:
+        pool.close()
+
+    dt = time.perf_counter() - tick
+    print(f'{sent} emails sent, {failed} failed in {dt:.1f}s '
+          f'({sent / max(dt, 1e-6):.1f} emails/s)', file=sys.stderr)
+
+
+def _render(rec, subject, body, sender, replyto, campaign):
+    message = make_message(rec, subject, body, sender, replyto)
+    message[CAMPAIGN_HEADER] = campaign
+    return message.as_bytes()
+
+
+def spool_email(spool, subject=EMAIL_SUBJECT, body=EMAIL_BODTY,
+                sender=EMAIL_FROM, replyto=EMAIL_REPLY_TO, records=None,
+                journal=None, campaign=None, jobs=None):
+    """
+    Render the email to all `records`, in parallel, into the `spool` mailbox
+    (see open_spool) instead of sending it. deliver_spool.py will then send
+    them. Write the spooled records to STDOUT, as CSV.
+    """
+    if not records:
+        return
+
+    tick = time.perf_counter()
+    render = partial(_render, subject=subject, body=body, sender=sender,
+                     replyto=replyto, campaign=campaign)
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        chunksize = max(1, len(records) // (4 * (jobs or os.cpu_count())))
+        messages = list(executor.map(render, records, chunksize=chunksize))
+
+    writer = csv.DictWriter(sys.stdout, fieldnames=records[0].keys())
+    writer.writeheader()
+    mbox = open_spool(spool)
+    mbox.lock()
+    try:
+        for message in messages:
+            mbox.add(message)
+        mbox.flush()
+    finally:
+        mbox.unlock()
+        mbox.close()
+
+    # Spool first, log later: if we crash in between, duplicates in the spool
+    # are harmless since deliver_spool.py checks the journal before sending.
+    if journal is not None:
+        journal.log_many(campaign, (email_key(rec) for rec in records),
+                         SPOOLED)
+    writer.writerows(records)
+
+    dt = time.perf_counter() - tick
+    print(f'{len(records)} emails spooled to {spool} in {dt:.1f}s',
+          file=sys.stderr)
+
+
+def open_spool(path):
+    """A Maildir, unless `path` ends with .mbox."""
+    if path.endswith('.mbox'):
+        return mailbox.mbox(path, create=True)
+    return mailbox.Maildir(path, create=True)
 
 
 def send_email(subject=EMAIL_SUBJECT, body=EMAIL_BODTY,
                sender=EMAIL_FROM, replyto=EMAIL_REPLY_TO,
                records=None, host=SMTP_HOST, port=SMTP_PORT,
-               user=SMTP_USER, passwd=SMTP_PASSWD, dryrun=True):
-
-    with smtplib.SMTP_SSL(host, port) as s:
-        s.login(user, passwd)
-        writer = csv.DictWriter(sys.stdout, fieldnames=records[0].keys())
-        writer.writeheader()
-        for rec in records:
-            address = f'{rec["name"]} <{rec["email"]}>'
-            name = rec['name']
-            code = rec['ticket_id']
-
-            message = EmailMessage()
-            message.set_content(body.format(name=name, reg_code=code))
-            message['Subject'] = subject
-            message['From'] = sender
-            message['Reply-To'] = replyto
-            message['To'] = address
-            if dryrun:
-                print(message)
-            else:
-                s.send_message(message)
+               user=SMTP_USER, passwd=SMTP_PASSWD, dryrun=True,
+               connections=SMTP_CONNECTIONS, delay=0., journal=None,
+               campaign=None):
+    """
+    Send the email to all `records` and write the records of the messages
+    that were accepted by the server to STDOUT, as CSV. If given, every
+    message is logged in `journal` under `campaign`.
+
+    In dry run mode nothing is sent and the messages are printed to STDERR.
+    """
+    if not records:
+        return
+
+    writer = csv.DictWriter(sys.stdout, fieldnames=records[0].keys())
+    writer.writeheader()
+    messages = [make_message(rec, subject, body, sender, replyto)
+                for rec in records]
+    if dryrun:
+        for rec, message in zip(records, messages):
+            print(message, file=sys.stderr)
             writer.writerow(rec)
-            time.sleep(.1)
+        return
 
+    jobs = [(campaign, message, rec)
+            for rec, message in zip(records, messages)]
+    for rec, error in send_all(jobs, host, port, user, passwd,
+                               connections=connections, delay=delay,
+                               journal=journal):
+        if error is not None:
+            print(f'{rec["email"]}: NOT SENT: {error}', file=sys.stderr)
+            continue
+        writer.writerow(rec)
 
-def select_people(regfile, groups, operator=all):
-    def selector(record, operator):
-        return operator(GROUPS[g](record) for g in groups)
 
-    people = []
-    emails = set()
-    with open(regfile) as f:
-        reader = csv.DictReader(f)
-        for record in reader:
-            if selector(record, operator) and record['email'] not in emails:
-                people.append(record)
-                emails.add(record['email'])
-    return people
+def select_people(regfile, groups, operator='and'):
+    """
+    Return the records in `regfile` belonging to all (operator 'and') or any
+    (operator 'or') of the given `groups`.
+    """
+    op = ' & ' if operator == 'and' else ' | '
+    return list(Registrations.load(regfile).select(op.join(groups)))
 
 
 if __name__ == '__main__':
@@ -145,17 +615,44 @@ if __name__ == '__main__':
                         help='custom email subject')
     parser.add_argument('--body', '-b', required=False, type=str,
                         help='custom text file with email body')
-    parser.add_argument('--group', '-g', required=True, action='append',
-                        choices=list(GROUPS))
+    parser.add_argument('--group', '-g', required=False, action='append',
+                        choices=GROUPS)
+    parser.add_argument('--select', '-x', required=False, type=str,
+                        help='selection expression, e.g. '
+                             '"speaker & !trainer | (loc & volunteer)"')
     parser.add_argument('--exclude', '-e', required=False, type=str,
-                        help='cvs reg file with records to exclude')
+                        help='cvs reg file with records (emails) to exclude')
+    parser.add_argument('--campaign', '-c', required=False, type=str,
+                        help='campaign name in the journal of sent emails '
+                             '[defaults to the email subject]')
+    parser.add_argument('--journal', '-J', required=False, type=str,
+                        default=JOURNAL_PATH,
+                        help=f'journal of sent emails [{JOURNAL_PATH}]')
+    parser.add_argument('--resend-uncertain', action='store_true',
+                        help='also resend the emails of an interrupted run '
+                             'that might or might not have been delivered')
     parser.add_argument('regfile', metavar='REG_CSV', nargs=1,
                         help='registration csv file')
     parser.add_argument('--dry-run', dest='dryrun', action='store_true',
                         help='simulation mode: do not send emails')
+    parser.add_argument('--spool', type=str,
+                        help='do not send emails: write them to this Maildir '
+                             '(or mbox if it ends with .mbox) to be sent '
+                             'with deliver_spool.py')
+    parser.add_argument('--connections', '-n', type=int,
+                        default=SMTP_CONNECTIONS,
+                        help='number of parallel SMTP connections '
+                             f'[defaults to {SMTP_CONNECTIONS}]')
+    parser.add_argument('--delay', type=float, default=0.,
+                        help='initial delay between emails in seconds; it '
+                             'adapts to the server replies [defaults to 0]')
     args = parser.parse_args()
 
-    groups = args.group
+    groups = args.group or []
+    if groups and args.select:
+        parser.error('Use either -g GROUP or -x EXPRESSION, not both')
+    if not groups and not args.select:
+        parser.error('Specify the recipients with -g GROUP or -x EXPRESSION')
     if 'all' in groups and len(groups) > 1:
         parser.error('You cannot specify `all` together with any other group')
 
@@ -167,25 +664,46 @@ if __name__ == '__main__':
         subject = args.subject
     else:
         subject = EMAIL_SUBJECT
-    if args.operator == 'or':
-        logicalfn = any
+    if args.select:
+        expression = args.select
     else:
-        logicalfn = all
-
-    records = select_people(args.regfile[0], groups, operator=logicalfn)
-
+        expression = (' | ' if args.operator == 'or' else ' & ').join(groups)
+    try:
+        selection = compile_selection(expression)
+    except ValueError as e:
+        parser.error(str(e))
+
+    registrations = Registrations.load(args.regfile[0])
+
+    campaign = args.campaign or subject
+    journal = SendJournal(args.journal)
+    statuses = journal.statuses(campaign)
+    skip = {SENT, SPOOLED}
+    if not args.resend_uncertain:
+        skip.add(SENDING)
+
+    exclude_set = set()
     if args.exclude:
-        exclude_records = select_people(args.exclude, ['all'])
-        exclude_set = set(','.join(v.lower() for v in rec.values())
-                          for rec in exclude_records)
-        clean = []
-        while records:
-            rec = records.pop()
-            key = ','.join(v.lower() for v in rec.values())
-            if key not in exclude_set:
-                clean.append(rec)
-        clean.reverse()
-    else:
-        clean = records
-
-    send_email(records=clean, body=body, subject=subject, dryrun=args.dryrun)
+        with open(args.exclude) as f:
+            exclude_set = set(email_key(rec) for rec in csv.DictReader(f))
+
+    clean = []
+    for rec in registrations.select(selection):
+        key = email_key(rec)
+        if key in exclude_set or statuses.get(key) in skip:
+            if statuses.get(key) == SENDING:
+                print(f'{rec["email"]}: might have been sent already in an '
+                      'interrupted run: SKIPPED', file=sys.stderr)
+            continue
+        clean.append(rec)
+
+    try:
+        if args.spool and not args.dryrun:
+            spool_email(args.spool, records=clean, body=body, subject=subject,
+                        journal=journal, campaign=campaign)
+        else:
+            send_email(records=clean, body=body, subject=subject,
+                       dryrun=args.dryrun, connections=args.connections,
+                       delay=args.delay, journal=journal, campaign=campaign)
+    finally:
+        journal.close()
@@ -0,0 +1,807 @@
+"""
+Generate a fake, but realistic, pretalx conference of any size (number of
+talks, rooms and days) to test and benchmark the schedule tools without the
+real export:
+
+    OUT/html/EVENT/schedule/index.html      schedule, talk and speaker index
+    OUT/html/EVENT/talk/index.html          pages (see fix_titles_authors.py)
+    OUT/html/EVENT/speaker/index.html
+    OUT/html/EVENT/talk/CODE/index.html     one page and calendar per talk
+    OUT/html/EVENT/talk/CODE.ics
+    OUT/html/EVENT/schedule/export/         schedule.xml/.json/.xcal/.ics
+    OUT/ftp/PAPER_ID/                       PDF/MP4 uploads
+    OUT/pretalx.sql                         the database tables (those of
+                                            pretalx_snapshot.py)
+    OUT/pretalx.sqlite                      the same, for --snapshot
+
+pretalx.sql is plain SQL that works with both Postgres (psql -f) and SQLite.
+Times are in Europe/Madrid (+01:00), as pretalx exports them. The
+pdf_path/video_path columns already point to the FTP uploads, i.e. the
+database is as populate_pdf_video_paths.py left it. Every submission but
+the tutorials answers the theme question (see adass_themes.py), some with a
+second theme, and some talks answer the time question (see
+schedule_helper.py). Only the columns the tools read are there. The same seed
+always gives the same conference.
+
+Usage:
+    fake_pretalx.py --talks 1000 --rooms 2 --days 5 /tmp/fake
+"""
+import argparse
+from collections import defaultdict, namedtuple
+from datetime import date, datetime, timedelta, timezone
+from html import escape
+import json
+import logging
+import math
+import os
+from pathlib import Path
+import random
+import sqlite3
+import uuid
+
+import adass_themes
+import populate_pdf_video_paths
+import schedule_helper
+
+
+log = logging.getLogger(__name__)
+
+EVENT = 'adass2020'
+DOMAIN = 'pretalx.adass2020.es'
+FIRST_DAY = date(2020, 11, 9)
+# CET, as in November
+TZ = timezone(timedelta(hours=1))
+# Start (local time) of the three daily sessions: 06, 11 and 17 UTC
+SESSIONS = ((7, 0), (12, 0), (18, 0))
+SESSION_MINUTES = 180
+MAX_TALK_MINUTES = 30
+THEMES = 11
+POSTER_ROOM = 'Posters'
+# submission type id -> (name, paper_id prefix, share of the submissions)
+TYPES = {
+    13: ('Poster', 'P', 0.45),
+    3: ('Talk', 'O', 0.40),
+    1: ('Invited Talk', 'I', 0.07),
+    4: ('BoF', 'B', 0.04),
+    15: ('Focus Demo', 'D', 0.04),
+}
+POSTER_TYPE = 13
+WITHDRAWN = 0.03
+MAX_SPEAKERS = 4
+# Share of the confirmed submissions with something on the FTP site
+UPLOADS = 0.8
+# Share of the submissions with a second theme, and of the non posters that
+# cannot make some time slot (schedule_helper.TIME_SLOTS)
+SECOND_THEME = 0.2
+TIME_ANSWERS = 0.3
+CODE_CHARS = 'ABCDEFGHJKLMNPQRSTUVWXYZ3789'
+INSERT_BATCH = 500
+
+FIRST_NAMES = (
+    'Ada', 'Alberto', 'Ana', 'Bruno', 'Carmen', 'Chen', 'David', 'Elena',
+    'Fatima', 'Giulia', 'Hiroshi', 'Ines', 'Javier', 'Jessica', 'Karl',
+    'Laura', 'Lucia', 'Marco', 'Maria', 'Mei', 'Nikolai', 'Olga', 'Pablo',
+    'Priya', 'Rafael', 'Sara', 'Thomas', 'Usha', 'Victor', 'Yuki',
+)
+LAST_NAMES = (
+    'Abbott', 'Becker', 'Bianchi', 'Costa', 'Dubois', 'Fernandez', 'Fischer',
+    'Garcia', 'Gupta', 'Hansen', 'Ivanova', 'Jensen', 'Kim', 'Kowalski',
+    'Lopez', 'Martin', 'Moreau', 'Muller', 'Nakamura', 'Nguyen', 'Novak',
+    'Okafor', 'Olsen', 'Perez', 'Rossi', 'Sanchez', 'Schmidt', 'Silva',
+    'Singh', 'Tanaka', 'Torres', 'Wang', 'Weber', 'Williams', 'Zhang',
+)
+WORDS = (
+    'adaptive', 'archive', 'astrometry', 'calibration', 'catalogue', 'cloud',
+    'cross-match', 'data', 'deep', 'distributed', 'exoplanet', 'fast',
+    'galaxy', 'GPU', 'imaging', 'interferometry', 'learning', 'light curve',
+    'machine', 'mosaic', 'neural', 'observatory', 'open', 'pipeline',
+    'python', 'radio', 'reduction', 'scalable', 'sky survey', 'software',
+    'spectroscopy', 'streaming', 'telescope', 'time-domain', 'transient',
+    'virtual observatory', 'visualisation', 'workflow', 'X-ray',
+)
+
+Person = namedtuple('Person', ['pk', 'code', 'name', 'email'])
+Talk = namedtuple('Talk', ['pk', 'code', 'paper_id', 'title', 'abstract',
+                           'state', 'type_id', 'speakers', 'room', 'start',
+                           'minutes', 'pdf', 'video'])
+
+DDL = '''\
+DROP TABLE IF EXISTS person_user;
+DROP TABLE IF EXISTS submission_submissiontype;
+DROP TABLE IF EXISTS submission_submission;
+DROP TABLE IF EXISTS submission_submission_speakers;
+DROP TABLE IF EXISTS schedule_room;
+DROP TABLE IF EXISTS schedule_talkslot;
+DROP TABLE IF EXISTS submission_answeroption;
+DROP TABLE IF EXISTS submission_answer;
+DROP TABLE IF EXISTS submission_answer_options;
+CREATE TABLE person_user (
+    id INTEGER PRIMARY KEY,
+    code TEXT,
+    name TEXT,
+    email TEXT
+);
+CREATE TABLE submission_submissiontype (
+    id INTEGER PRIMARY KEY,
+    name TEXT
+);
+CREATE TABLE submission_submission (
+    id INTEGER PRIMARY KEY,
+    code TEXT,
+    paper_id TEXT,
+    title TEXT,
+    abstract TEXT,
+    state TEXT,
+    submission_type_id INTEGER,
+    main_author_id INTEGER,
+    pdf_path TEXT,
+    video_path TEXT
+);
+CREATE TABLE submission_submission_speakers (
+    id INTEGER PRIMARY KEY,
+    submission_id INTEGER,
+    user_id INTEGER
+);
+CREATE TABLE schedule_room (
+    id INTEGER PRIMARY KEY,
+    name TEXT,
+    position INTEGER
+);
+CREATE TABLE schedule_talkslot (
+    id INTEGER PRIMARY KEY,
+    submission_id INTEGER,
+    room_id INTEGER,
+    schedule_id INTEGER,
+    start TIMESTAMPTZ,
+    "end" TIMESTAMPTZ,
+    is_visible BOOLEAN,
+    description TEXT
+);
+CREATE TABLE submission_answeroption (
+    id INTEGER PRIMARY KEY,
+    question_id INTEGER,
+    answer TEXT
+);
+CREATE TABLE submission_answer (
+    id INTEGER PRIMARY KEY,
+    submission_id INTEGER,
+    question_id INTEGER,
+    answer TEXT
+);
+CREATE TABLE submission_answer_options (
+    id INTEGER PRIMARY KEY,
+    answer_id INTEGER,
+    answeroption_id INTEGER
+);
+'''
+
+
+def _code(rng, n, used):
+    while True:
+        code = ''.join(rng.choice(CODE_CHARS) for _ in range(n))
+        if code not in used:
+            used.add(code)
+            return code
+
+
+def _sentence(rng, n):
+    return ' '.join(rng.choice(WORDS) for _ in range(n))
+
+
+def make_people(rng, n):
+    used = set()
+    people = []
+    for pk in range(1, n + 1):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        name = f'{first} {rng.choice(CODE_CHARS[:24])}. {last}'
+        email = f'{first}.{last}.{pk}@example.org'.lower()
+        people.append(Person(pk, _code(rng, 5, used), name, email))
+    return people
+
+
+def _type_ids(rng, n):
+    """n submission type ids, in the TYPES proportions."""
+    counts = {type_id: int(share * n)
+              for type_id, (_, _, share) in TYPES.items()}
+    counts[3] += n - sum(counts.values())
+    type_ids = [type_id for type_id, k in counts.items() for _ in range(k)]
+    rng.shuffle(type_ids)
+    return type_ids
+
+
+def make_talks(rng, n, rooms, days, people):
+    """
+    Return n Talks: confirmed ones are scheduled (talks in Room 1..rooms,
+    all in the same number of slots, posters in POSTER_ROOM) and some have
+    uploads.
+    """
+    used = set()
+    numbers = defaultdict(int)
+    talks = []
+    for pk, type_id in enumerate(_type_ids(rng, n), 1):
+        prefix = TYPES[type_id][1]
+        theme = rng.randint(1, THEMES)
+        numbers[prefix, theme] += 1
+        state = 'withdrawn' if rng.random() < WITHDRAWN else 'confirmed'
+        speakers = tuple(rng.sample(people, rng.randint(1, MAX_SPEAKERS)))
+        pdf = video = None
+        paper_id = f'{prefix}{theme}-{numbers[prefix, theme]}'
+        if state == 'confirmed' and rng.random() < UPLOADS:
+            video = f'{paper_id}.mp4' if rng.random() < 0.6 else None
+            pdf = f'{paper_id}.pdf' if rng.random() < 0.9 or not video \
+                else None
+        title = _sentence(rng, rng.randint(3, 9)).capitalize()
+        abstract = '. '.join(_sentence(rng, 12).capitalize()
+                             for _ in range(rng.randint(3, 8))) + '.'
+        talks.append(Talk(pk, _code(rng, 6, used), paper_id, title, abstract,
+                          state, type_id, speakers, None, None, None, pdf,
+                          video))
+
+    # Same theme, same session as much as possible: schedule by paper_id
+    confirmed = sorted((t for t in talks if t.state == 'confirmed'),
+                       key=lambda t: (t.type_id == POSTER_TYPE, t.paper_id))
+    orals = [t for t in confirmed if t.type_id != POSTER_TYPE]
+    posters = confirmed[len(orals):]
+    n_blocks = days * len(SESSIONS) * rooms
+    per_block = max(1, math.ceil(len(orals) / n_blocks))
+    minutes = max(1, min(MAX_TALK_MINUTES, SESSION_MINUTES // per_block))
+    scheduled = {}
+    for i, talk in enumerate(orals):
+        block, k = divmod(i, per_block)
+        session, room = divmod(block, rooms)
+        day, slot = divmod(session, len(SESSIONS))
+        start = datetime.combine(FIRST_DAY + timedelta(days=day),
+                                 datetime.min.time(), TZ)
+        start += timedelta(hours=SESSIONS[slot][0],
+                           minutes=SESSIONS[slot][1] + k * minutes)
+        scheduled[talk.pk] = talk._replace(room=f'Room {room + 1}',
+                                           start=start, minutes=minutes)
+    for i, talk in enumerate(posters):
+        start = datetime.combine(FIRST_DAY + timedelta(days=i % days),
+                                 datetime.min.time(), TZ)
+        start += timedelta(hours=SESSIONS[0][0], minutes=SESSIONS[0][1])
+        scheduled[talk.pk] = talk._replace(room=POSTER_ROOM, start=start,
+                                           minutes=SESSION_MINUTES)
+    return [scheduled.get(t.pk, t) for t in talks]
+
+
+def make_answers(rng, talks):
+    """
+    Return the answers of `talks` to the theme and time questions as
+    {talk pk: (time answer or None, [theme option id, ...])}. The first
+    theme is the one of the paper_id.
+    """
+    option_ids = list(adass_themes.THEMES)
+    slots = list(schedule_helper.TIME_SLOTS)
+    answers = {}
+    for talk in talks:
+        if talk.type_id == adass_themes.TUTORIAL_TYPE:
+            continue
+        theme = int(talk.paper_id[1:].split('-')[0])
+        themes = [option_ids[theme - 1]]
+        if rng.random() < SECOND_THEME:
+            other = rng.choice(option_ids)
+            if other not in themes:
+                themes.append(other)
+        time = None
+        if talk.type_id != POSTER_TYPE and rng.random() < TIME_ANSWERS:
+            time = ', '.join(rng.sample(slots, rng.randint(1, 2)))
+        answers[talk.pk] = (time, themes)
+    return answers
+
+
+def room_names(rooms):
+    return [POSTER_ROOM] + [f'Room {i + 1}' for i in range(rooms)]
+
+
+# Database
+def _literal(value):
+    if value is None:
+        return 'NULL'
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _inserts(table, columns, rows):
+    rows = list(rows)
+    for i in range(0, len(rows), INSERT_BATCH):
+        values = ',\n'.join(
+            '(' + ', '.join(map(_literal, row)) + ')'
+            for row in rows[i:i + INSERT_BATCH]
+        )
+        yield f'INSERT INTO {table} ({", ".join(columns)}) VALUES\n{values};\n'
+
+
+def write_sql(path, people, talks, answers, rooms, media_url_root):
+    room_ids = {name: pk for pk, name in enumerate(room_names(rooms), 1)}
+
+    def media_path(talk, name):
+        if name is None:
+            return None
+        return str(Path(media_url_root) / talk.paper_id / name)
+
+    speakers = [(sub.pk, spk.pk) for sub in talks for spk in sub.speakers]
+    slots = [t for t in talks if t.start is not None]
+    # submission_answer rows and, for the themes, their options
+    answer_rows, option_rows = [], []
+    for sub_pk, (time, themes) in answers.items():
+        answer_rows.append((len(answer_rows) + 1, sub_pk,
+                            adass_themes.THEME_QUESTION_ID,
+                            ', '.join(adass_themes.THEMES[t] for t in themes)))
+        option_rows.extend((len(option_rows) + 1, answer_rows[-1][0], t)
+                           for t in themes)
+        if time is not None:
+            answer_rows.append((len(answer_rows) + 1, sub_pk,
+                                schedule_helper.TIME_QUESTION_ID, time))
+    with open(path, 'w') as f:
+        f.write(DDL)
+        f.writelines(_inserts('person_user', ('id', 'code', 'name', 'email'),
+                              people))
+        f.writelines(_inserts('submission_submissiontype', ('id', 'name'),
+                              ((k, v[0]) for k, v in TYPES.items())))
+        f.writelines(_inserts(
+            'submission_submission',
+            ('id', 'code', 'paper_id', 'title', 'abstract', 'state',
+             'submission_type_id', 'main_author_id', 'pdf_path',
+             'video_path'),
+            ((t.pk, t.code, t.paper_id, t.title, t.abstract, t.state,
+              t.type_id, t.speakers[0].pk, media_path(t, t.pdf),
+              media_path(t, t.video)) for t in talks)
+        ))
+        f.writelines(_inserts(
+            'submission_submission_speakers',
+            ('id', 'submission_id', 'user_id'),
+            ((pk, *row) for pk, row in enumerate(speakers, 1))
+        ))
+        f.writelines(_inserts('schedule_room', ('id', 'name', 'position'),
+                              ((pk, name, pk) for name, pk in
+                               room_ids.items())))
+        f.writelines(_inserts(
+            'schedule_talkslot',
+            ('id', 'submission_id', 'room_id', 'schedule_id', 'start',
+             '"end"', 'is_visible', 'description'),
+            ((pk, t.pk, room_ids[t.room], 1, t.start,
+              t.start + timedelta(minutes=t.minutes), True, None)
+             for pk, t in enumerate(slots, 1))
+        ))
+        f.writelines(_inserts(
+            'submission_answeroption', ('id', 'question_id', 'answer'),
+            ((pk, adass_themes.THEME_QUESTION_ID, name)
+             for pk, name in adass_themes.THEMES.items())
+        ))
+        f.writelines(_inserts(
+            'submission_answer',
+            ('id', 'submission_id', 'question_id', 'answer'), answer_rows
+        ))
+        f.writelines(_inserts(
+            'submission_answer_options',
+            ('id', 'answer_id', 'answeroption_id'), option_rows
+        ))
+
+
+def write_sqlite(path, sql_path):
+    if os.path.exists(path):
+        os.unlink(path)
+    db = sqlite3.connect(path)
+    try:
+        with open(sql_path) as f:
+            db.executescript(f.read())
+        db.commit()
+    finally:
+        db.close()
+
+
+# HTML export
+PAGE = '''\
+<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>{title} :: ADASS 2020</title>
+</head>
+<body>
+<main>
+{body}
+</main>
+</body>
+</html>
+'''
+QRCODE = '''\
+<div class="export-qrcode-image">
+<svg width="150" height="150" viewBox="0 0 29 29"><path d="M0 0h7v7H0z"/></svg>
+</div>'''
+
+
+def _talk_url(event, code):
+    return f'/{event}/talk/{code}/'
+
+
+def _when(talk):
+    end = talk.start + timedelta(minutes=talk.minutes)
+    return f'{talk.start:%A}, {talk.start:%H:%M}\u2013{end:%H:%M}, {talk.room}'
+
+
+def _by_day_and_room(talks, rooms):
+    """{day: {room: [talk, ...]}} of the scheduled talks, sorted by start."""
+    days = defaultdict(lambda: {name: [] for name in room_names(rooms)})
+    for talk in sorted((t for t in talks if t.start is not None),
+                       key=lambda t: (t.start, t.pk)):
+        days[talk.start.date()][talk.room].append(talk)
+    return dict(sorted(days.items()))
+
+
+def schedule_page(event, talks, rooms):
+    lines = [QRCODE, QRCODE, '<div class="pretalx-schedule">']
+    for day, by_room in _by_day_and_room(talks, rooms).items():
+        lines.append('<div class="pretalx-schedule-day">')
+        lines.append(f'<div class="pretalx-schedule-day-header">'
+                     f'{day:%A, %Y-%m-%d}</div>')
+        for room in by_room:
+            lines.append(f'<div class="pretalx-schedule-day-room-header">'
+                         f'{escape(room)}</div>')
+        for room, bag in by_room.items():
+            lines.append('<div class="pretalx-schedule-room">')
+            for talk in bag:
+                names = ', '.join(s.name for s in talk.speakers)
+                lines.append(
+                    f'<div class="pretalx-schedule-talk" id="{talk.code}">'
+                    f'<div class="pretalx-schedule-talk-content">'
+                    f'<span class="pretalx-schedule-talk-title">'
+                    f'{escape(talk.title)}</span>'
+                    f'<span class="pretalx-schedule-talk-speakers">'
+                    f'({escape(names)})</span></div></div>'
+                )
+            lines.append('</div>')
+        lines.append('</div>')
+    lines.append('</div>')
+    return PAGE.format(title='Schedule', body='\n'.join(lines))
+
+
+def talks_page(event, talks):
+    lines = []
+    for talk in talks:
+        if talk.state != 'confirmed':
+            continue
+        names = ', '.join(s.name for s in talk.speakers)
+        lines.append(
+            f'<section class="talk">\n'
+            f'<h3 class="talk-title"><a href="{_talk_url(event, talk.code)}">'
+            f'{escape(talk.title)}</a></h3>\n'
+            f'<div class="speakers">{escape(names)}</div>\n</section>'
+        )
+    return PAGE.format(title='Talks', body='\n'.join(lines))
+
+
+def speakers_page(event, talks):
+    by_speaker = defaultdict(list)
+    for talk in talks:
+        if talk.state == 'confirmed':
+            for speaker in talk.speakers:
+                by_speaker[speaker].append(talk)
+    lines = []
+    for speaker in sorted(by_speaker, key=lambda s: (s.name, s.pk)):
+        links = ' | '.join(
+            f'<a href="{_talk_url(event, t.code)}">{escape(t.title)}</a>'
+            for t in by_speaker[speaker]
+        )
+        lines.append(
+            f'<section class="speaker">\n'
+            f'<h3 class="talk-title"><a href="/{event}/speaker/'
+            f'{speaker.code}/">{escape(speaker.name)}</a></h3>\n'
+            f'<p>{links}</p>\n</section>'
+        )
+    return PAGE.format(title='Speakers', body='\n'.join(lines))
+
+
+def talk_page(event, talk):
+    speakers = '\n'.join(
+        f'<div class="speaker-header"><strong>{escape(s.name)}</strong></div>'
+        for s in talk.speakers
+    )
+    body = (
+        f'<section class="talk">\n'
+        f'<h3 class="talk-title"><a href="{_talk_url(event, talk.code)}">'
+        f'{escape(talk.title)}</a>\n<small>{escape(_when(talk))}</small>\n'
+        f'<div><a href="/{event}/talk/{talk.code}.ics">.ics</a></div></h3>\n'
+        f'<div class="abstract"><p>{escape(talk.abstract)}</p></div>\n'
+        f'</section>\n'
+        f'<aside>\n<section class="speakers">\n{speakers}\n</section>\n'
+        f'</aside>'
+    )
+    return PAGE.format(title=escape(talk.title), body=body)
+
+
+# Calendars
+def _guid(event, talk):
+    return uuid.uuid5(uuid.NAMESPACE_URL, f'https://{DOMAIN}'
+                                          f'{_talk_url(event, talk.code)}')
+
+
+def _hhmm(minutes):
+    return f'{minutes // 60:02d}:{minutes % 60:02d}'
+
+
+def _day_bounds(day):
+    start = datetime.combine(day, datetime.min.time(), TZ)
+    return start + timedelta(hours=4), start + timedelta(hours=27, minutes=59)
+
+
+def _ics_text(value):
+    return value.replace('\\', '\\\\').replace(';', '\\;') \
+                .replace(',', '\\,').replace('\n', '\\n')
+
+
+def _fold(line):
+    """Fold an iCalendar content line at 75 characters."""
+    parts = [line[:75]]
+    parts += [' ' + line[i:i + 74] for i in range(75, len(line), 74)]
+    return '\r\n'.join(parts) + '\r\n'
+
+
+def _vevent(event, talk):
+    end = talk.start + timedelta(minutes=talk.minutes)
+    names = ', '.join(s.name for s in talk.speakers)
+    return [
+        'BEGIN:VEVENT',
+        f'SUMMARY:{_ics_text(f"{talk.title} - {names}")}',
+        f'DTSTART;TZID=Europe/Madrid:{talk.start:%Y%m%dT%H%M%S}',
+        f'DTEND;TZID=Europe/Madrid:{end:%Y%m%dT%H%M%S}',
+        'DTSTAMP:20201101T120000Z',
+        f'UID:pretalx-{event}-{talk.code}@{DOMAIN}',
+        f'LOCATION:{_ics_text(talk.room)}',
+        f'DESCRIPTION:{_ics_text(talk.abstract)}',
+        f'URL:https://{DOMAIN}{_talk_url(event, talk.code)}',
+        'END:VEVENT',
+    ]
+
+
+def ics(event, talks):
+    lines = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        f'PRODID:-//pretalx//{DOMAIN}//{event}',
+        'BEGIN:VTIMEZONE',
+        'TZID:Europe/Madrid',
+        'BEGIN:STANDARD',
+        'DTSTART:20001029T030000',
+        'RRULE:FREQ=YEARLY;BYDAY=-1SU;BYMONTH=10',
+        'TZNAME:CET',
+        'TZOFFSETFROM:+0200',
+        'TZOFFSETTO:+0100',
+        'END:STANDARD',
+        'END:VTIMEZONE',
+    ]
+    for talk in talks:
+        lines.extend(_vevent(event, talk))
+    lines.append('END:VCALENDAR')
+    return ''.join(map(_fold, lines))
+
+
+def _xml_event(event, talk):
+    persons = ''.join(f'<person id="{s.pk}">{escape(s.name)}</person>'
+                      for s in talk.speakers)
+    return (
+        f'      <event guid="{_guid(event, talk)}" id="{talk.pk}">'
+        f'<date>{talk.start.isoformat()}</date>'
+        f'<start>{talk.start:%H:%M}</start>'
+        f'<duration>{_hhmm(talk.minutes)}</duration>'
+        f'<room>{escape(talk.room)}</room>'
+        f'<slug>{event}-{talk.pk}</slug>'
+        f'<url>https://{DOMAIN}{_talk_url(event, talk.code)}</url>'
+        f'<recording><license></license><optout>false</optout></recording>'
+        f'<title>{escape(talk.title)}</title><subtitle></subtitle>'
+        f'<track></track><type>{TYPES[talk.type_id][0]}</type>'
+        f'<language>en</language>'
+        f'<abstract>{escape(talk.abstract)}</abstract>'
+        f'<description></description><logo></logo>'
+        f'<persons>{persons}</persons><links></links>'
+        f'<attachments></attachments></event>'
+    )
+
+
+def schedule_xml(event, days):
+    lines = [
+        "<?xml version='1.0' encoding='utf-8'?>",
+        '<schedule>',
+        '  <version>1.0</version>',
+        f'  <conference><acronym>{event}</acronym>'
+        f'<title>ADASS 2020</title></conference>',
+    ]
+    for index, (day, by_room) in enumerate(days.items(), 1):
+        start, end = _day_bounds(day)
+        lines.append(f'  <day index="{index}" date="{day}" '
+                     f'start="{start.isoformat()}" end="{end.isoformat()}">')
+        for room, bag in by_room.items():
+            lines.append(f'    <room name="{escape(room)}">')
+            lines.extend(_xml_event(event, talk) for talk in bag)
+            lines.append('    </room>')
+        lines.append('  </day>')
+    lines.append('</schedule>')
+    return '\n'.join(lines) + '\n'
+
+
+def schedule_json(event, days):
+    def event_dict(talk):
+        return {
+            'id': talk.pk,
+            'guid': str(_guid(event, talk)),
+            'logo': '',
+            'date': talk.start.isoformat(),
+            'start': f'{talk.start:%H:%M}',
+            'duration': _hhmm(talk.minutes),
+            'room': talk.room,
+            'slug': f'{event}-{talk.pk}',
+            'url': f'https://{DOMAIN}{_talk_url(event, talk.code)}',
+            'title': talk.title,
+            'subtitle': '',
+            'track': None,
+            'type': TYPES[talk.type_id][0],
+            'language': 'en',
+            'abstract': talk.abstract,
+            'description': '',
+            'recording_license': '',
+            'do_not_record': False,
+            'persons': [{'id': s.pk, 'code': s.code, 'public_name': s.name,
+                         'biography': '', 'answers': []}
+                        for s in talk.speakers],
+            'links': [],
+            'attachments': [],
+            'answers': [],
+        }
+
+    days_list = []
+    for index, (day, by_room) in enumerate(days.items(), 1):
+        start, end = _day_bounds(day)
+        days_list.append({
+            'index': index,
+            'date': str(day),
+            'day_start': start.isoformat(),
+            'day_end': end.isoformat(),
+            'rooms': {room: [event_dict(t) for t in bag]
+                      for room, bag in by_room.items()},
+        })
+    return json.dumps({'schedule': {
+        'version': '1.0',
+        'base_url': f'https://{DOMAIN}/{event}/schedule/',
+        'conference': {
+            'acronym': event,
+            'title': 'ADASS 2020',
+            'start': str(min(days, default=FIRST_DAY)),
+            'end': str(max(days, default=FIRST_DAY)),
+            'daysCount': len(days),
+            'timeslot_duration': '00:05',
+            'days': days_list,
+        },
+    }})
+
+
+def schedule_xcal(event, talks):
+    lines = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<iCalendar xmlns:pentabarf="http://pentabarf.org" '
+        'xmlns:xCal="urn:ietf:params:xml:ns:xcal">',
+        '  <vcalendar>',
+        '    <version>2.0</version>',
+        '    <prodid>-//Pentabarf//Schedule//EN</prodid>',
+        f'    <x-wr-caldesc>{event}</x-wr-caldesc>',
+        f'    <x-wr-calname>{event}</x-wr-calname>',
+    ]
+    for talk in talks:
+        end = talk.start + timedelta(minutes=talk.minutes)
+        attendees = ''.join(f'<attendee>{escape(s.name)}</attendee>'
+                            for s in talk.speakers)
+        lines.append(
+            f'    <vevent><method>PUBLISH</method>'
+            f'<uid>{_guid(event, talk)}@{DOMAIN}</uid>'
+            f'<dtstart>{talk.start:%Y%m%dT%H%M%S}</dtstart>'
+            f'<dtend>{end:%Y%m%dT%H%M%S}</dtend>'
+            f'<duration>{_hhmm(talk.minutes)}:00</duration>'
+            f'<summary>{escape(talk.title)}</summary>'
+            f'<description>{escape(talk.abstract)}</description>'
+            f'<class>PUBLIC</class><status>CONFIRMED</status>'
+            f'<category>{TYPES[talk.type_id][0]}</category>'
+            f'<url>https://{DOMAIN}{_talk_url(event, talk.code)}</url>'
+            f'<location>{escape(talk.room)}</location>{attendees}</vevent>'
+        )
+    lines.extend(['  </vcalendar>', '</iCalendar>'])
+    return '\n'.join(lines) + '\n'
+
+
+def _write(path, data, newline=None):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w', newline=newline) as f:
+        f.write(data)
+
+
+def write_export(root, event, talks, rooms):
+    """Write the pretalx HTML export of `talks` in root/event."""
+    base = Path(root, event)
+    scheduled = [t for t in talks if t.start is not None]
+    days = _by_day_and_room(talks, rooms)
+
+    _write(base / 'schedule' / 'index.html',
+           schedule_page(event, talks, rooms))
+    _write(base / 'talk' / 'index.html', talks_page(event, talks))
+    _write(base / 'speaker' / 'index.html', speakers_page(event, talks))
+    for talk in scheduled:
+        _write(base / 'talk' / talk.code / 'index.html',
+               talk_page(event, talk))
+        _write(base / 'talk' / f'{talk.code}.ics', ics(event, [talk]),
+               newline='')
+
+    export = base / 'schedule' / 'export'
+    in_order = [t for by_room in days.values() for bag in by_room.values()
+                for t in bag]
+    _write(export / 'schedule.xml', schedule_xml(event, days))
+    _write(export / 'schedule.json', schedule_json(event, days))
+    _write(export / 'schedule.xcal', schedule_xcal(event, in_order))
+    _write(export / 'schedule.ics', ics(event, in_order), newline='')
+
+
+def write_ftp(root, talks):
+    """One directory per confirmed paper_id, with its (fake) uploads."""
+    for talk in talks:
+        if talk.state != 'confirmed':
+            continue
+        path = Path(root, talk.paper_id)
+        path.mkdir(parents=True, exist_ok=True)
+        if talk.pdf:
+            (path / talk.pdf).write_bytes(b'%PDF-1.4\n%%EOF\n')
+        if talk.video:
+            (path / talk.video).write_bytes(b'\x00\x00\x00\x18ftypmp42')
+
+
+def output_paths(out):
+    out = Path(out)
+    return {
+        'html': out / 'html',
+        'ftp': out / 'ftp',
+        'sql': out / 'pretalx.sql',
+        'sqlite': out / 'pretalx.sqlite',
+    }
+
+
+def generate(out, talks=1000, rooms=1, days=5, seed=0, event=EVENT,
+             media_url_root=populate_pdf_video_paths.MEDIA_URL_ROOT):
+    """
+    Generate a conference with `talks` submissions in `out` (see the module
+    docstring) and return the paths of its parts.
+    """
+    rng = random.Random(seed)
+    people = make_people(rng, max(1, int(talks * 1.3)))
+    subs = make_talks(rng, talks, rooms, days, people)
+    answers = make_answers(rng, subs)
+
+    paths = output_paths(out)
+    Path(out).mkdir(parents=True, exist_ok=True)
+    write_export(paths['html'], event, subs, rooms)
+    write_ftp(paths['ftp'], subs)
+    write_sql(paths['sql'], people, subs, answers, rooms, media_url_root)
+    write_sqlite(paths['sqlite'], paths['sql'])
+    log.info(f'{talks} submissions, {len(people)} people in {out}')
+    return paths
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--talks', '-n', type=int, default=1000,
+                        help='number of submissions')
+    parser.add_argument('--rooms', type=int, default=1,
+                        help='parallel rooms (plus the poster room)')
+    parser.add_argument('--days', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--event', '-e', type=str, default=EVENT,
+                        help='event name')
+    parser.add_argument('--media_url_root', type=str,
+                        default=populate_pdf_video_paths.MEDIA_URL_ROOT)
+    parser.add_argument('out', metavar='OUT', help='output directory')
+    args = parser.parse_args()
+
+    generate(args.out, args.talks, args.rooms, args.days, args.seed,
+             args.event, args.media_url_root)
@@ -0,0 +1,171 @@
+"""
+Fix all calendar files in the pretalx HTML export to use UTC instead of
+CEST/CET/Madrid time and to point to the public schedule site:
+
+    *.xml, schedule.json: +01:00 -> +00:00
+    *.ics: ;TZID=Europe/Madrid:YYYYMMDDTHHMMSS -> :YYYYMMDDTHHMMSSZ
+           https://pretalx. -> https://schedule.
+
+Each file is rewritten (atomically) in a single pass, files are processed in
+parallel and files that are already normalised are skipped. Finally the main
+schedule.ics is rebuilt from schedule.xml with schedule_convert.
+
+Usage:
+    fix_calendars.py -r HTML_EXPORT_DIR -e EVENT_NAME
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+
+
+SCHEDULE_URL = 'https://schedule.adass2020.es'
+# Keep this outside of the export root (that gets rsync --delete'd every
+# time): next to this script.
+STATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'calendar_hashes.json')
+
+# On bytes: the files are not decoded (whatever their encoding)
+XML_RULES = (
+    (re.compile(rb'\+01:00'), b'+00:00'),
+)
+ICS_RULES = (
+    (re.compile(rb';TZID=Europe/Madrid:([0-9T]+)'), rb':\1Z'),
+    (re.compile(rb'https://pretalx\.'), b'https://schedule.'),
+)
+
+
+def _rules_for(name):
+    if name.endswith('.xml') or name == 'schedule.json':
+        return XML_RULES
+    if name.endswith('.ics'):
+        return ICS_RULES
+    return None
+
+
+def _sig(path):
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size]
+
+
+def _sha1(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def find_calendars(root):
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            if _rules_for(name):
+                yield os.path.join(dirpath, name)
+
+
+def normalise(path, known=None):
+    """
+    Apply the substitution rules to `path`, line by line, and return its new
+    [mtime_ns, size, sha1] and whether it was rewritten. `known` is what we
+    returned the last time: if the file still has that mtime and size it is
+    left alone. If only those changed (e.g. after a copy) but the content
+    still has the sha1 we wrote, it is already normalised and left alone too.
+    """
+    if known:
+        sig = _sig(path)
+        if sig == known[:2]:
+            return known, False
+        if _sha1(path) == known[2]:
+            return sig + known[2:], False
+
+    rules = _rules_for(os.path.basename(path))
+    in_hash = hashlib.sha1()
+    out_hash = hashlib.sha1()
+    dirname, basename = os.path.split(path)
+    tmp_path = os.path.join(dirname, f'.{basename}.tmp')
+    with open(path, 'rb') as f, open(tmp_path, 'wb') as out:
+        for line in f:
+            in_hash.update(line)
+            for pattern, repl in rules:
+                line = pattern.sub(repl, line)
+            out_hash.update(line)
+            out.write(line)
+
+    written = in_hash.digest() != out_hash.digest()
+    if written:
+        shutil.copymode(path, tmp_path)
+        os.replace(tmp_path, path)
+    else:
+        os.unlink(tmp_path)
+    return _sig(path) + [out_hash.hexdigest()], written
+
+
+def _normalise(args):
+    return normalise(*args)
+
+
+def rebuild_ics(root, event, url=SCHEDULE_URL):
+    export_dir = os.path.join(root, event, 'schedule', 'export')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        subprocess.run(['schedule_convert',
+                        os.path.join(export_dir, 'schedule.xml'),
+                        '-l', tmp_dir, url], check=True)
+        host = url.split('://', 1)[-1].rstrip('/')
+        shutil.move(os.path.join(tmp_dir, f'{host}.ics'),
+                    os.path.join(export_dir, 'schedule.ics'))
+
+
+def fix_calendars(root, event, state_path=STATE_PATH, jobs=None,
+                  url=SCHEDULE_URL, rebuild=True):
+    """
+    Return the list of calendar files that were (re)written. With
+    rebuild=False schedule.ics is not rebuilt (no schedule_convert needed).
+    """
+    state = {}
+    if state_path and os.path.isfile(state_path):
+        with open(state_path) as f:
+            state = json.load(f)
+
+    paths = sorted(find_calendars(root))
+    work = [(path, state.get(path)) for path in paths]
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        chunksize = max(1, len(work) // (4 * (jobs or os.cpu_count())))
+        results = list(executor.map(_normalise, work, chunksize=chunksize))
+
+    changed = [path for path, (_, written) in zip(paths, results)
+               if written]
+    new_state = {path: res for path, (res, _) in zip(paths, results)}
+
+    if rebuild:
+        rebuild_ics(root, event, url)
+
+    if state_path:
+        tmp_path = f'{state_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(new_state, f)
+        os.replace(tmp_path, state_path)
+    return changed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--root', '-r', type=str, required=True,
+                        help='root of the pretalx HTML export')
+    parser.add_argument('--event', '-e', type=str, required=True,
+                        help='event name')
+    parser.add_argument('--state', type=str, default=STATE_PATH,
+                        help='file used to skip already normalised files')
+    parser.add_argument('--url', type=str, default=SCHEDULE_URL,
+                        help='public URL of the schedule')
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count(),
+                        help='number of processes')
+    args = parser.parse_args()
+
+    for path in fix_calendars(args.root, args.event, args.state, args.jobs,
+                              args.url):
+        print(path)
@@ -8,7 +8,9 @@ import argparse
 import os
 import sys
 from bs4 import BeautifulSoup
-import psycopg2
+from lxml import etree, html as lxml_html
+
+import pretalx_model
 
 
 # This is a hack
@@ -42,32 +44,6 @@ CODES = {
 ICS_SVG = 'schedule-ics.svg'
 XML_SVG = 'schedule-xml.svg'
 
-SELECT = '''\
-SELECT
-    submission_submission.id,
-    submission_submission.code,
-    submission_submission.paper_id,
-    submission_submission.title,
-    person_user.name
-FROM
-    submission_submission,
-    person_user
-WHERE
-    submission_submission.state not in ('deleted', 'withdrawn')
-    AND submission_submission.main_author_id = person_user.id
-ORDER BY
-    submission_submission.id
-'''
-
-FIND_UNWANTED_TYPES = '''\
-SELECT
-    submission_submission.code
-FROM
-    submission_submission
-WHERE
-    submission_submission.submission_type_id in %s
-'''
-
 
 def mkcssclass(s):
     s = s.strip().replace(' ', '_')
@@ -83,8 +59,41 @@ def fix_auth_order(first_author, all_authors):
     )
 
 
+def compute_changes(submissions):
+    """
+    Return the submission code -> (new title, first author) dict for the
+    active `submissions` (pretalx_model.Submission) with a main author.
+    """
+    changes = {}
+    for sub in submissions:
+        if not sub.active or sub.main_author is None:
+            continue
+        code, pid, title = sub.code, sub.paper_id, sub.title
+        first_author = sub.main_author.name
+
+        # Hack
+        if code in TUTORIAL_IDS:
+            new_title = f'Tutorial - {title}'
+        elif pid is not None:
+            typ = CODES[pid[0]]
+            new_title = f'{typ} ({pid}) - {title}'
+            assert code not in changes
+        else:
+            print(f'{title}: SKIPPED', file=sys.stderr)
+            continue
+
+        changes[code] = (new_title, first_author)
+    return changes
+
+
+def hidden_codes(program):
+    """Codes of the submissions (of TYPES_TO_REMOVE) to hide."""
+    return set(sub.code for type_id in TYPES_TO_REMOVE
+               for sub in program.by_type.get(type_id, ()))
+
+
 def _extract_code(a):
-    uri = a['href']
+    uri = a.get('href')
     if uri.endswith('/'):
         uri = uri[:-1]
     code = uri.split('/')[-1]
@@ -200,10 +209,172 @@ def edit_speaker(event, subs_to_hide, root):
                 else:
                     new_content.append(el)
             # Now replace the old content with the new one
-            p.contents = new_content
+            p.clear()
+            p.extend(new_content)
     return soup.prettify()
 
 
+# lxml engine: same edits as above, but done with targeted XPath queries on a
+# tree parsed straight from the file. The document is serialised as is, without
+# re-indenting it.
+def _xp_class(name):
+    """XPath predicate for elements having `name` among their CSS classes."""
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+def _has_class(el, name):
+    return name in el.get('class', '').split()
+
+
+def _first(el, path):
+    res = el.xpath(path)
+    return res[0] if res else None
+
+
+def _set_text(el, text):
+    """Replace all the content of `el` with `text`, like bs4 `tag.string`."""
+    for child in list(el):
+        el.remove(child)
+    el.text = text
+
+
+def _to_string(tree):
+    return etree.tostring(tree, method='html', encoding='unicode',
+                          doctype=tree.docinfo.doctype)
+
+
+def edit_index_lxml(event, changes, root):
+    index_path = os.path.join(root, event, 'schedule', 'index.html')
+    tree = lxml_html.parse(index_path)
+
+    # Fix the SVGs
+    containers = tree.xpath(f'//div[{_xp_class("export-qrcode-image")}]')
+    assert len(containers) == 2
+    for i, svg_path in enumerate((ICS_SVG, XML_SVG)):
+        with open(svg_path) as fd:
+            tag = lxml_html.fragment_fromstring(fd.read())
+        old = _first(containers[i], './/svg')
+        tag.set('width', old.get('width'))
+        tag.set('height', old.get('height'))
+        tag.tail = old.tail
+        old.getparent().replace(old, tag)
+
+    # Hide rooms, if needed.
+    for class_name in ('pretalx-schedule-day-room-header',
+                       'pretalx-schedule-room'):
+        divs = tree.xpath(f'//div[{_xp_class(class_name)}]')
+        for i in ROOMS_TO_REMOVE:
+            if i < len(divs):
+                divs[i].set('style', 'display: none;')
+
+    # Fix titles and authors
+    talks = tree.xpath(f'//div[{_xp_class("pretalx-schedule-talk")}]')
+    for container in talks:
+        code = container.get('id')
+        if code not in changes:
+            continue
+
+        spans = container.xpath('(.//div)[1]//span')
+        title_span = spans[0]
+        if not _has_class(title_span, 'pretalx-schedule-talk-title'):
+            continue
+
+        authors_span = spans[1]
+        if not _has_class(authors_span, 'pretalx-schedule-talk-speakers'):
+            continue
+        all_authors = [s.strip() for s in
+                       authors_span.text_content().strip()[1:-1].split(',')]
+
+        new_title, first_author = changes[code]
+
+        # Now make the changes
+        _set_text(title_span, new_title)
+        _set_text(authors_span, fix_auth_order(first_author, all_authors))
+        container.set('class', ' '.join(
+            container.get('class', '').split() +
+            [mkcssclass(new_title.split(' (')[0])]
+        ))
+    return _to_string(tree)
+
+
+def edit_talk_lxml(event, subs_to_hide, root):
+    talk_path = os.path.join(root, event, 'talk', 'index.html')
+    tree = lxml_html.parse(talk_path)
+
+    for section in tree.iter('section'):
+        a = _first(section, f'(.//h3[{_xp_class("talk-title")}])[1]//a')
+        if a is None:
+            continue
+
+        if _extract_code(a) in subs_to_hide:
+            section.set('style', 'display: none;')
+    return _to_string(tree)
+
+
+def edit_speaker_lxml(event, subs_to_hide, root):
+    talk_path = os.path.join(root, event, 'speaker', 'index.html')
+    tree = lxml_html.parse(talk_path)
+
+    for section in tree.iter('section'):
+        if _first(section, f'.//h3[{_xp_class("talk-title")}]') is None:
+            continue
+
+        p = _first(section, './/p')
+        if p is None:
+            continue
+
+        links = p.findall('.//a')
+        codes = set(_extract_code(tag) for tag in links)
+        bad = codes.intersection(subs_to_hide)
+
+        # Same three cases as in edit_speaker()
+        if not bad:
+            continue
+
+        if bad == codes:
+            section.set('style', 'display: none;')
+            continue
+
+        # In lxml text nodes are the text/tail of elements: flatten them into
+        # a list of nodes first, like bs4 `p.contents`.
+        contents = [p.text] if p.text else []
+        for el in p:
+            contents.append(el)
+            if el.tail:
+                contents.append(el.tail)
+
+        new_content = []
+        for el in contents:
+            if getattr(el, 'tag', None) == 'a' and _extract_code(el) in bad:
+                if new_content:
+                    new_content.pop()
+                continue
+            new_content.append(el)
+
+        # Now rebuild p from new_content
+        p.text = None
+        for el in list(p):
+            p.remove(el)
+        last = None
+        for el in new_content:
+            if isinstance(el, str):
+                if last is None:
+                    p.text = (p.text or '') + el
+                else:
+                    last.tail = (last.tail or '') + el
+            else:
+                el.tail = None
+                p.append(el)
+                last = el
+    return _to_string(tree)
+
+
+ENGINES = {
+    'bs4': (edit_index, edit_talk, edit_speaker),
+    'lxml': (edit_index_lxml, edit_talk_lxml, edit_speaker_lxml),
+}
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--event', '-e', type=str, required=True,
@@ -214,46 +385,25 @@ if __name__ == '__main__':
                         help='new talk file')
     parser.add_argument('--speaker', '-s', type=str, required=True,
                         help='new speaker file')
+    parser.add_argument('--engine', type=str, choices=list(ENGINES),
+                        default='bs4',
+                        help='HTML engine: bs4 (prettified output) or lxml '
+                             '(faster, output not re-indented)')
     parser.add_argument('root', metavar='HTML_ROOT', type=str, nargs=1,
                         help='root of the pretalx HTML export')
     args = parser.parse_args()
     root = args.root[0]
 
-    conn = psycopg2.connect(database="pretalx",
-                            user="pretalx",
-                            password="",
-                            host="localhost",
-                            port="5432")
-    cur = conn.cursor()
-    cur.execute(SELECT)
-
-    # Submission code -> new title
-    changes = {}
-    for row in cur:
-        (pk, code, pid, title, first_author) = row
-
-        # Hack
-        if code in TUTORIAL_IDS:
-            new_title = f'Tutorial - {title}'
-        elif pid is not None:
-            typ = CODES[pid[0]]
-            new_title = f'{typ} ({pid}) - {title}'
-            assert code not in changes
-        else:
-            print(f'{title}: SKIPPED', file=sys.stderr)
-            continue
-
-        changes[code] = (new_title, first_author)
+    program = pretalx_model.Program.load()
+    changes = compute_changes(program.submissions)
 
     # Submissions to hide:
-    subs_to_hide = []
-    if TYPES_TO_REMOVE:
-        cur.execute(FIND_UNWANTED_TYPES % (str(tuple(TYPES_TO_REMOVE))))
-        subs_to_hide = set(res[0] for res in cur.fetchall())
-
-    index = edit_index(args.event, changes, root)
-    talk = edit_talk(args.event, subs_to_hide, root)
-    speaker = edit_speaker(args.event, subs_to_hide, root)
+    subs_to_hide = hidden_codes(program)
+
+    edit_index_fn, edit_talk_fn, edit_speaker_fn = ENGINES[args.engine]
+    index = edit_index_fn(args.event, changes, root)
+    talk = edit_talk_fn(args.event, subs_to_hide, root)
+    speaker = edit_speaker_fn(args.event, subs_to_hide, root)
 
     with open(args.index, 'w') as f:
         f.write(index)
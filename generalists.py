@@ -9,13 +9,16 @@ the list is a link to its own record in the ADASS program.
 import argparse
 import logging
 import os
-import psycopg2
 from pathlib import Path
 
+import pretalx_db
+import pretalx_model
+
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
 DEF_BASE = "/Users/jer/git/adassweb/website/content"
+DB_HOST = "pretalx.adass2020.es"
 program_url = "https://schedule.adass2020.es/adass2020/talk"
 folders = ["posters", "talks", "invited-talks", "bofs", "demos", "tutorials"]
 themes = {
@@ -31,6 +34,14 @@ themes = {
     "10": "Open Source Software and Community Development in Astronomy",
     "11": "Other",
 }
+# submission types
+POSTER_TYPES = (13, 18)
+INVITED_TYPE = 1
+CONTRIBUTED_TYPE = 3
+BOF_TYPE = 4
+TUTORIAL_TYPE = 14
+DEMO_TYPE = 15
+
 template = """
  _model: page
 ---
@@ -44,6 +55,41 @@ body:
 """
 
 
+def build_listings(program):
+    """
+    Bucket the confirmed submissions of `program` (pretalx_model.Program) by
+    type and theme, sorted by title as the database sorts them. Return
+    listings, bofs, demos, tutos as consumed by the fill_* functions.
+    """
+    listings = {
+        number: {"posters": [], "talks": {"invited": [], "contributed": []}}
+        for number in themes
+    }
+    # (type, paper_id prefix) -> where to go in listings[theme]
+    buckets = {(t, "P"): ("posters", ) for t in POSTER_TYPES}
+    buckets[(INVITED_TYPE, "I")] = ("talks", "invited")
+    buckets[(CONTRIBUTED_TYPE, "O")] = ("talks", "contributed")
+
+    def confirmed(type_ids):
+        subs = program.select(type_ids=type_ids, states=("confirmed", ))
+        subs = [s for s in subs if s.main_author is not None]
+        # Same order as ORDER BY title (i.e. the database collation)
+        return sorted(subs, key=lambda s: (s.title_rank, s.pk))
+
+    for sub in confirmed([t for t, _ in buckets]):
+        where = buckets.get((sub.type_id, sub.pid_prefix))
+        if where is None or sub.theme not in listings:
+            continue
+        bag = listings[sub.theme]
+        for key in where:
+            bag = bag[key]
+        bag.append(sub)
+    bofs = confirmed([BOF_TYPE])
+    demos = confirmed([DEMO_TYPE])
+    tutos = confirmed([TUTORIAL_TYPE])
+    return listings, bofs, demos, tutos
+
+
 def add_icons(pdf, video):
     icons = "- "
     if pdf:
@@ -53,116 +99,105 @@ def add_icons(pdf, video):
     return icons
 
 
+def page_header(item):
+    content = template
+    item = item.replace("-", " ")
+    content = content.replace("title:", f"title: {item.capitalize()}")
+    content = content.replace("description:", f"description: {item.capitalize()}")
+    if item == "bofs":
+        content = content.replace("Bofs", "BOFs")
+    return content
+
+
 def make_folder_structure(base):
     for item in folders:
-        fold = Path(item)
-        content = template
-        item = item.replace("-", " ")
-        content = content.replace("title:", f"title: {item.capitalize()}")
-        content = content.replace("description:", f"description: {item.capitalize()}")
-        if item == "bofs":
-            content = content.replace("Bofs", "BOFs")
-        Path.mkdir(base / fold, parents=True, exist_ok=True)
-        fn = open(base / fold / "contents.lr", "w")
-        fn.write(content)
-        fn.close()
+        Path.mkdir(base / Path(item), parents=True, exist_ok=True)
     log.info(" making folders successful")
 
 
-def fill_posters(base):
-    fold = Path(folders[0])
-    contents = ""
-    contents += """
+def write_page(base, item, parts):
+    """
+    Write the page `item` (header and body `parts`) unless contents.lr
+    already has that content, so that Lektor only rebuilds changed pages.
+    Return whether the page was written.
+    """
+    content = (page_header(item) + "".join(parts)).encode()
+    path = base / Path(item) / "contents.lr"
+    if os.path.isfile(path):
+        # Both are in memory anyway: comparing the bytes is what comparing
+        # their hashes would tell, minus the hashing.
+        with open(path, "rb") as f:
+            if f.read() == content:
+                return False
+
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+    return True
+
+
+def list_item(sub):
+    return (
+        f"{add_icons(sub.pdf_path, sub.video_path)} "
+        + f"<a href='{program_url}/{sub.code}' target='_schedule'>"
+        + f"{sub.title}</a>, {sub.main_author.name}\n"
+    )
+
+
+def abstract_block(sub):
+    return (
+        f"<b><a href='{program_url}/{sub.code}' "
+        + f"target='_schedule'>{sub.title}</a></b>\n\n"
+        + f"<b>{sub.main_author.name}</b>\n\n"
+        + f"{sub.abstract}\n\n"
+    )
+
+
+def fill_posters(base, listings):
+    parts = ["""
 #### NOTE
 **There are no specific posters sessions scheduled.**
 Instead conference participants will be allowed to download the PDF poster files from this list.
 They could also download optional complementary self-recorded lightning talks as MP4 video files.
 Access authentication info will be delivered in Discord, where participants could also interact 
 with posters authors individually or within the #posters channel. 
-    """
+    """]
     for number, label in themes.items():
-        bag = listings[number]["posters"]
-        contents += f"\n**{label.upper()}**\n\n"
-        for pack in bag:
-            title, abstract, code, author, pdf, video = pack
-            contents += f"{add_icons(pdf, video)} <a href='{program_url}/{code}' target='_schedule'>{title}</a>, {author}\n"
-    fn = open(base / fold / "contents.lr", "a")
-    fn.write(contents)
-    fn.close()
-
-
-def fill_talks(base):
-    fold = Path(folders[1])
-    contents = ""
+        parts.append(f"\n**{label.upper()}**\n\n")
+        parts.extend(list_item(sub) for sub in listings[number]["posters"])
+    return write_page(base, folders[0], parts)
+
+
+def fill_talks(base, listings):
+    parts = []
     for number, label in themes.items():
-        bag = listings[number]["talks"]["contributed"]
-        contents += f"\n**{label.upper()}**\n\n"
-        for pack in bag:
-            title, abstract, code, author, pdf, video = pack
-            contents += f"{add_icons(pdf, video)} <a href='{program_url}/{code}' target='_schedule'>{title}</a>, {author}\n"
-    fn = open(base / fold / "contents.lr", "a")
-    fn.write(contents)
-    fn.close()
-
-
-def fill_invited(base):
-    fold = Path(folders[2])
-    contents = ""
+        parts.append(f"\n**{label.upper()}**\n\n")
+        parts.extend(list_item(sub)
+                     for sub in listings[number]["talks"]["contributed"])
+    return write_page(base, folders[1], parts)
+
+
+def fill_invited(base, listings):
+    parts = []
     for number, label in themes.items():
         bag = listings[number]["talks"]["invited"]
         if len(bag):
-            contents += f"\n**{label.upper()}**\n\n"
-            for pack in bag:
-                title, abstract, code, author, pdf, video = pack
-                contents += f"{add_icons(pdf, video)} <a href='{program_url}/{code}' target='_schedule'>{title}</a>, {author}\n"
-    fn = open(base / fold / "contents.lr", "a")
-    fn.write(contents)
-    fn.close()
-
-
-def fill_bofs(base):
-    fold = Path(folders[3])
-    contents = ""
-    for pack in bofs:
-        title, abstract, code, author, pdf, video = pack
-        contents += (
-            f"<b><a href='{program_url}/{code}' "
-            + f"target='_schedule'>{title}</a></b>\n\n<b>{author}</b>\n\n"
-        )
-        contents += f"{abstract}\n\n"
-    fn = open(base / fold / "contents.lr", "a")
-    fn.write(contents)
-    fn.close()
-
-
-def fill_demos(base):
-    fold = Path(folders[4])
-    contents = ""
-    for pack in demos:
-        title, abstract, code, author, pdf, video = pack
-        contents += (
-            f"<b><a href='{program_url}/{code}' "
-            + f"target='_schedule'>{title}</a></b>\n\n<b>{author}</b>\n\n"
-        )
-        contents += f"{abstract}\n\n"
-    fn = open(base / fold / "contents.lr", "a")
-    fn.write(contents)
-    fn.close()
-
-
-def fill_tutos():
-    fold = Path(folders[5])
-    contents = ""
-    for pack in tutos:
-        title, abstract, code, author, pdf, video = pack
-        contents += (
-            f"<b><a href='{program_url}/{code}' "
-            + f"target='_schedule'>{title}</a></b>\n\n<b>{author}</b>\n\n"
-        )
-        contents += f"{abstract}\n\n"
-    fn = open(base / fold / "contents.lr", "a")
-    fn.write(contents)
-    fn.close()
+            parts.append(f"\n**{label.upper()}**\n\n")
+            parts.extend(list_item(sub) for sub in bag)
+    return write_page(base, folders[2], parts)
+
+
+def fill_bofs(base, bofs):
+    return write_page(base, folders[3], [abstract_block(sub) for sub in bofs])
+
+
+def fill_demos(base, demos):
+    return write_page(base, folders[4], [abstract_block(sub) for sub in demos])
+
+
+def fill_tutos(base, tutos):
+    return write_page(base, folders[5], [abstract_block(sub) for sub in tutos])
 
 
 if __name__ == "__main__":
@@ -175,116 +210,37 @@ if __name__ == "__main__":
         default=DEF_BASE,
         help="root of the lektor site (website/content)",
     )
+    parser.add_argument(
+        "--snapshot",
+        metavar="PATH",
+        type=str,
+        help="read from this pretalx_snapshot.py SQLite file instead of "
+        "the database",
+    )
     args = parser.parse_args()
+    if args.snapshot:
+        pretalx_db.use_snapshot(args.snapshot)
     base = args.base[0]
 
     if not os.path.isdir(base):
         parser.error(f"{base}: no such file or directory")
 
-    listings = {}
-    demos = []
-    tutos = []
-    bofs = []
-
-    # connect to posgre pretalx
-    with psycopg2.connect(
-        database="pretalx",
-        user="pretalx",
-        password="",
-        host="pretalx.adass2020.es",
-        port="5432",
-    ) as conn:
-
-        # build listings data structure
-        sql = """
-        SELECT
-        title, abstract, submission_submission.code, name, pdf_path, video_path
-        FROM
-        submission_submission,
-        person_user
-        WHERE
-        submission_submission.main_author_id=person_user.id
-        AND submission_submission.state='confirmed'
-        """
-        for number, label in themes.items():
-            listings[number] = {
-                "posters": [],
-                "talks": {"invited": [], "contributed": [],},
-            }
-            # add poster for each theme
-            sql_posters = sql
-            sql_posters += f"""
-                AND submission_submission.submission_type_id in (13, 18)
-                AND submission_submission.paper_id LIKE 'P{number}-%'
-                ORDER BY title
-                """
-            cur = conn.cursor()
-            cur.execute(sql_posters)
-            for row in cur:
-                listings[number]["posters"].append(row)
-
-            # add invited talks for each theme
-            sql_invited_talks = sql
-            sql_invited_talks += f"""
-                AND submission_submission.submission_type_id=1
-                AND submission_submission.paper_id LIKE 'I{number}-%'
-                ORDER BY title
-                """
-            cur = conn.cursor()
-            cur.execute(sql_invited_talks)
-            for row in cur:
-                listings[number]["talks"]["invited"].append(row)
-
-            # add contributed talks for each theme
-            sql_talks = sql
-            sql_talks += f"""
-                AND submission_submission.submission_type_id=3
-                AND submission_submission.paper_id LIKE 'O{number}-%'
-                ORDER BY title
-                """
-            cur = conn.cursor()
-            cur.execute(sql_talks)
-            for row in cur:
-                listings[number]["talks"]["contributed"].append(row)
-
-        # fill bofs
-        sql_bofs = sql
-        sql_bofs += """
-        AND submission_submission.submission_type_id=4
-        ORDER BY title
-        """
-        cur = conn.cursor()
-        cur.execute(sql_bofs)
-        for row in cur:
-            bofs.append(row)
-
-        # fill demos
-        sql_demos = sql
-        sql_demos += """
-        AND submission_submission.submission_type_id=15
-        ORDER BY title
-        """
-        cur = conn.cursor()
-        cur.execute(sql_demos)
-        for row in cur:
-            demos.append(row)
-
-        # fill tutos
-        sql_tutos = sql
-        sql_tutos += """
-        AND submission_submission.submission_type_id=14
-        ORDER BY title
-        """
-        cur = conn.cursor()
-        cur.execute(sql_tutos)
-        for row in cur:
-            tutos.append(row)
-
-        # start filling files
-        make_folder_structure()
-        fill_posters()
-        fill_talks()
-        fill_invited()
-        fill_bofs()
-        fill_demos()
-        fill_tutos()
+    # build listings data structure (one round trip)
+    listings, bofs, demos, tutos = build_listings(
+        pretalx_model.Program.load(host=DB_HOST)
+    )
+
+    # start filling files
+    make_folder_structure(base)
+    touched = {
+        folders[0]: fill_posters(base, listings),
+        folders[1]: fill_talks(base, listings),
+        folders[2]: fill_invited(base, listings),
+        folders[3]: fill_bofs(base, bofs),
+        folders[4]: fill_demos(base, demos),
+        folders[5]: fill_tutos(base, tutos),
+    }
+    for item, written in touched.items():
+        if written:
+            print(Path(base, item, "contents.lr"))
+    log.info(f"{sum(touched.values())} of {len(touched)} pages changed")
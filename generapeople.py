@@ -3,18 +3,19 @@ Build different lektor files with lists of people.
 The different files account for lists of participants and speakers.
 """
 import logging
-import psycopg2
 from pathlib import Path
-import gspread
 import pandas as pd
 
+import pretalx_db
+import registrations
+
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
 base = "/Users/jer/git/adassweb/website/content"
+DB_HOST = "pretalx.adass2020.es"
 program_url = "https://schedule.adass2020.es/adass2020/speaker/"
 folders = ["participants", "speakers"]
-speakers = []
 template = """
  _model: page
 ---
@@ -29,57 +30,61 @@ body:
 
 def make_folder_structure():
     for item in folders:
-        fold = Path(item)
-        content = template
-        content = content.replace("title:", f"title: {item.capitalize()}")
-        content = content.replace("description:", f"description: {item.capitalize()}")
-        Path.mkdir(base / fold, parents=True, exist_ok=True)
-        fn = open(base / fold / "contents.lr", "w")
-        fn.write(content)
-        fn.close()
+        Path.mkdir(base / Path(item), parents=True, exist_ok=True)
     log.info(" making folders successful")
 
 
-def fill_participants():
-    fold = Path(folders[0])
-    contents = ""
-    for idx, row in participants.iterrows():
-        contents += f"- {row['Name']} {row['Surname']} - {row['Affiliation']}\n"
-    fn = open(base / fold / "contents.lr", "a")
-    fn.write(contents)
-    fn.close()
-    log.info(f"filled {len(participants)} participants")
+def page_header(item):
+    content = template
+    content = content.replace("title:", f"title: {item.capitalize()}")
+    content = content.replace("description:", f"description: {item.capitalize()}")
+    return content
 
 
-def fill_speakers():
-    fold = Path(folders[1])
-    contents = ""
-    speakers.sort(key=lambda tup: tup[1])  # sorts in place
-    for pack in speakers:
-        name, surname, code, affiliation = pack
-        contents += f"- <a href='{program_url}/{code}' target='_schedule'>{name} {surname}</a> - {affiliation}\n"
-    fn = open(base / fold / "contents.lr", "a")
-    fn.write(contents)
-    fn.close()
-    log.info(f"filled {len(speakers)} speakers")
+def write_page(item, lines):
+    # header and list in a single write
+    with open(base / Path(item) / "contents.lr", "w") as fn:
+        fn.write(page_header(item) + "".join(lines))
+
 
+def _str(column):
+    return column.fillna("").astype(str)
 
-gc = gspread.service_account()
-wks = gc.open('ADASS XXX Registrations').sheet1
-gdf = pd.DataFrame(wks.get_all_records())[1:]
 
-# fetch participants
-invited = gdf[gdf["INVITED"] == "Yes"]
-not_invited = gdf[gdf["INVITED"] == ""]
-payed = not_invited[not_invited["Amount"] != 0]
-df = pd.concat([invited, payed])
-participants = df.sort_values("Surname")
+def _key(emails):
+    return emails.astype(str).str.strip().str.lower()
+
+
+def join_speakers(participants, pgdf):
+    """
+    Match all pretalx speakers with their registration in one join on the
+    (normalised) email. The first registration wins, as participants are
+    sorted by surname. The result is sorted by surname as well.
+    """
+    regs = participants.assign(_key=_key(participants["Email"]))
+    regs = regs.drop_duplicates("_key")[
+        ["_key", "Name", "Surname", "Affiliation"]]
+    joined = pgdf.assign(_key=_key(pgdf["email"])).merge(
+        regs, on="_key", how="inner")
+    return joined.sort_values("Surname", kind="stable")
+
+
+def fill_participants(participants):
+    lines = ("- " + _str(participants["Name"]) + " "
+             + _str(participants["Surname"])
+             + " - " + _str(participants["Affiliation"]) + "\n")
+    write_page(folders[0], lines)
+    log.info(f"filled {len(participants)} participants")
+
+
+def fill_speakers(speakers):
+    lines = ("- <a href='" + program_url + "/" + _str(speakers["code"])
+             + "' target='_schedule'>" + _str(speakers["Name"]) + " "
+             + _str(speakers["Surname"]) + "</a> - "
+             + _str(speakers["Affiliation"]) + "\n")
+    write_page(folders[1], lines)
+    log.info(f"filled {len(speakers)} speakers")
 
-conn = psycopg2.connect(database="pretalx",
-                        user="pretalx",
-                        password="",
-                        host="pretalx.adass2020.es",
-                        port="5432")
 
 # grab speakers
 sql = """
@@ -95,20 +100,22 @@ AND submission_submission_speakers.user_id=person_user.id
 AND submission_submission.submission_type_id in(1,3,4,14,15,17)
 AND submission_submission.state='confirmed';
 """
-pgdf = pd.read_sql_query(sql, conn)
-for idx, row in pgdf.iterrows():
-    if not participants[participants["Email"] == row["email"]].empty:
-        name = participants[participants["Email"] == row["email"]]["Name"].values[0]
-        surname = participants[participants["Email"] == row["email"]]["Surname"].values[0]
-        affiliation = participants[participants["Email"] == row["email"]]["Affiliation"].values[0]
-        speakers.append((name, surname, row["code"], affiliation))
 
 
-# start filling files
-make_folder_structure()
-fill_participants()
-fill_speakers()
+if __name__ == "__main__":
+    gdf = registrations.load_registrations()
+
+    # fetch participants
+    invited = gdf[gdf["INVITED"] == "Yes"]
+    not_invited = gdf[gdf["INVITED"] == ""]
+    payed = not_invited[not_invited["Amount"] != 0]
+    df = pd.concat([invited, payed])
+    participants = df.sort_values("Surname")
 
-# close connection
-conn.close()
+    with pretalx_db.connection(host=DB_HOST) as conn:
+        pgdf = pd.read_sql_query(sql, conn)
 
+    # start filling files
+    make_folder_structure()
+    fill_participants(participants)
+    fill_speakers(join_speakers(participants, pgdf))
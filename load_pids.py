@@ -1,37 +1,121 @@
 """
 Add PID (paper ID) values to the relevant entries in the pretalx DB.
 
+The papers file is the output of adass_themes.py: either the text form
+(papers.tab) or --format csv/json (papers.csv, papers.json). All PIDs are
+copied into a temporary table and applied with a single UPDATE. With --diff
+nothing is changed: the PIDs that would change are printed instead.
+
 Usage:
-    load_pids.py papers.tab
+    load_pids.py [--diff] papers.tab
 """
+import argparse
+import csv
+import io
+import json
+import os
 import sys
-import psycopg2
-
-
-SQL = "UPDATE submission_submission SET paper_id = '{}' WHERE id = {}"
-
-
-# This could/should be better :-)
-try:
-    fname = sys.argv[1]
-except IndexError:
-    print('usage: load_pids.py /path/to/papers.tab', file=sys.stderr)
-    sys.exit(1)
-
-with psycopg2.connect(database="pretalx", user="pretalx", password="",
-                      host='localhost') as conn:
-    with conn.cursor() as cur, open(fname) as f:
-        # Here we are in a transaction
-        # The papers.tab format is:
-        # submission.id, "submission.title"\s*; PID
-        for row in f:
-            if row.startswith('#'):
-                continue
-            aid, the_rest = row.split(',', maxsplit=1)
-            title, pid = the_rest.rsplit(';', maxsplit=1)
-
-            aid = int(aid.strip())
-            title = title.strip()[1:-1]            # remove quotes
-            pid = pid.strip()
-            assert int(pid.split('-')[-1]) == aid
-            cur.execute(SQL.format(pid, aid))
+
+import pretalx_db
+
+
+STAGE_SQL = '''\
+CREATE TEMPORARY TABLE pids (
+    id integer PRIMARY KEY,
+    paper_id text NOT NULL
+) ON COMMIT DROP'''
+COPY_SQL = 'COPY pids (id, paper_id) FROM STDIN WITH (FORMAT csv)'
+DIFF_SQL = '''\
+SELECT
+    pids.id,
+    submission_submission.paper_id,
+    pids.paper_id
+FROM
+    pids
+    LEFT JOIN submission_submission ON submission_submission.id = pids.id
+WHERE
+    submission_submission.paper_id IS DISTINCT FROM pids.paper_id
+ORDER BY
+    pids.id'''
+UPDATE_SQL = '''\
+UPDATE submission_submission
+SET paper_id = pids.paper_id
+FROM pids
+WHERE
+    submission_submission.id = pids.id
+    AND submission_submission.paper_id IS DISTINCT FROM pids.paper_id'''
+
+
+def _read_text(f):
+    # The papers.tab format is:
+    # submission.id, "submission.title"\s*; PID
+    for row in f:
+        if row.startswith('#') or not row.strip():
+            continue
+        aid, the_rest = row.split(',', maxsplit=1)
+        title, pid = the_rest.rsplit(';', maxsplit=1)
+        yield int(aid.strip()), pid.strip()
+
+
+def _read_csv(f):
+    for rec in csv.DictReader(f):
+        yield int(rec['id']), rec['pid'].strip()
+
+
+def _read_json(f):
+    for rec in json.load(f):
+        yield int(rec['id']), rec['pid'].strip()
+
+
+READERS = {
+    '.csv': _read_csv,
+    '.json': _read_json,
+}
+
+
+def read_papers(fname):
+    """Return the [(submission id, PID), ...] in the papers file."""
+    reader = READERS.get(os.path.splitext(fname)[1].lower(), _read_text)
+    with open(fname, newline='') as f:
+        papers = list(reader(f))
+    for aid, pid in papers:
+        assert int(pid.split('-')[-1]) == aid, f'{pid} is not for {aid}'
+    return papers
+
+
+def stage(cur, papers):
+    """Copy the papers in the pids temporary table."""
+    buf = io.StringIO()
+    csv.writer(buf).writerows(papers)
+    buf.seek(0)
+    cur.execute(STAGE_SQL)
+    cur.copy_expert(COPY_SQL, buf)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--diff', action='store_true',
+                        help='only show the PIDs that would change')
+    parser.add_argument('fname', metavar='PAPERS',
+                        help='adass_themes.py output (text, .csv or .json)')
+    args = parser.parse_args()
+
+    papers = read_papers(args.fname)
+
+    # Here we are in a transaction
+    with pretalx_db.connection() as conn:
+        with conn.cursor() as cur:
+            stage(cur, papers)
+            if args.diff:
+                cur.execute(DIFF_SQL)
+                writer = csv.writer(sys.stdout)
+                writer.writerow(['id', 'old', 'new'])
+                for aid, old, new in cur:
+                    writer.writerow([aid, old, new])
+                print(f'# {cur.rowcount} of {len(papers)} PIDs would change',
+                      file=sys.stderr)
+                conn.rollback()
+            else:
+                cur.execute(UPDATE_SQL)
+                print(f'# {cur.rowcount} of {len(papers)} PIDs changed',
+                      file=sys.stderr)
@@ -7,36 +7,24 @@ and displays the following lists.
 - Main authors in pretalx not registered in ADASS
 - Main authors with contributions confirmed in pretalx not registered in ADASS
 - Main authors with contributions confirmed in pretalx registered in ADASS
+
+The crossmatch is a single join on the normalised (stripped, lower case)
+email. The lists can also be written as CSV or JSON (--format).
 """
-import psycopg2
-from sshtunnel import SSHTunnelForwarder
+import argparse
+import json
+import sys
 import pandas as pd
-import gspread
-
-PASSWD = "*****"
-KEYFILE = "/users/jer/.ssh/id_rsa"
-GOOGLE_DOC = "*****"
 
-# create an ssh tunnel
-tunnel = SSHTunnelForwarder(
-    ("www.adass2020.es", 22),
-    ssh_username="root",
-    ssh_pkey=KEYFILE,
-    ssh_private_key_password=PASSWD,
-    remote_bind_address=("localhost", 5432),
-    local_bind_address=("localhost", 6543),
-)
+import pretalx_db
+import registrations
 
-# start the tunnel
-tunnel.start()
-
-# create a database connection
-conn = psycopg2.connect(database="pretalx", user="pretalx", host=tunnel.local_bind_host, port=tunnel.local_bind_port,)
+GOOGLE_DOC = "*****"
 
 sql = """
-SELECT 
+SELECT
 submission_submission.title, submission_submission.state, submission_submission.paper_id, person_user.email
-FROM 
+FROM
 submission_submission,
 person_user
 WHERE
@@ -44,51 +32,108 @@ submission_submission.main_author_id=person_user.id
 AND submission_submission.state not in ('deleted', 'withdrawn')
 ORDER BY email;
 """
-postgredf = pd.read_sql_query(sql, conn)
-conn.close()
-
-# stop the tunnel
-tunnel.stop()
-
-# open google spreadsheet
-gc = gspread.service_account()
-wks = gc.open('ADASS XXX Registrations').sheet1
-gdf = pd.DataFrame(wks.get_all_records())[1:]
-
-invited = gdf[gdf["INVITED"] == "Yes"]
-not_invited = gdf[gdf["INVITED"] == ""]
-not_registered = not_invited[not_invited["Amount"] == 0]
-payed = not_invited[not_invited["Amount"] != 0]
-registered = pd.concat([invited, payed])
-
-print("-------------------------------------------")
-print("People in Google spreadsheet not registered")
-print("-------------------------------------------")
-print(not_registered["Email"])
-
-i = 1
-print("---------------------------")
-print("Main authors not registered")
-print("---------------------------")
-for idx, row in postgredf.iterrows():
-    if registered[registered["Email"] == row["email"]].empty:
-        print(f"{i}; {row['email']}; {row['title']}")
-        i += 1
-
-i = 1
-print("--------------------------------------------------------")
-print("Main authors not registered with contributions confirmed")
-print("--------------------------------------------------------")
-for idx, row in postgredf.iterrows():
-    if registered[registered["Email"] == row["email"]].empty and row["state"] == "confirmed":
-        print(f"{i}; {row['email']}; {row['title']}")
-        i += 1
-
-i = 1
-print("----------------------------------------------------")
-print("Main authors registered with contributions confirmed")
-print("----------------------------------------------------")
-for idx, row in postgredf.iterrows():
-    if not registered[registered["Email"] == row["email"]].empty and row["state"] == "confirmed":
-        print(f"{i}; {row['email']}; {row['paper_id']}; {row['title']}")
-        i += 1
+
+# list name -> (title, columns to print)
+LISTS = {
+    "not_registered": (
+        "People in Google spreadsheet not registered", ["Email"]),
+    "authors_not_registered": (
+        "Main authors not registered", ["email", "title"]),
+    "confirmed_not_registered": (
+        "Main authors not registered with contributions confirmed",
+        ["email", "title"]),
+    "confirmed_registered": (
+        "Main authors registered with contributions confirmed",
+        ["email", "paper_id", "title"]),
+}
+
+
+def fetch_submissions():
+    # through the (shared) ssh tunnel, see pretalx_db for the settings
+    with pretalx_db.connection(tunnel=True) as conn:
+        return pd.read_sql_query(sql, conn)
+
+
+def normalise_email(emails):
+    return emails.astype(str).str.strip().str.lower()
+
+
+def crossmatch(postgredf, gdf):
+    """
+    Return the list name -> DataFrame dict of all the lists in LISTS, out of
+    the pretalx main authors `postgredf` and the registrations `gdf`.
+    """
+    invited = gdf[gdf["INVITED"] == "Yes"]
+    not_invited = gdf[gdf["INVITED"] == ""]
+    not_registered = not_invited[not_invited["Amount"] == 0]
+    payed = not_invited[not_invited["Amount"] != 0]
+    registered = pd.concat([invited, payed])
+
+    # One hash join for all the lists: the indicator tells us whether each
+    # main author email is among the registered ones.
+    keys = pd.DataFrame({"_key": normalise_email(registered["Email"])})
+    authors = postgredf.assign(_key=normalise_email(postgredf["email"]))
+    merged = authors.merge(keys.drop_duplicates(), on="_key", how="left",
+                           indicator=True)
+    is_registered = merged["_merge"] == "both"
+    is_confirmed = merged["state"] == "confirmed"
+    merged = merged.drop(columns=["_key", "_merge"])
+
+    return {
+        "not_registered": not_registered,
+        "authors_not_registered": merged[~is_registered],
+        "confirmed_not_registered": merged[~is_registered & is_confirmed],
+        "confirmed_registered": merged[is_registered & is_confirmed],
+    }
+
+
+def print_lists(lists, out=sys.stdout):
+    for name, (title, columns) in LISTS.items():
+        df = lists[name]
+        print("-" * len(title), file=out)
+        print(title, file=out)
+        print("-" * len(title), file=out)
+        if name == "not_registered":
+            print(df["Email"], file=out)
+            continue
+        for i, row in enumerate(df[columns].itertuples(index=False), 1):
+            print("; ".join([str(i)] + [str(v) for v in row]), file=out)
+
+
+def write_lists(lists, fmt, out):
+    """Write the lists to the file `out` in the format `fmt`."""
+    if fmt == "text":
+        print_lists(lists, out)
+    elif fmt == "csv":
+        # A single table: the list name is in the first column.
+        pd.concat(
+            [lists[name][columns].assign(list=name)[["list"] + columns]
+             for name, (_, columns) in LISTS.items()]
+        ).to_csv(out, index=False)
+    else:
+        json.dump({name: lists[name][columns].to_dict(orient="records")
+                   for name, (_, columns) in LISTS.items()}, out, indent=1,
+                  default=str)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--format", "-f", choices=("text", "csv", "json"),
+                        default="text", help="output format [text]")
+    parser.add_argument("--output", "-o", type=str,
+                        help="output file [defaults to STDOUT]")
+    parser.add_argument("--snapshot", type=str, metavar="PATH",
+                        help="read from this pretalx_snapshot.py SQLite "
+                             "file instead of the database")
+    args = parser.parse_args()
+    if args.snapshot:
+        pretalx_db.use_snapshot(args.snapshot)
+
+    lists = crossmatch(fetch_submissions(),
+                       registrations.load_registrations())
+
+    if args.output:
+        with open(args.output, "w") as out:
+            write_lists(lists, args.format, out)
+    else:
+        write_lists(lists, args.format, sys.stdout)
@@ -1,17 +1,239 @@
 """
-Parse the ics calendar generated by pretalx to remove poster contributions.
+Filter the events of the ics calendar generated by pretalx (e.g. to remove
+poster contributions).
+
+The calendar is streamed line by line: events are kept or dropped as a whole
+and everything that is not an event is written out as is.
+
+Usage:
+    % parseics.py -x Posters URL > talks_schedule.ics
+    % parseics.py -l 'Room 1' --after 2020-11-09T00:00 schedule.ics
+    % cat schedule.ics | parseics.py -t Tutorial
+
+where the calendar can be a local file, - (stdin) or a URL. With --cache, URLs
+are only downloaded again if they changed (ETag/If-Modified-Since).
 """
-from ics import Calendar, Event
-import requests
+import argparse
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import io
+import json
+import os
+import sys
+from zoneinfo import ZoneInfo
+
+
+URL = 'https://schedule.adass2020.es/adass2020/schedule/export/schedule.ics'
+
+
+def _strip(line):
+    return line.rstrip('\r\n')
+
+
+def iter_events(lines):
+    """
+    Split the iCalendar `lines` in events and everything else. Yield
+    (True, event_lines) for each VEVENT (from BEGIN:VEVENT to END:VEVENT) and
+    (False, line) for each other line. Lines are not modified in any way.
+    """
+    event = None
+    for line in lines:
+        if event is None:
+            if _strip(line) == 'BEGIN:VEVENT':
+                event = [line]
+            else:
+                yield False, line
+            continue
+
+        event.append(line)
+        if _strip(line) == 'END:VEVENT':
+            yield True, event
+            event = None
+
+    # Unterminated event: give it back as is.
+    if event:
+        yield from ((False, line) for line in event)
+
+
+def _unescape(value):
+    return value.replace('\\,', ',').replace('\\;', ';') \
+                .replace('\\n', '\n').replace('\\N', '\n') \
+                .replace('\\\\', '\\')
+
+
+def ics_property(lines, name):
+    """
+    Return (params, value) of the first `name` property (e.g. LOCATION) in the
+    raw event `lines`, or None. The value is unfolded and unescaped.
+    """
+    name = name.upper()
+    n = len(name)
+    for i, line in enumerate(lines):
+        if line[:n].upper() != name or line[n:n + 1] not in (':', ';'):
+            continue
+        # Unfold the property: continuation lines start with a space or tab.
+        prop = _strip(line)
+        for cont in lines[i + 1:]:
+            if not cont.startswith((' ', '\t')):
+                break
+            prop += _strip(cont)[1:]
+        params, value = prop[n:].split(':', 1)
+        return params, _unescape(value)
+    return None
+
+
+def event_location(lines):
+    prop = ics_property(lines, 'LOCATION')
+    return prop[1] if prop else None
+
+
+def event_start(lines):
+    """Return DTSTART of the event as an aware datetime (or None)."""
+    prop = ics_property(lines, 'DTSTART')
+    if prop is None:
+        return None
+    params, value = prop
+    value = value.strip()
+    if len(value) == 8:
+        # All day event
+        return datetime.strptime(value, '%Y%m%d').replace(tzinfo=timezone.utc)
+
+    start = datetime.strptime(value[:15], '%Y%m%dT%H%M%S')
+    tzid = [p.split('=', 1)[1] for p in params.split(';')
+            if p.upper().startswith('TZID=')]
+    if value.endswith('Z') or not tzid:
+        return start.replace(tzinfo=timezone.utc)
+    return start.replace(tzinfo=ZoneInfo(tzid[0].strip('"')))
+
+
+def make_filter(locations=None, exclude_locations=None, tracks=None,
+                after=None, before=None):
+    """Return a function telling whether to keep an event (list of lines)."""
+    def keep(lines):
+        if locations or exclude_locations:
+            location = event_location(lines)
+            if locations and location not in locations:
+                return False
+            if exclude_locations and location in exclude_locations:
+                return False
+        if tracks:
+            categories = ics_property(lines, 'CATEGORIES')
+            if not categories or not tracks.intersection(
+                    c.strip() for c in categories[1].split(',')):
+                return False
+        if after or before:
+            start = event_start(lines)
+            if start is None:
+                return False
+            if after and start < after:
+                return False
+            if before and start >= before:
+                return False
+        return True
+    return keep
+
+
+def filter_events(lines, keep):
+    """Stream `lines` dropping all events for which keep(event) is false."""
+    for is_event, chunk in iter_events(lines):
+        if not is_event:
+            yield chunk
+        elif keep(chunk):
+            yield from chunk
+
+
+def fetch(url, cache):
+    """
+    Download `url` into the `cache` file, unless it did not change since the
+    last time, and return the path of the cache.
+    """
+    import requests
+
+    meta_path = f'{cache}.json'
+    headers = {}
+    if os.path.isfile(cache) and os.path.isfile(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    with requests.get(url, headers=headers, stream=True, timeout=60) as r:
+        if r.status_code == 304:
+            return cache
+        r.raise_for_status()
+
+        with open(f'{cache}.tmp', 'wb') as f:
+            for chunk in r.iter_content(chunk_size=1 << 16):
+                f.write(chunk)
+        os.replace(f'{cache}.tmp', cache)
+        with open(meta_path, 'w') as f:
+            json.dump({'etag': r.headers.get('ETag'),
+                       'last_modified': r.headers.get('Last-Modified')}, f)
+    return cache
+
+
+@contextmanager
+def open_calendar(source, cache=None):
+    """Open `source` (a path, - for stdin or a URL) as a text stream."""
+    # newline='' everywhere so that CRLF line endings are preserved.
+    if source == '-':
+        yield io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8',
+                               newline='')
+    elif source.startswith(('http://', 'https://')):
+        if cache:
+            with open(fetch(source, cache), newline='') as f:
+                yield f
+        else:
+            import requests
+
+            with requests.get(source, stream=True, timeout=60) as r:
+                r.raise_for_status()
+                r.raw.decode_content = True
+                yield io.TextIOWrapper(r.raw, encoding='utf-8', newline='')
+    else:
+        with open(source, newline='') as f:
+            yield f
+
+
+def _utc(value):
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt
 
-url = "https://schedule.adass2020.es/adass2020/schedule/export/schedule.ics"
-cal = Calendar(requests.get(url).text)
 
-c = Calendar()
-e = Event()
-for ev in cal.events:
-    if ev.location != "Posters":
-        c.events.add(ev)
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--location', '-l', type=str, action='append',
+                        help='only keep events in this location (repeatable)')
+    parser.add_argument('--exclude-location', '-x', type=str,
+                        action='append', dest='exclude_locations',
+                        help='drop events in this location (repeatable)')
+    parser.add_argument('--track', '-t', type=str, action='append',
+                        help='only keep events in this track (repeatable)')
+    parser.add_argument('--after', type=_utc,
+                        help='only keep events starting at or after this '
+                             'ISO time [UTC unless specified]')
+    parser.add_argument('--before', type=_utc,
+                        help='only keep events starting before this ISO time '
+                             '[UTC unless specified]')
+    parser.add_argument('--cache', type=str,
+                        help='local copy of the calendar when reading from a '
+                             'URL: only download it again if it changed')
+    parser.add_argument('source', metavar='CALENDAR', nargs='?', default=URL,
+                        help=f'path, - (stdin) or URL [defaults to {URL}]')
+    args = parser.parse_args()
 
-with open('talks_schedule.ics', 'w') as f:
-    f.write(str(c))
+    keep = make_filter(
+        locations=set(args.location or ()),
+        exclude_locations=set(args.exclude_locations or ()),
+        tracks=set(args.track or ()),
+        after=args.after,
+        before=args.before,
+    )
+    out = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', newline='')
+    with open_calendar(args.source, args.cache) as f:
+        out.writelines(filter_events(f, keep))
+    out.flush()
@@ -8,10 +8,17 @@ and HTML pages for all contributions. We want to add and update links to the
 PFD and MP4 in there as well.
 """
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
 import logging
+import os
 from pathlib import Path
+import shutil
 from bs4 import BeautifulSoup, Tag
-import psycopg2
+from psycopg2.extras import execute_values
+
+import pretalx_db
 
 
 # Configuration
@@ -19,6 +26,10 @@ FTP_ROOT = '/var/www/html/static/ftp'
 HTML_ROOT = '/var/www/schedule/adass2020/talk'
 MEDIA_ROOT = '/var/www/schedule/media'
 MEDIA_URL_ROOT = 'https:\/\/adass2020.es/static/ftp'
+# Keep this outside of HTML_ROOT (that gets rsync --delete'd on every publish):
+# next to this script.
+MANIFEST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'pdf_video_manifest.json')
 
 SQL = '''\
 SELECT
@@ -34,6 +45,314 @@ ORDER BY
     paper_id
 '''
 
+# Only overwrite the columns for which we found a file.
+UPDATE_SQL = '''\
+UPDATE
+    submission_submission AS s
+SET
+    pdf_path = COALESCE(v.pdf_path, s.pdf_path),
+    video_path = COALESCE(v.video_path, s.video_path)
+FROM
+    (VALUES %s) AS v (code, pdf_path, video_path)
+WHERE
+    s.code = v.code
+'''
+
+RESOURCES_TEMPLATE = """\
+<section class="resources">
+  <div class="speaker-header">
+    <strong>From the FTP</strong>
+  </div>
+  <div>
+{links}
+  </div>
+</section>
+"""
+
+
+def _stat_sig(path):
+    """Return [mtime_ns, size] of `path` or None if it does not exist."""
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+def load_manifest(path):
+    if not path.is_file():
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, path):
+    # Write to a temp file first so that a crash never leaves a truncated
+    # manifest behind.
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def media_files(ftp_path, paper_id):
+    """All the PDF/MP4 files of `paper_id` in `ftp_path`."""
+    return [p for p in ftp_path.iterdir()
+            if p.suffix.lower() in ('.pdf', '.mp4') and paper_id in p.name]
+
+
+def find_newest_media(ftp_path, paper_id, files=None):
+    """
+    Return the (newest PDF, newest MP4) Path in `ftp_path` (among `files`, if
+    given). Either of the two can be None.
+    """
+    # Understand which pdf/mp4 file to use: probably the most recemt.
+    if files is None:
+        files = media_files(ftp_path, paper_id)
+    files = sorted(files, key=lambda path: path.stat().st_mtime)
+
+    # Find the newest PDF & MP4. Important that files is sorted in
+    # oldest -> newest since we remove elements from the back.
+    newest_pdf = None
+    newest_video = None
+    while files:
+        path = files.pop()
+        ext = path.suffix.lower()
+        if ext == '.pdf' and not newest_pdf:
+            newest_pdf = path
+        elif ext == '.mp4' and not newest_video:
+            newest_video = path
+        if newest_video and newest_pdf:
+            break
+    return newest_pdf, newest_video
+
+
+def cached_media(entry, ftp_path):
+    """
+    Return the (newest PDF, newest MP4) recorded in the manifest `entry` if
+    neither the FTP directory nor any of its PDF/MP4 files changed since, None
+    otherwise. Files added/removed change the directory signature, files
+    overwritten in place (e.g. an older upload that becomes the newest) their
+    own.
+    """
+    if not entry or entry['ftp'] != _stat_sig(ftp_path) \
+            or 'files' not in entry:
+        return None
+    for name, sig in entry['files'].items():
+        if _stat_sig(ftp_path / name) != sig:
+            return None
+
+    media = []
+    for key in ('pdf', 'video'):
+        if entry[key] is None:
+            media.append(None)
+            continue
+        name, mtime_ns, size = entry[key]
+        path = ftp_path / name
+        if _stat_sig(path) != [mtime_ns, size]:
+            return None
+        media.append(path)
+    return tuple(media)
+
+
+def render_resources(urls):
+    links = ' | '.join(
+        f'    <a href="{v}">{v.name}</a>' for v in urls if v is not None
+    )
+    return RESOURCES_TEMPLATE.format(links=links)
+
+
+def edit_talk_page(data, resources):
+    """
+    Inject the `resources` section in the talk HTML page `data` and return the
+    new HTML (or None if `data` does not look like a talk page).
+    """
+    soup = BeautifulSoup(data, 'html.parser')
+
+    aside = soup.find('aside')
+    if not aside or not isinstance(aside, Tag):
+        return None
+
+    existing = aside.find('section', 'resources')
+    new_tag = BeautifulSoup(resources, 'html.parser').section
+    if not existing:
+        aside.append(new_tag)
+    else:
+        existing.replace_with(new_tag)
+
+    # FIXME: this is very hackish!
+    # Is the HTML is about a poster (meaning something "scheduled" in
+    # the Posters room), remove the fake schedule info as well as the
+    # iCal file.
+    h3 = soup.find('h3', 'talk-title')
+
+    # We have two cases here: either h3.small is a simple tag with
+    # text inside (the scheduling info) or is a compound tag with the
+    # scheduling info as well as some i tags with the do not record
+    # icon etc. In this second case, the first element in the tag
+    # contents in the actual string.
+    # The schedule info is already gone if we edited this page before.
+    if not h3 or not h3.small:
+        pass
+    elif h3.small.string and h3.small.string.strip().endswith('Posters'):
+        h3.small.decompose()
+        h3.div.a.decompose()
+    elif h3.small.string is None:
+        txt = h3.small.contents[0]
+        if txt.strip().endswith('Posters'):
+            h3.small.decompose()
+            h3.div.a.decompose()
+    return soup.prettify()
+
+
+def edit_talk_file(index_path, resources):
+    """
+    Worker side of edit_talk_page(): read the talk page from disk and return
+    its new HTML (or None).
+    """
+    with open(index_path) as f:
+        data = f.read()
+    return edit_talk_page(data, resources)
+
+
+def atomic_write(path, data):
+    # Readers (i.e. the web server) either see the old or the new file, never
+    # a partially written one.
+    tmp_path = path.with_name(f'.{path.name}.tmp')
+    with open(tmp_path, 'w') as f:
+        f.write(data)
+    shutil.copymode(path, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def populate(conn, rows, ftp_root, html_root, media_url_root, manifest_path,
+             force=False, jobs=1):
+    """
+    Update the DB and talk pages for the (code, paper_id, pdf_path,
+    video_path) `rows` of the confirmed submissions (see SQL).
+    """
+    # paper_id -> state of its FTP directory, DB row and HTML page at the end
+    # of the last run.
+    old_manifest = {} if force else load_manifest(manifest_path)
+    manifest = {}
+
+    # (code, pdf_path, video_path) rows for the UPDATE and talk pages to edit.
+    updates = []
+    pages = []
+    for row in rows:
+        (code, paper_id, pdf_path, video_path) = row
+        if paper_id is None:
+            logging.warning(f'Talk code {code} has no paper_id!')
+            continue
+
+        ftp_path = ftp_root / paper_id
+        if not ftp_path.is_dir():
+            logging.warning(f'Directory {ftp_path} MISSING')
+            continue
+        index_path = html_root / code / 'index.html'
+        html_sig = _stat_sig(index_path)
+        if html_sig is None:
+            logging.warning(f'HTML file {index_path} MISSING')
+            continue
+
+        entry = old_manifest.get(paper_id)
+        if entry and entry['code'] != code:
+            entry = None
+        media = cached_media(entry, ftp_path)
+        ftp_changed = media is None
+        if ftp_changed:
+            files = media_files(ftp_path, paper_id)
+            media = find_newest_media(ftp_path, paper_id, files)
+            file_sigs = {p.name: _stat_sig(p) for p in files}
+        else:
+            file_sigs = entry['files']
+        newest_pdf, newest_video = media
+
+        if not newest_pdf and not newest_video:
+            # See if the PDF/MP4 was in the DB and just disappeared
+            if pdf_path or video_path:
+                logging.warning(f'!!!!! {code}: PDF/MP4 DISAPPEARED!!!!!!')
+            # else:
+            #     logging.warning(f'{code} has not uploaded a PDF/MP4')
+            continue
+
+        entry = {
+            'code': code,
+            'ftp': _stat_sig(ftp_path),
+            'files': file_sigs,
+            'pdf': None,
+            'video': None,
+        }
+        # We store the file url, not the absolute path
+        # Also, make sure that we can actually serve the files via HTTP(S)
+        if newest_pdf:
+            if ftp_changed:
+                newest_pdf.chmod(0o644)
+            entry['pdf'] = [newest_pdf.name] + _stat_sig(newest_pdf)
+            newest_pdf = media_url_root / paper_id / newest_pdf.name
+        if newest_video:
+            if ftp_changed:
+                newest_video.chmod(0o644)
+            entry['video'] = [newest_video.name] + _stat_sig(newest_video)
+            newest_video = media_url_root / paper_id / newest_video.name
+
+        d = {'pdf_path': newest_pdf, 'video_path': newest_video}
+        db = {'pdf_path': pdf_path, 'video_path': video_path}
+        resources = render_resources(d.values())
+        entry['resources'] = hashlib.sha1(resources.encode()).hexdigest()
+
+        db_changed = any(v is not None and str(v) != str(db[k])
+                         for k, v in d.items())
+        old_entry = old_manifest.get(paper_id)
+        html_changed = (
+            old_entry is None
+            or old_entry.get('resources') != entry['resources']
+            or old_entry.get('html') != html_sig
+        )
+        entry['html'] = html_sig
+        manifest[paper_id] = entry
+
+        if db_changed:
+            updates.append((code, *(str(v) if v is not None else None
+                                    for v in d.values())))
+        if html_changed:
+            pages.append((paper_id, code, index_path, resources))
+
+    # Update the database: all the changes in a single statement and
+    # transaction. Note that the connection was idle (no open transaction)
+    # while we were walking the FTP tree.
+    if updates:
+        with conn, conn.cursor() as cur:
+            execute_values(cur, UPDATE_SQL, updates)
+        logging.warning(f'{len(updates)} DB rows updated')
+
+    # Only touch the HTML once the DB changes have been committed. The soup
+    # edits are CPU bound: do them in worker processes and just write the
+    # results here.
+    paths = [index_path for (_, _, index_path, _) in pages]
+    contents = [resources for (_, _, _, resources) in pages]
+    if jobs > 1 and len(pages) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            chunksize = max(1, len(pages) // (4 * jobs))
+            htmls = list(executor.map(edit_talk_file, paths, contents,
+                                      chunksize=chunksize))
+    else:
+        htmls = list(map(edit_talk_file, paths, contents))
+
+    for (paper_id, code, index_path, _), html in zip(pages, htmls):
+        if html is None:
+            logging.warning(f'!!!! {code}: malformed HTML!!!!')
+            # Make sure that we try again next time.
+            del manifest[paper_id]
+            continue
+
+        atomic_write(index_path, html)
+        logging.warning(f'{code} was updated')
+        manifest[paper_id]['html'] = _stat_sig(index_path)
+
+    # Only persist the new state once the DB transaction has been committed.
+    save_manifest(manifest, manifest_path)
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -41,146 +360,21 @@ if __name__ == '__main__':
     parser.add_argument('--html_root', type=str, default=HTML_ROOT)
     parser.add_argument('--media_root', type=str, default=MEDIA_ROOT)
     parser.add_argument('--media_url_root', type=str, default=MEDIA_URL_ROOT)
+    parser.add_argument('--manifest', type=str, default=MANIFEST_PATH,
+                        help='state file used to skip unchanged contributions')
+    parser.add_argument('--force', action='store_true',
+                        help='ignore the manifest and process everything')
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count(),
+                        help='number of processes editing the HTML pages')
     args = parser.parse_args()
 
     ftp_root = Path(args.ftp_root)
     html_root = Path(args.html_root)
     media_root = Path(args.media_root)
     media_url_root = Path(args.media_url_root)
+    manifest_path = Path(args.manifest)
 
-    contribution_files = {}
-
-    with psycopg2.connect(database="pretalx", user="pretalx", password="",
-                          host="localhost", port="5432") as conn:
-        cur = conn.cursor()
-        cur.execute(SQL)
-
-        for row in cur:
-            (code, paper_id, pdf_path, video_path) = row
-            if paper_id is None:
-                logging.warning(f'Talk code {code} has no paper_id!')
-                continue
-
-            ftp_path = ftp_root / paper_id
-            if not ftp_path.is_dir():
-                logging.warning(f'Directory {ftp_path} MISSING')
-                continue
-            index_path = html_root / code / 'index.html'
-            if not index_path.is_file():
-                logging.warning(f'HTML file {index_path} MISSING')
-                continue
-
-            # Understand which pdf/mp4 file to use: probably the most recemt.
-            files = sorted(
-                [p for p in ftp_path.iterdir()
-                 if p.suffix.lower() in ('.pdf', '.mp4')
-                    and paper_id in p.name],
-                key=lambda path: path.stat().st_mtime
-            )
-            if not files:
-                # See if the PDF/MP4 was in the DB and just disappeared
-                if pdf_path or video_path:
-                    logging.warning(f'!!!!! {code}: PDF/MP4 DISAPPEARED!!!!!!')
-                # else:
-                #     logging.warning(f'{code} has not uploaded a PDF/MP4')
-                continue
-
-            # Find the newest PDF & MP4. Important that files is sorted in
-            # oldest -> newest since we remove elements from the back.
-            newest_pdf = None
-            newest_video = None
-            while files:
-                path = files.pop()
-                ext = path.suffix.lower()
-                if ext == '.pdf' and not newest_pdf:
-                    newest_pdf = path
-                elif ext == '.mp4' and not newest_video:
-                    newest_video = path
-                if newest_video and newest_pdf:
-                    break
-
-            # We store the file url, not the absolute path
-            # Also, make sure that we can actually serve the files via HTTP(S)
-            if newest_pdf:
-                newest_pdf.chmod(0o644)
-                newest_pdf = media_url_root / paper_id / newest_pdf.name
-            if newest_video:
-                newest_video.chmod(0o644)
-                newest_video = media_url_root / paper_id / newest_video.name
-
-            # if str(newest_pdf) == str(pdf_path) and \
-            #         str(newest_video) == str(video_path):
-            #     # Nothing to do!
-            #     logging.warning(f'{code} is already up to date! SKIPPED')
-            #     continue
-
-            d = {'pdf_path': newest_pdf, 'video_path': newest_video}
-
-            # Update the database
-            # FIXME: do all these updates in a single transaction!
-            with conn.cursor() as update_cur:
-                update = 'UPDATE submission_submission SET'
-                where = f"WHERE code = '{code}'"
-                values = ', '.join(
-                    f"{k} = '{v}'" for k, v in d.items() if v is not None
-                )
-                sql = f'{update} {values} {where}'
-                update_cur.execute(sql)
-
-            with open(index_path) as f:
-                data = f.read()
-            soup = BeautifulSoup(data, 'html.parser')
-
-            aside = soup.find('aside')
-            if not aside or not isinstance(aside, Tag):
-                logging.warning(f'!!!! {code}: malformed HTML!!!!')
-                continue
-
-            existing = aside.find('section', 'resources')
-
-            start = '''\
-<section class="resources">
-  <div class="speaker-header">
-    <strong>From the FTP</strong>
-  </div>
-  <div>
-'''
-            links = ' | '.join(
-                f'    <a href="{v}">{v.name}</a>' for v in d.values()
-                if v is not None
-            )
-            end = '''
-  </div>
-</section>
-'''
-            html = f'{start}{links}{end}'
-            new_tag = BeautifulSoup(html, 'html.parser').section
-            if not existing:
-                aside.contents.append(new_tag)
-            else:
-                existing.replace_with(new_tag)
-
-            # FIXME: this is very hackish!
-            # Is the HTML is about a poster (meaning something "scheduled" in
-            # the Posters room), remove the fake schedule info as well as the
-            # iCal file.
-            h3 = soup.find('h3', 'talk-title')
-
-            # We have two cases here: either h3.small is a simple tag with
-            # text inside (the scheduling info) or is a compound tag with the
-            # scheduling info as well as some i tags with the do not record
-            # icon etc. In this second case, the first element in the tag
-            # contents in the actual string.
-            if h3.small.string and h3.small.string.strip().endswith('Posters'):
-                h3.small.decompose()
-                h3.div.a.decompose()
-            elif h3.small.string is None:
-                txt = h3.small.contents[0]
-                if txt.strip().endswith('Posters'):
-                    h3.small.decompose()
-                    h3.div.a.decompose()
-
-            with open(index_path, 'w') as f:
-                f.write(soup.prettify())
-                logging.warning(f'{code} was updated')
-            # print(soup.prettify())
+    rows = pretalx_db.query(SQL)
+    with pretalx_db.connection() as conn:
+        populate(conn, rows, ftp_root, html_root, media_url_root,
+                 manifest_path, force=args.force, jobs=args.jobs)
@@ -0,0 +1,265 @@
+"""
+Shared access to the pretalx database.
+
+Connection settings come from the environment (falling back to the values
+each script used to hard-code):
+
+    PRETALX_DB_NAME, PRETALX_DB_USER, PRETALX_DB_PASSWORD, PRETALX_DB_HOST,
+    PRETALX_DB_PORT
+
+Connections are kept in a thread-safe pool per set of settings, so that
+stages and threads reuse them instead of connecting every time:
+
+    import pretalx_db
+
+    rows = pretalx_db.query(SQL, (type_id, ))
+    for row in pretalx_db.iter_query(BIG_SQL):     # server-side cursor
+        ...
+    with pretalx_db.connection() as conn:          # one transaction
+        ...
+
+Remote databases can be reached through an SSH tunnel (tunnel=True), set up
+once per process and shared by all connections. The tunnel settings are
+
+    PRETALX_SSH_HOST, PRETALX_SSH_PORT, PRETALX_SSH_USER, PRETALX_SSH_KEY,
+    PRETALX_SSH_KEY_PASSWORD, PRETALX_TUNNEL_PORT
+
+If something is already listening on PRETALX_TUNNEL_PORT (e.g. a tunnel
+started with `pretalx_db.py tunnel` in another terminal), it is used as is.
+
+After use_snapshot(PATH) (the --snapshot option of the report scripts) all
+reads go to the local SQLite snapshot made by pretalx_snapshot.py instead:
+%s placeholders are translated and the queries need to be plain SQL.
+
+Usage:
+    pretalx_db.py tunnel
+"""
+import argparse
+import atexit
+from contextlib import contextmanager
+from datetime import date, datetime
+import itertools
+import os
+import re
+import socket
+import sqlite3
+import threading
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+
+
+DB_SETTINGS = {
+    'database': os.environ.get('PRETALX_DB_NAME', 'pretalx'),
+    'user': os.environ.get('PRETALX_DB_USER', 'pretalx'),
+    'password': os.environ.get('PRETALX_DB_PASSWORD', ''),
+    'host': os.environ.get('PRETALX_DB_HOST'),
+    'port': os.environ.get('PRETALX_DB_PORT'),
+}
+DEFAULT_HOST = 'localhost'
+DEFAULT_PORT = '5432'
+POOL_SIZE = int(os.environ.get('PRETALX_DB_POOL_SIZE', 8))
+ITERSIZE = 2000
+
+SSH_HOST = os.environ.get('PRETALX_SSH_HOST', 'www.adass2020.es')
+SSH_PORT = int(os.environ.get('PRETALX_SSH_PORT', 22))
+SSH_USER = os.environ.get('PRETALX_SSH_USER', 'root')
+SSH_KEY = os.environ.get('PRETALX_SSH_KEY',
+                         os.path.expanduser('~/.ssh/id_rsa'))
+SSH_KEY_PASSWORD = os.environ.get('PRETALX_SSH_KEY_PASSWORD')
+TUNNEL_PORT = int(os.environ.get('PRETALX_TUNNEL_PORT', 6543))
+
+_lock = threading.Lock()
+_pools = {}
+_tunnel = None
+_cursor_ids = itertools.count()
+_snapshot = None
+
+# Column types used by pretalx_snapshot.py
+sqlite3.register_converter(
+    'timestamptz', lambda b: datetime.fromisoformat(b.decode()))
+sqlite3.register_converter(
+    'timestamp', lambda b: datetime.fromisoformat(b.decode()))
+sqlite3.register_converter('date', lambda b: date.fromisoformat(b.decode()))
+sqlite3.register_converter('boolean', lambda b: bool(int(b)))
+
+
+def settings(host=None, port=None):
+    """
+    Return the psycopg2.connect() keyword arguments. The environment wins over
+    the `host` and `port` given by the script, which win over the defaults.
+    """
+    conf = dict(DB_SETTINGS)
+    conf['host'] = conf['host'] or host or DEFAULT_HOST
+    conf['port'] = conf['port'] or port or DEFAULT_PORT
+    return conf
+
+
+def _listening(port, host='localhost'):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.settimeout(1)
+        return s.connect_ex((host, port)) == 0
+
+
+def open_tunnel(remote_port=DEFAULT_PORT):
+    """
+    Forward localhost:TUNNEL_PORT to the database on SSH_HOST (once per
+    process) and return the local (host, port).
+    """
+    global _tunnel
+
+    with _lock:
+        if _tunnel is None and not _listening(TUNNEL_PORT):
+            from sshtunnel import SSHTunnelForwarder
+
+            _tunnel = SSHTunnelForwarder(
+                (SSH_HOST, SSH_PORT),
+                ssh_username=SSH_USER,
+                ssh_pkey=SSH_KEY,
+                ssh_private_key_password=SSH_KEY_PASSWORD,
+                remote_bind_address=('localhost', int(remote_port)),
+                local_bind_address=('localhost', TUNNEL_PORT),
+            )
+            _tunnel.start()
+            atexit.register(_tunnel.stop)
+    return 'localhost', str(TUNNEL_PORT)
+
+
+class Pool:
+    """
+    ThreadedConnectionPool that makes callers wait for a free connection
+    instead of failing when all `maxconn` are in use.
+    """
+    def __init__(self, maxconn=POOL_SIZE, **conf):
+        self.pool = ThreadedConnectionPool(0, maxconn, **conf)
+        self.slots = threading.BoundedSemaphore(maxconn)
+
+    @contextmanager
+    def connection(self):
+        """
+        Yield a connection with a transaction that is committed on exit (or
+        rolled back on error).
+        """
+        with self.slots:
+            conn = self.pool.getconn()
+            broken = False
+            try:
+                with conn:
+                    yield conn
+            except (psycopg2.InterfaceError, psycopg2.OperationalError):
+                broken = True
+                raise
+            finally:
+                self.pool.putconn(conn, close=broken or bool(conn.closed))
+
+    def close(self):
+        self.pool.closeall()
+
+
+def get_pool(host=None, port=None, tunnel=False):
+    """Return the (shared) pool for these settings."""
+    conf = settings(host, port)
+    if tunnel:
+        conf['host'], conf['port'] = open_tunnel(conf['port'])
+    key = tuple(sorted(conf.items()))
+    with _lock:
+        if key not in _pools:
+            _pools[key] = Pool(**conf)
+            atexit.register(_pools[key].close)
+        return _pools[key]
+
+
+def use_snapshot(path):
+    """From now on, read from the SQLite snapshot in `path`."""
+    global _snapshot
+
+    if not os.path.isfile(path):
+        raise FileNotFoundError(path)
+    _snapshot = path
+
+
+def _sqlite_query(sql, params):
+    """Turn psycopg2 placeholders (%s, tuples for IN %s) into sqlite3 ones."""
+    if params is None:
+        return sql, ()
+    params = iter(params)
+    args = []
+
+    def placeholder(match):
+        if match.group() == '%%':
+            return '%'
+        param = next(params)
+        if isinstance(param, tuple):
+            args.extend(param)
+            return '(' + ', '.join('?' * len(param)) + ')'
+        args.append(param)
+        return '?'
+    return re.sub(r'%%|%s', placeholder, sql), args
+
+
+@contextmanager
+def _snapshot_connection():
+    conn = sqlite3.connect(f'file:{_snapshot}?mode=ro', uri=True,
+                           detect_types=sqlite3.PARSE_DECLTYPES)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+@contextmanager
+def connection(host=None, port=None, tunnel=False):
+    if _snapshot:
+        with _snapshot_connection() as conn:
+            yield conn
+        return
+    with get_pool(host, port, tunnel).connection() as conn:
+        yield conn
+
+
+def query(sql, params=None, **kwargs):
+    """Run `sql` with `params` and return all the rows."""
+    if _snapshot:
+        with _snapshot_connection() as conn:
+            return conn.execute(*_sqlite_query(sql, params)).fetchall()
+    with connection(**kwargs) as conn, conn.cursor() as cur:
+        cur.execute(sql, params)
+        return cur.fetchall()
+
+
+def iter_query(sql, params=None, itersize=ITERSIZE, **kwargs):
+    """
+    Yield the rows of `sql` from a named (server-side) cursor, fetched
+    `itersize` at a time: large results are never all in memory.
+    """
+    if _snapshot:
+        with _snapshot_connection() as conn:
+            yield from conn.execute(*_sqlite_query(sql, params))
+        return
+    with connection(**kwargs) as conn:
+        name = f'pretalx_db_{os.getpid()}_{next(_cursor_ids)}'
+        with conn.cursor(name=name) as cur:
+            cur.itersize = itersize
+            cur.execute(sql, params)
+            yield from cur
+
+
+def execute(sql, params=None, **kwargs):
+    """Run `sql` in its own transaction and return the number of rows."""
+    with connection(**kwargs) as conn, conn.cursor() as cur:
+        cur.execute(sql, params)
+        return cur.rowcount
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=('tunnel', ),
+                        help='tunnel: keep the SSH tunnel open until ^C')
+    args = parser.parse_args()
+
+    host, port = open_tunnel(settings()['port'])
+    print(f'PRETALX_DB_HOST={host} PRETALX_DB_PORT={port} (^C to stop)')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
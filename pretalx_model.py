@@ -0,0 +1,202 @@
+"""
+In-memory model of the conference program: all submissions with their main
+author, speakers and (latest schedule) room, loaded with a single query and
+indexed by code, paper_id, type, theme, room and speaker email.
+
+    import pretalx_model
+
+    program = pretalx_model.Program.load()
+    program.by_code['ABCDEF'].title
+    program.by_paper_id['O3-14'].main_author.name
+    for sub in program.by_theme['3']:
+        ...
+
+Submission and Speaker use __slots__: a few thousand of them take next to no
+memory and every index is a plain dict lookup.
+"""
+from collections import defaultdict
+
+import pretalx_db
+
+
+# One row per (submission, speaker). The room/start come from the latest
+# version of the schedule. The rank by title is there to sort by title in the
+# database collation, as ORDER BY title would.
+SQL = '''\
+SELECT
+    submission_submission.id,
+    submission_submission.code,
+    submission_submission.paper_id,
+    submission_submission.title,
+    submission_submission.abstract,
+    submission_submission.state,
+    submission_submission.submission_type_id,
+    submission_submission.pdf_path,
+    submission_submission.video_path,
+    main_author.id,
+    main_author.code,
+    main_author.name,
+    main_author.email,
+    speaker.id,
+    speaker.code,
+    speaker.name,
+    speaker.email,
+    schedule_room.name,
+    schedule_talkslot.start,
+    dense_rank() OVER (ORDER BY submission_submission.title)
+FROM
+    submission_submission
+    LEFT JOIN person_user AS main_author
+        ON submission_submission.main_author_id = main_author.id
+    LEFT JOIN submission_submission_speakers
+        ON submission_submission.id =
+            submission_submission_speakers.submission_id
+    LEFT JOIN person_user AS speaker
+        ON submission_submission_speakers.user_id = speaker.id
+    LEFT JOIN schedule_talkslot
+        ON submission_submission.id = schedule_talkslot.submission_id
+        AND schedule_talkslot.schedule_id = (
+            SELECT max(schedule_id) FROM schedule_talkslot)
+        AND schedule_talkslot.is_visible = true
+    LEFT JOIN schedule_room
+        ON schedule_talkslot.room_id = schedule_room.id
+ORDER BY
+    submission_submission.id,
+    submission_submission_speakers.id
+'''
+INACTIVE_STATES = ('deleted', 'withdrawn')
+
+
+class Speaker:
+    __slots__ = ('pk', 'code', 'name', 'email')
+
+    def __init__(self, pk, code, name, email):
+        self.pk = pk
+        self.code = code
+        self.name = name
+        self.email = email
+
+    def __repr__(self):
+        return f'Speaker({self.code!r}, {self.name!r})'
+
+
+class Submission:
+    __slots__ = ('pk', 'code', 'paper_id', 'title', 'abstract', 'state',
+                 'type_id', 'pdf_path', 'video_path', 'main_author',
+                 'speakers', 'room', 'start', 'title_rank')
+
+    def __init__(self, pk, code, paper_id, title, abstract, state, type_id,
+                 pdf_path, video_path, main_author=None, room=None,
+                 start=None, title_rank=None):
+        self.pk = pk
+        self.code = code
+        self.paper_id = paper_id
+        self.title = title
+        self.abstract = abstract
+        self.state = state
+        self.type_id = type_id
+        self.pdf_path = pdf_path
+        self.video_path = video_path
+        self.main_author = main_author
+        self.speakers = []
+        self.room = room
+        self.start = start
+        self.title_rank = title_rank
+
+    def __repr__(self):
+        return f'Submission({self.code!r}, {self.paper_id!r})'
+
+    @property
+    def pid_prefix(self):
+        """'O3-14' -> 'O'"""
+        return self.paper_id[0] if self.paper_id else None
+
+    @property
+    def theme(self):
+        """'O3-14' -> '3'"""
+        if not self.paper_id or '-' not in self.paper_id:
+            return None
+        return self.paper_id.split('-', 1)[0][1:] or None
+
+    @property
+    def active(self):
+        return self.state not in INACTIVE_STATES
+
+
+class Program:
+    """All submissions and speakers, with their indexes."""
+    def __init__(self, submissions):
+        self.submissions = list(submissions)
+        self.by_pk = {}
+        self.by_code = {}
+        self.by_paper_id = {}
+        self.by_type = defaultdict(list)
+        self.by_theme = defaultdict(list)
+        self.by_room = defaultdict(list)
+        self.by_speaker_email = defaultdict(list)
+        self.speakers = {}
+
+        for sub in self.submissions:
+            self.by_pk[sub.pk] = sub
+            self.by_code[sub.code] = sub
+            if sub.paper_id:
+                self.by_paper_id[sub.paper_id] = sub
+            self.by_type[sub.type_id].append(sub)
+            self.by_theme[sub.theme].append(sub)
+            self.by_room[sub.room].append(sub)
+            for speaker in sub.speakers:
+                self.speakers[speaker.pk] = speaker
+                if speaker.email:
+                    self.by_speaker_email[_email_key(speaker.email)].append(
+                        sub)
+
+    @classmethod
+    def load(cls, **kwargs):
+        """Load the whole program in one query (see pretalx_db.query)."""
+        return cls(build_submissions(pretalx_db.iter_query(SQL, **kwargs)))
+
+    def select(self, type_ids=None, states=None, theme=None):
+        """Return the submissions of the given types/states/theme."""
+        if theme is not None:
+            subs = self.by_theme.get(theme, [])
+        elif type_ids is not None:
+            subs = [s for t in type_ids for s in self.by_type.get(t, [])]
+            subs.sort(key=lambda s: s.pk)
+        else:
+            subs = self.submissions
+        return [s for s in subs
+                if (type_ids is None or s.type_id in type_ids)
+                and (states is None or s.state in states)]
+
+    def by_email(self, email):
+        """Submissions of the speaker with this email (any case/spaces)."""
+        return self.by_speaker_email.get(_email_key(email), [])
+
+
+def _email_key(email):
+    return email.strip().lower()
+
+
+def build_submissions(rows):
+    """Turn the (one per speaker) rows of SQL into Submissions."""
+    submissions = {}
+    speakers = {}
+
+    def speaker(pk, code, name, email):
+        if pk is None:
+            return None
+        if pk not in speakers:
+            speakers[pk] = Speaker(pk, code, name, email)
+        return speakers[pk]
+
+    for row in rows:
+        pk = row[0]
+        sub = submissions.get(pk)
+        if sub is None:
+            sub = submissions[pk] = Submission(
+                *row[:9], main_author=speaker(*row[9:13]), room=row[17],
+                start=row[18], title_rank=row[19])
+        spk = speaker(*row[13:17])
+        if spk is not None and spk not in sub.speakers:
+            sub.speakers.append(spk)
+    return submissions.values()
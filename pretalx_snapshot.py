@@ -0,0 +1,221 @@
+"""
+Keep a local SQLite snapshot of the pretalx tables the report scripts need,
+so that they can run with --snapshot PATH (no database, no tunnel).
+
+Snapshots are incremental. Rows are keyed on their id: for tables with an
+`updated` timestamp only the rows updated since the last snapshot are fetched,
+for the others the database computes an md5 of every row and only new or
+changed rows are fetched. Rows that are gone are deleted. Each snapshot is a
+single SQLite transaction.
+
+Sensitive columns (EXCLUDED_COLUMNS) are never copied.
+
+Usage:
+    pretalx_snapshot.py [--full] pretalx.sqlite
+    schedule_helper.py --snapshot pretalx.sqlite 3
+"""
+import argparse
+from datetime import date, datetime
+from decimal import Decimal
+import json
+import logging
+import sqlite3
+
+import pretalx_db
+
+
+log = logging.getLogger(__name__)
+
+TABLES = (
+    'submission_submission',
+    'submission_submission_speakers',
+    'submission_answer',
+    'submission_answer_options',
+    'submission_answeroption',
+    'submission_submissiontype',
+    'person_user',
+    'schedule_talkslot',
+    'schedule_room',
+)
+EXCLUDED_COLUMNS = {
+    'person_user': ('password', 'pw_reset_token', 'pw_reset_time'),
+}
+TIMESTAMP_COLUMN = 'updated'
+# Postgres type OID -> SQLite declared type (see the converters in pretalx_db)
+TYPES = {
+    16: 'BOOLEAN',
+    20: 'INTEGER', 21: 'INTEGER', 23: 'INTEGER',
+    700: 'REAL', 701: 'REAL', 1700: 'REAL',
+    1082: 'DATE',
+    1114: 'TIMESTAMP',
+    1184: 'TIMESTAMPTZ',
+}
+CHUNK = 1000
+
+META_SQL = '''\
+CREATE TABLE IF NOT EXISTS _snapshot (
+    name TEXT PRIMARY KEY,
+    columns TEXT NOT NULL,
+    updated TEXT,
+    taken TEXT NOT NULL
+)'''
+HASHES_SQL = '''\
+CREATE TABLE IF NOT EXISTS _snapshot_rows (
+    name TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    PRIMARY KEY (name, id)
+)'''
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _sqlite_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, default=str)
+    if isinstance(value, memoryview):
+        return bytes(value)
+    if value is None or isinstance(value, (int, float, str, bytes)):
+        return value
+    return str(value)
+
+
+def live_columns(table):
+    """Return [(name, sqlite type), ...] of `table` in the database."""
+    with pretalx_db.connection() as conn, conn.cursor() as cur:
+        cur.execute(f'SELECT * FROM {table} LIMIT 0')
+        excluded = EXCLUDED_COLUMNS.get(table, ())
+        return [(col.name, TYPES.get(col.type_code, 'TEXT'))
+                for col in cur.description if col.name not in excluded]
+
+
+def _create(db, table, columns):
+    db.execute(f'DROP TABLE IF EXISTS {table}')
+    db.execute('DELETE FROM _snapshot_rows WHERE name = ?', (table, ))
+    db.execute('DELETE FROM _snapshot WHERE name = ?', (table, ))
+    defs = ', '.join(f'{_quote(name)} {kind}' +
+                     (' PRIMARY KEY' if name == 'id' else '')
+                     for name, kind in columns)
+    db.execute(f'CREATE TABLE {table} ({defs})')
+
+
+def _store(db, table, names, rows):
+    placeholders = ', '.join('?' * len(names))
+    sql = f'INSERT OR REPLACE INTO {table} ' \
+          f'({", ".join(map(_quote, names))}) VALUES ({placeholders})'
+    n = 0
+    for row in rows:
+        db.execute(sql, [_sqlite_value(v) for v in row])
+        n += 1
+    return n
+
+
+def _delete_missing(db, table, live_ids):
+    db.execute('CREATE TEMP TABLE IF NOT EXISTS _live '
+               '(id INTEGER PRIMARY KEY)')
+    db.execute('DELETE FROM _live')
+    db.executemany('INSERT INTO _live VALUES (?)', ((i, ) for i in live_ids))
+    gone = db.execute(f'DELETE FROM {table} WHERE id NOT IN '
+                      '(SELECT id FROM _live)').rowcount
+    db.execute('DELETE FROM _snapshot_rows WHERE name = ? AND id NOT IN '
+               '(SELECT id FROM _live)', (table, ))
+    return gone
+
+
+def snapshot_table(db, table, full=False):
+    """
+    Bring `table` in the SQLite `db` up to date. Return (stored, deleted).
+    """
+    columns = live_columns(table)
+    names = [name for name, _ in columns]
+    select = ', '.join(map(_quote, names))
+    meta = db.execute('SELECT columns, updated FROM _snapshot WHERE name = ?',
+                      (table, )).fetchone()
+    if full or meta is None or \
+            json.loads(meta[0]) != [list(col) for col in columns]:
+        _create(db, table, columns)
+        meta = None
+
+    since = meta[1] if meta else None
+    if TIMESTAMP_COLUMN in names:
+        # Changed rows by timestamp (>=: rows sharing the last timestamp are
+        # just stored again).
+        sql = f'SELECT {select} FROM {table}'
+        params = None
+        if since:
+            sql += f' WHERE {TIMESTAMP_COLUMN} >= %s'
+            params = (since, )
+        stored = _store(db, table, names, pretalx_db.iter_query(sql, params))
+        live_ids = [row[0] for row in
+                    pretalx_db.iter_query(f'SELECT id FROM {table}')]
+        latest = db.execute(f'SELECT max({TIMESTAMP_COLUMN}) FROM {table}'
+                            ).fetchone()[0]
+    else:
+        # Changed rows by content hash
+        known = dict(db.execute('SELECT id, hash FROM _snapshot_rows '
+                                'WHERE name = ?', (table, )))
+        hashes = dict(pretalx_db.iter_query(
+            f'SELECT id, md5(CAST(ROW({select}) AS text)) FROM {table}'
+        ))
+        changed = [i for i, h in hashes.items() if known.get(i) != h]
+        stored = 0
+        for start in range(0, len(changed), CHUNK):
+            stored += _store(db, table, names, pretalx_db.query(
+                f'SELECT {select} FROM {table} WHERE id = ANY(%s)',
+                (changed[start:start + CHUNK], )
+            ))
+        db.executemany(
+            'INSERT OR REPLACE INTO _snapshot_rows VALUES (?, ?, ?)',
+            ((table, i, hashes[i]) for i in changed)
+        )
+        live_ids = list(hashes)
+        latest = None
+
+    deleted = _delete_missing(db, table, live_ids)
+    db.execute('INSERT OR REPLACE INTO _snapshot VALUES (?, ?, ?, ?)',
+               (table, json.dumps(columns), latest,
+                datetime.now().isoformat()))
+    return stored, deleted
+
+
+def snapshot(path, tables=TABLES, full=False):
+    db = sqlite3.connect(path, isolation_level=None)
+    try:
+        db.execute(META_SQL)
+        db.execute(HASHES_SQL)
+        db.execute('BEGIN')
+        for table in tables:
+            stored, deleted = snapshot_table(db, table, full)
+            log.info(f'{table}: {stored} rows stored, {deleted} deleted')
+        db.execute('COMMIT')
+    except BaseException:
+        if db.in_transaction:
+            db.execute('ROLLBACK')
+        raise
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--full', action='store_true',
+                        help='copy everything again')
+    parser.add_argument('--table', '-t', type=str, action='append',
+                        dest='tables', help=f'table to copy (repeatable) '
+                                            f'[{", ".join(TABLES)}]')
+    parser.add_argument('--tunnel', action='store_true',
+                        help='connect through the SSH tunnel')
+    parser.add_argument('path', metavar='PATH', help='SQLite snapshot')
+    args = parser.parse_args()
+
+    if args.tunnel:
+        host, port = pretalx_db.open_tunnel(pretalx_db.settings()['port'])
+        pretalx_db.DB_SETTINGS.update(host=host, port=port)
+    snapshot(args.path, args.tables or TABLES, args.full)
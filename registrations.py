@@ -0,0 +1,202 @@
+"""
+Local cache of the 'ADASS XXX Registrations' Google spreadsheet.
+
+The sheet is kept in a parquet file (CACHE_PATH) with a small JSON sidecar
+recording the sheet revision (last update time) it was fetched at. The sheet
+is only contacted to read its revision: if it did not change, the cache is
+used as is.
+
+Otherwise, if the sheet has a ROW_STAMP_COLUMN, only that column is read and
+the rows whose stamp changed (edited or appended) are fetched again, in one
+request. The stamp has to change whenever anything in its row does, i.e. it
+must be kept by the sheet itself (an onEdit/onFormSubmit Apps Script setting
+it to the current time), not typed by hand. Without that column, when the
+header changed or when rows were removed the whole sheet is fetched again,
+as with --full.
+
+All scripts should use load_registrations(), which returns the typed
+DataFrame that pd.DataFrame(sheet1.get_all_records())[1:] used to give:
+
+    import registrations
+    gdf = registrations.load_registrations()
+
+The gspread client can be passed explicitly (e.g. a local fake).
+
+Usage:
+    registrations.py [--full] [--offline]
+"""
+import argparse
+import json
+import logging
+import os
+import time
+import pandas as pd
+
+
+log = logging.getLogger(__name__)
+
+SHEET_NAME = 'ADASS XXX Registrations'
+CACHE_PATH = 'registrations.parquet'
+NUMERIC_COLUMNS = ('Amount', )
+# Last update of each row, kept by the sheet (see above)
+ROW_STAMP_COLUMN = 'Updated'
+
+
+def _pad(rows, width):
+    return [list(row[:width]) + [''] * (width - len(row)) for row in rows]
+
+
+def _col_letter(index):
+    """0 -> 'A', 26 -> 'AA'"""
+    letters = ''
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(ord('A') + rem) + letters
+    return letters
+
+
+def _runs(indexes):
+    """[first, last] of each run of consecutive (sorted) `indexes`."""
+    runs = []
+    for i in indexes:
+        if runs and runs[-1][1] == i - 1:
+            runs[-1][1] = i
+        else:
+            runs.append([i, i])
+    return runs
+
+
+def _last_update(spreadsheet):
+    if hasattr(spreadsheet, 'get_lastUpdateTime'):
+        return spreadsheet.get_lastUpdateTime()
+    return spreadsheet.lastUpdateTime
+
+
+def _meta_path(cache):
+    return f'{cache}.json'
+
+
+def _read_cache(cache):
+    meta_path = _meta_path(cache)
+    if not (os.path.isfile(cache) and os.path.isfile(meta_path)):
+        return None, None
+    with open(meta_path) as f:
+        meta = json.load(f)
+    return pd.read_parquet(cache), meta
+
+
+def _write_cache(cache, raw, meta):
+    raw.to_parquet(f'{cache}.tmp', index=False)
+    os.replace(f'{cache}.tmp', cache)
+    with open(f'{_meta_path(cache)}.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.replace(f'{_meta_path(cache)}.tmp', _meta_path(cache))
+
+
+def _fetch_all(worksheet):
+    values = worksheet.get_all_values()
+    header, rows = values[0], values[1:]
+    return pd.DataFrame(_pad(rows, len(header)), columns=header, dtype=object)
+
+
+def _fetch_delta(worksheet, raw):
+    """
+    Return `raw` with the rows whose ROW_STAMP_COLUMN changed fetched again,
+    or None if the sheet has to be fetched whole.
+    """
+    header = list(raw.columns)
+    if ROW_STAMP_COLUMN not in header or worksheet.row_values(1) != header:
+        return None
+    column = _col_letter(header.index(ROW_STAMP_COLUMN))
+    stamps = [row[0] if row else '' for row in
+              worksheet.batch_get([f'{column}2:{column}'])[0]]
+    old = raw[ROW_STAMP_COLUMN].tolist()
+    if len(stamps) < len(old):
+        return None
+    changed = [i for i, stamp in enumerate(stamps)
+               if i >= len(old) or stamp != old[i]]
+    if not changed:
+        return raw
+
+    # Row i of raw is row i + 2 of the sheet
+    last = _col_letter(len(header) - 1)
+    runs = _runs(changed)
+    blocks = worksheet.batch_get([f'A{first + 2}:{last}{end + 2}'
+                                  for first, end in runs])
+    rows = raw.values.tolist()
+    rows += [[]] * (len(stamps) - len(rows))
+    for (first, end), block in zip(runs, blocks):
+        # Trailing empty rows are not returned
+        block = block + [[]] * (end - first + 1 - len(block))
+        rows[first:end + 1] = _pad(block, len(header))
+    log.info(f'{len(changed)} of {len(rows)} rows fetched')
+    return pd.DataFrame(rows, columns=header, dtype=object)
+
+
+def refresh(client=None, sheet=SHEET_NAME, cache=CACHE_PATH, full=False):
+    """
+    Bring the cache up to date with the spreadsheet and return the raw sheet
+    (all values as strings, header as columns).
+    """
+    raw, meta = _read_cache(cache)
+    if client is None:
+        import gspread
+
+        client = gspread.service_account()
+    spreadsheet = client.open(sheet)
+    revision = _last_update(spreadsheet)
+    if raw is not None and not full and meta['revision'] == revision:
+        return raw
+
+    delta = None
+    if raw is not None and not full:
+        delta = _fetch_delta(spreadsheet.sheet1, raw)
+    if delta is None:
+        raw = _fetch_all(spreadsheet.sheet1)
+        log.info(f'{len(raw)} rows fetched (revision {revision})')
+    else:
+        raw = delta
+    _write_cache(cache, raw, {'revision': revision,
+                              'fetched_at': time.time()})
+    return raw
+
+
+def load_registrations(client=None, sheet=SHEET_NAME, cache=CACHE_PATH,
+                       offline=False):
+    """
+    Return the registrations as a DataFrame: string columns, except for
+    NUMERIC_COLUMNS (NaN when empty). As with get_all_records()[1:], the first
+    record is not a registration and is dropped. With `offline` the cache is
+    used without contacting the spreadsheet.
+    """
+    if offline:
+        raw, _ = _read_cache(cache)
+        if raw is None:
+            raise FileNotFoundError(cache)
+    else:
+        raw = refresh(client, sheet, cache)
+
+    df = raw.astype(str)
+    for name in NUMERIC_COLUMNS:
+        if name in df:
+            df[name] = pd.to_numeric(df[name].str.replace(',', ''),
+                                     errors='coerce')
+    return df.iloc[1:]
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cache', type=str, default=CACHE_PATH,
+                        help=f'cache file [{CACHE_PATH}]')
+    parser.add_argument('--full', action='store_true',
+                        help='fetch the whole sheet again')
+    parser.add_argument('--offline', action='store_true',
+                        help='only read the cache')
+    args = parser.parse_args()
+
+    if args.full:
+        refresh(cache=args.cache, full=True)
+    df = load_registrations(cache=args.cache, offline=args.offline)
+    print(f'{len(df)} registrations')
@@ -1,5 +1,5 @@
 """
-Remove all events associated to a given room from the four calendar files
+Remove all events associated to the given rooms from the four calendar files
 generated by pretalx:
     schedule.ics
     schedule.json
@@ -7,96 +7,125 @@ generated by pretalx:
     schedule.xml
 This is mostly useful to remove posters from the calendar files. Just schedule
 all posters in a single room and then run this script.
+
+All rooms are removed in a single pass over each file and the files are
+processed concurrently. Everything that is not removed is written back as is.
 """
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 import json
 import os
-from bs4 import BeautifulSoup
-import ics
+from lxml import etree
+
+from parseics import event_location, iter_events
+
+
+def _write(path, data, mode='w'):
+    # Write to a temp file first so that readers never see a partial file.
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, mode) as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _localname(el):
+    return etree.QName(el).localname
 
 
-def _process_json_cal(path, room):
+def _remove(el):
+    """Remove `el` from the tree, together with the whitespace before it."""
+    parent = el.getparent()
+    prev = el.getprevious()
+    if prev is not None:
+        prev.tail = el.tail
+    else:
+        parent.text = el.tail
+    parent.remove(el)
+
+
+def _process_json_cal(path, rooms):
     modified = False
 
     with open(path) as f:
         data = json.load(f)
     for day_dict in data['schedule']['conference']['days']:
-        if room in day_dict['rooms']:
-            del(day_dict['rooms'][room])
-            modified = True
+        for room in rooms:
+            if room in day_dict['rooms']:
+                del(day_dict['rooms'][room])
+                modified = True
 
     if not modified:
-        return
+        return False
 
-    with open(path, 'w') as f:
-        json.dump(data, f)
+    _write(path, json.dumps(data))
+    return True
 
 
-def _process_xml_cal(path, room):
+def _process_etree(path, tag, predicate):
+    """
+    Stream through the XML file in `path` and remove all `tag` elements (by
+    local name) for which predicate(element) is true.
+    """
     modified = False
 
-    with open(path) as f:
-        soup = BeautifulSoup(f, 'xml')
-    for day in soup.schedule.find_all('day'):
-        valid_elements = []
-        for el in day.contents:
-            if getattr(el, 'name', None) == 'room' and el['name'] == room:
-                if valid_elements:
-                    valid_elements.pop()
-                continue
-            valid_elements.append(el)
-        if len(valid_elements) != len(day.contents):
+    context = etree.iterparse(path, events=('end', ))
+    for _, el in context:
+        if not isinstance(el.tag, str) or _localname(el) != tag:
+            continue
+        if predicate(el):
+            _remove(el)
             modified = True
-            day.contents = valid_elements
 
     if not modified:
-        return
+        return False
 
-    with open(path, 'w') as f:
-        f.write(soup.prettify())
+    tree = context.root.getroottree()
+    _write(path, etree.tostring(tree, xml_declaration=True,
+                                encoding=tree.docinfo.encoding), mode='wb')
+    return True
 
 
-def _process_xcal(path, room):
-    modified = False
+def _process_xml_cal(path, rooms):
+    # <schedule><day><room name="Posters">...</room>...</day></schedule>
+    return _process_etree(
+        path, 'room',
+        lambda el: _localname(el.getparent()) == 'day' and
+        el.get('name') in rooms
+    )
 
-    with open(path) as f:
-        soup = BeautifulSoup(f, 'xml')
-
-    cal = soup.iCalendar.vcalendar
-    valid_elements = []
-    for el in cal.contents:
-        if getattr(el, 'name', None) == 'vevent' and \
-                el.location.string == room:
-            if valid_elements:
-                valid_elements.pop()
-            continue
-        valid_elements.append(el)
-    if len(valid_elements) != len(cal.contents):
-        modified = True
-        cal.contents = valid_elements
 
-    if not modified:
-        return
+def _process_xcal(path, rooms):
+    # <iCalendar><vcalendar><vevent><location>Posters</location>...
+    def predicate(el):
+        for child in el:
+            if isinstance(child.tag, str) and \
+                    _localname(child) == 'location':
+                return child.text in rooms
+        return False
+    return _process_etree(path, 'vevent', predicate)
 
-    with open(path, 'w') as f:
-        f.write(soup.prettify())
 
+def _process_ics(path, rooms):
+    modified = False
 
-def _process_ics(path, room):
-    with open(path) as f:
-        cal = ics.Calendar(f.read())
+    out = []
+    # newline='' so that CRLF line endings are preserved.
+    with open(path, newline='') as f:
+        for is_event, chunk in iter_events(f):
+            if not is_event:
+                out.append(chunk)
+            elif event_location(chunk) in rooms:
+                modified = True
+            else:
+                out.extend(chunk)
 
-    valid_events = set()
-    for e in list(cal.events):
-        if e.location == room:
-            continue
-        valid_events.add(e)
-    if len(valid_events) == len(cal.events):
-        return
+    if not modified:
+        return False
 
-    cal.events = valid_events
-    with open(path, 'w') as f:
-        f.write(str(cal))
+    with open(f'{path}.tmp', 'w', newline='') as f:
+        f.writelines(out)
+    os.replace(f'{path}.tmp', path)
+    return True
 
 
 PROCESSORS = {
@@ -107,19 +136,35 @@ PROCESSORS = {
 }
 
 
-def process(cal_files, room):
-    for cal_file in cal_files:
-        _, ext = os.path.splitext(cal_file)
-        if ext not in PROCESSORS:
-            continue
-        PROCESSORS[ext](cal_file, room)
+def _process_one(cal_file, rooms):
+    _, ext = os.path.splitext(cal_file)
+    return PROCESSORS[ext](cal_file, rooms)
+
+
+def process(cal_files, rooms):
+    """
+    Remove `rooms` (room names) from all `cal_files` and return the list of
+    files that were modified.
+    """
+    rooms = frozenset(rooms)
+    cal_files = [cal_file for cal_file in cal_files
+                 if os.path.splitext(cal_file)[1] in PROCESSORS]
+    if not cal_files:
+        return []
+
+    with ProcessPoolExecutor(max_workers=len(cal_files)) as executor:
+        results = executor.map(_process_one, cal_files,
+                               [rooms] * len(cal_files))
+        return [cal_file for cal_file, modified in zip(cal_files, results)
+                if modified]
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--room', '-r', type=str, required=True,
-                        help='room name')
+                        action='append', dest='rooms',
+                        help='room name (repeat -r to remove more rooms)')
     parser.add_argument('calendar_files', metavar='FILE', nargs='+',
                         help='calendar files to process')
     args = parser.parse_args()
-    process(args.calendar_files, room=args.room)
+    process(args.calendar_files, rooms=args.rooms)
@@ -1,6 +1,6 @@
 """
-Group abstracts of a given submission type (e.g. Talk) in themes and list their
-compatible time slots (defined in the code itself for now).
+Group abstracts of the given submission types (e.g. Talk) in themes and list
+their compatible time slots (defined in the code itself for now).
 
 Output a CSV table (to STDOUT) of the form
 
@@ -11,11 +11,27 @@ e.g.
 # PID,Title,06-09,12-15,17-20
 O3-14,Test Talk Title,True,False,True
 ...
+
+With --schedule, propose a schedule instead: every talk goes to one of the
+sessions (DAYS x TIME_SLOTS) and rooms, with at most --per-session talks per
+room and session, only in time slots the speakers can make and with no speaker
+in two rooms at the same time. Talks of the same theme (the digit in their
+paper_id) are kept together as much as possible. The output is a CSV table
+
+# Day,Time Slot,Room,PID,Title,Theme
+
+and the conflicts (talks that could not be placed, sessions mixing themes) are
+reported on STDERR.
 """
 import argparse
+from collections import Counter, defaultdict, namedtuple
 import csv
+import random
 import sys
-import psycopg2
+import time
+
+import pretalx_db
+import pretalx_model
 # from adass_themes import Abstract
 
 
@@ -41,42 +57,300 @@ FIELDS = {
     'Title': lambda row: row[1],
 }
 FIELDS.update(TIME_SLOTS)
+# All the types at once, with one row per speaker. Submissions with no answer
+# to the time question can be scheduled at any time.
 SQL = f'''\
 SELECT
+    submission_submission.id,
     submission_submission.paper_id,
     submission_submission.title,
     submission_submission.submission_type_id,
-    submission_answer.answer
+    submission_answer.answer,
+    submission_submission_speakers.user_id
 FROM
-    submission_submission,
-    submission_answer
+    submission_submission
+    LEFT JOIN submission_answer
+        ON submission_submission.id = submission_answer.submission_id
+        AND submission_answer.question_id = {TIME_QUESTION_ID}
+    LEFT JOIN submission_submission_speakers
+        ON submission_submission.id =
+            submission_submission_speakers.submission_id
 WHERE
     submission_submission.state not in ('deleted', 'withdrawn')
-    AND submission_submission.submission_type_id = %d
-    AND submission_submission.id = submission_answer.submission_id
-    AND submission_answer.question_id = {TIME_QUESTION_ID}
+    AND submission_submission.submission_type_id IN %s
 ORDER BY
-    submission_submission.paper_id
+    submission_submission.paper_id,
+    submission_submission.id
 '''
 
+# Scheduling defaults
+DAYS = 5
+ROOMS = 1
+PER_SESSION = 6
+BUDGET = 5.0
+SCHEDULE_TYPES = (1, 3, 15, 17)
+UNPLACED_COST = 1000
+
+Talk = namedtuple('Talk', ['pid', 'title', 'type_id', 'theme', 'mask',
+                           'speakers'])
+
+
+def fetch_talks(type_ids):
+    """Return (pid, title, type_id, answer, [speaker, ...]) per submission."""
+    talks = {}
+    for pk, pid, title, type_id, answer, speaker in pretalx_db.iter_query(
+            SQL, (tuple(type_ids), )):
+        if pk not in talks:
+            talks[pk] = (pid, title, type_id, answer, [])
+        if speaker is not None:
+            talks[pk][-1].append(speaker)
+    return list(talks.values())
+
+
+def availability(answer):
+    """
+    Bitmask of the TIME_SLOTS a talk can go in: the answer lists the slots
+    that do *not* work. No answer means any slot.
+    """
+    mask = 0
+    for i, slot in enumerate(TIME_SLOTS):
+        if answer is None or slot not in answer:
+            mask |= 1 << i
+    return mask
+
+
+def make_talks(rows, n_sessions):
+    """Turn the rows of SQL into Talks, with `mask` over the sessions."""
+    n_slots = len(TIME_SLOTS)
+    talks = []
+    for pid, title, type_id, answer, speakers in rows:
+        # Only the paper_id matters for the theme
+        theme = pretalx_model.Submission(None, None, pid, title, None, None,
+                                         type_id, None, None).theme
+        slots = availability(answer)
+        mask = 0
+        for s in range(n_sessions):
+            if slots >> (s % n_slots) & 1:
+                mask |= 1 << s
+        talks.append(Talk(pid, title, type_id, theme, mask,
+                          tuple(speakers or ())))
+    return talks
+
+
+class Schedule:
+    """
+    Talks (by index) assigned to blocks: block b is room b % n_rooms of
+    session b // n_rooms. The cost is the number of talks that are not placed
+    (times UNPLACED_COST) plus, for every block, the number of themes in it.
+    """
+    def __init__(self, talks, n_sessions, n_rooms, capacity):
+        self.talks = talks
+        self.n_rooms = n_rooms
+        self.capacity = capacity
+        n_blocks = n_sessions * n_rooms
+        self.where = [None] * len(talks)
+        self.blocks = [[] for _ in range(n_blocks)]
+        self.themes = [Counter() for _ in range(n_blocks)]
+        self.busy = defaultdict(Counter)     # speaker -> session -> talks
+        # blocks each talk could go in, time-wise
+        self.options = [
+            [b for b in range(n_blocks) if t.mask >> (b // n_rooms) & 1]
+            for t in talks
+        ]
+
+    def session(self, b):
+        return b // self.n_rooms
+
+    def fits(self, i, b):
+        if len(self.blocks[b]) >= self.capacity:
+            return False
+        s = self.session(b)
+        return not any(self.busy[sp][s] for sp in self.talks[i].speakers)
+
+    def place(self, i, b):
+        self.where[i] = b
+        self.blocks[b].append(i)
+        self.themes[b][self.talks[i].theme] += 1
+        for sp in self.talks[i].speakers:
+            self.busy[sp][self.session(b)] += 1
+
+    def remove(self, i):
+        b = self.where[i]
+        self.where[i] = None
+        self.blocks[b].remove(i)
+        self.themes[b][self.talks[i].theme] -= 1
+        if not self.themes[b][self.talks[i].theme]:
+            del self.themes[b][self.talks[i].theme]
+        for sp in self.talks[i].speakers:
+            self.busy[sp][self.session(b)] -= 1
+        return b
+
+    def cost(self):
+        unplaced = sum(b is None for b in self.where)
+        return UNPLACED_COST * unplaced + sum(len(c) for c in self.themes)
+
+    def greedy(self):
+        """Place the most constrained talks first, next to their theme."""
+        order = sorted(range(len(self.talks)), key=lambda i: (
+            len(self.options[i]), self.talks[i].theme or '',
+            self.talks[i].pid or ''))
+        for i in order:
+            self.insert(i)
+
+    def insert(self, i):
+        theme = self.talks[i].theme
+        best = min(
+            (b for b in self.options[i] if self.fits(i, b)),
+            key=lambda b: (theme not in self.themes[b],
+                           bool(self.blocks[b]), b),
+            default=None,
+        )
+        if best is not None:
+            self.place(i, best)
+        return best is not None
+
+    def improve(self, budget, seed=0):
+        """
+        Local search (moves and swaps, accepted unless they make things worse)
+        until `budget` seconds have passed.
+        """
+        rng = random.Random(seed)
+        n = len(self.talks)
+        deadline = time.perf_counter() + budget
+        iteration = 0
+        while n and time.perf_counter() < deadline:
+            iteration += 1
+            i = rng.randrange(n)
+            if self.where[i] is None:
+                self.insert(i)
+                continue
+            if not self.options[i]:
+                continue
+            a = self.where[i]
+            b = rng.choice(self.options[i])
+            if b == a:
+                continue
+            j = rng.choice(self.blocks[b]) \
+                if len(self.blocks[b]) >= self.capacity else None
+            if j is not None and not self.talks[j].mask >> self.session(a) & 1:
+                continue
+
+            before = len(self.themes[a]) + len(self.themes[b])
+            self.remove(i)
+            if j is not None:
+                self.remove(j)
+            ok = self.fits(i, b)
+            if ok:
+                self.place(i, b)
+                if j is not None:
+                    ok = self.fits(j, a)
+                    if ok:
+                        self.place(j, a)
+                    else:
+                        self.remove(i)
+            if ok and len(self.themes[a]) + len(self.themes[b]) <= before:
+                continue
+            # undo
+            if ok:
+                self.remove(i)
+                if j is not None:
+                    self.remove(j)
+            self.place(i, a)
+            if j is not None:
+                self.place(j, b)
+        return iteration
+
+    def conflicts(self):
+        """Return a list of human readable problems with the schedule."""
+        problems = []
+        for i, t in enumerate(self.talks):
+            if not t.mask:
+                problems.append(f'{t.pid}: not available in any time slot')
+            elif self.where[i] is None:
+                problems.append(f'{t.pid}: could not be placed (no room left '
+                                f'in its time slots or speaker clash)')
+        for b, themes in enumerate(self.themes):
+            if len(themes) > 1:
+                problems.append(
+                    f'{block_label(b, self.n_rooms)}: mixes themes ' +
+                    ', '.join(f'{theme} ({n})' for theme, n in
+                              sorted(themes.items(), key=str)))
+        return problems
+
+
+def block_label(b, n_rooms):
+    session, room = divmod(b, n_rooms)
+    day, slot = divmod(session, len(TIME_SLOTS))
+    return f'Day {day + 1} {list(TIME_SLOTS)[slot]} Room {room + 1}'
+
+
+def make_schedule(talks, days=DAYS, rooms=ROOMS, per_session=PER_SESSION,
+                  budget=BUDGET, seed=0):
+    schedule = Schedule(talks, days * len(TIME_SLOTS), rooms, per_session)
+    schedule.greedy()
+    schedule.improve(budget, seed)
+    return schedule
+
+
+def write_schedule(schedule, out):
+    writer = csv.writer(out)
+    writer.writerow(['Day', 'Time Slot', 'Room', 'PID', 'Title', 'Theme'])
+    slots = list(TIME_SLOTS)
+    for b, block in enumerate(schedule.blocks):
+        session, room = divmod(b, schedule.n_rooms)
+        day, slot = divmod(session, len(slots))
+        for i in sorted(block, key=lambda i: (schedule.talks[i].theme or '',
+                                              schedule.talks[i].pid or '')):
+            t = schedule.talks[i]
+            writer.writerow([day + 1, slots[slot], room + 1, t.pid, t.title,
+                             t.theme])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('sub_type_id', metavar='TYPE_ID', type=int, nargs='*',
+                        help='submission type(s): ' + SUB_TYPE_IDS)
+    parser.add_argument('--schedule', action='store_true',
+                        help='propose a schedule for the given types '
+                             f'[{", ".join(map(str, SCHEDULE_TYPES))}]')
+    parser.add_argument('--days', type=int, default=DAYS)
+    parser.add_argument('--rooms', type=int, default=ROOMS,
+                        help='parallel rooms per session')
+    parser.add_argument('--per-session', type=int, default=PER_SESSION,
+                        help='talks per room and session')
+    parser.add_argument('--budget', type=float, default=BUDGET,
+                        help='seconds spent improving the schedule')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--snapshot', type=str, metavar='PATH',
+                        help='read from this pretalx_snapshot.py SQLite '
+                             'file instead of the database')
+    args = parser.parse_args()
+    if args.snapshot:
+        pretalx_db.use_snapshot(args.snapshot)
+    type_ids = args.sub_type_id or (SCHEDULE_TYPES if args.schedule else [])
+    if not type_ids:
+        parser.error('at least one TYPE_ID is needed')
+
+    rows = fetch_talks(type_ids)
+
+    if not args.schedule:
+        writer = csv.DictWriter(sys.stdout, fieldnames=FIELDS)
+        writer.writeheader()
+        for row in rows:
+            # [pid, title, _, answer, speakers] = row
+            row = row[:4]
+            if row[-1] is None:
+                continue
+            row += tuple(slot not in row[-1] for slot in TIME_SLOTS)
+            writer.writerow({k: fn(row) for k, fn in FIELDS.items()})
+        sys.exit(0)
 
-parser = argparse.ArgumentParser()
-parser.add_argument('sub_type_id', metavar='TYPE_ID', type=int, nargs=1,
-                    help='submission type: ' + SUB_TYPE_IDS)
-args = parser.parse_args()
-type_id = args.sub_type_id[0]
-
-conn = psycopg2.connect(database="pretalx",
-                        user="pretalx",
-                        password="",
-                        host="localhost",
-                        port="5432")
-cur = conn.cursor()
-cur.execute(SQL % (type_id, ))
-
-writer = csv.DictWriter(sys.stdout, fieldnames=FIELDS)
-writer.writeheader()
-for row in cur:
-    # [pid, title, _, answer] = rec
-    row += tuple(slot not in row[-1] for slot in TIME_SLOTS)
-    writer.writerow({k: fn(row) for k, fn in FIELDS.items()})
+    talks = make_talks(rows, args.days * len(TIME_SLOTS))
+    schedule = make_schedule(talks, args.days, args.rooms, args.per_session,
+                             args.budget, args.seed)
+    write_schedule(schedule, sys.stdout)
+    problems = schedule.conflicts()
+    print(f'# {len(talks)} talks, cost {schedule.cost()}, '
+          f'{len(problems)} conflicts', file=sys.stderr)
+    for problem in problems:
+        print(problem, file=sys.stderr)
@@ -0,0 +1,164 @@
+"""
+Publish the pretalx HTML export of the conference schedule, fixed with the
+info from the database, in a single process. This is what
+schedule_fixer_pipeline.sh used to do, one interpreter per step:
+
+    1. copy the original HTML export to a staging area
+    2. fetch all the submissions we need from the database (only once)
+    3. fix titles/authors in the schedule, talk and speaker index.html files
+    4. fix all calendar files to use UTC instead of CEST/CET/Madrid time
+    5. remove the given rooms (i.e. posters) from the calendars
+    6. update the PDF/MP4 links in the database and talk pages
+    7. copy staging to prod
+
+Each output file is written once, atomically, and the time spent in each stage
+is reported at the end.
+
+Usage:
+    schedule_pipeline.py [--engine lxml] [--jobs N]
+"""
+import argparse
+from contextlib import contextmanager
+import glob
+import logging
+import os
+from pathlib import Path
+import subprocess
+import time
+
+import fix_calendars
+import fix_titles_authors
+import populate_pdf_video_paths
+import pretalx_db
+import pretalx_model
+import remove_room_from_cals
+
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+# Configuration
+EVENT = 'adass2020'
+EXPORT_ROOT = '/var/pretalx/data/htmlexport/adass2020'
+STAGING_ROOT = '/tmp/adass2020'
+PROD_ROOT = '/var/www/schedule'
+ROOMS_TO_REMOVE = ('Posters', )
+
+
+class Timer:
+    """Keep track of the wall time spent in each stage."""
+    def __init__(self):
+        self.timings = []
+
+    @contextmanager
+    def stage(self, name):
+        log.info(f'{name}...')
+        tick = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings.append((name, time.perf_counter() - tick))
+
+    def report(self):
+        width = max(len(name) for name, _ in self.timings)
+        for name, dt in self.timings:
+            log.info(f'{name:{width}} {dt:8.3f}s')
+        log.info(f'{"total":{width}} '
+                 f'{sum(dt for _, dt in self.timings):8.3f}s')
+
+
+def rsync(src, dst):
+    subprocess.run(['/usr/bin/rsync', '-a', '--delete', f'{src}/', f'{dst}/'],
+                   check=True)
+
+
+def fix_titles(program, root, event, engine):
+    changes = fix_titles_authors.compute_changes(program.submissions)
+    subs_to_hide = fix_titles_authors.hidden_codes(program)
+
+    edit_index, edit_talk, edit_speaker = fix_titles_authors.ENGINES[engine]
+    outputs = (
+        ('schedule', edit_index(event, changes, root)),
+        ('talk', edit_talk(event, subs_to_hide, root)),
+        ('speaker', edit_speaker(event, subs_to_hide, root)),
+    )
+    for page, html in outputs:
+        populate_pdf_video_paths.atomic_write(
+            Path(root, event, page, 'index.html'), html
+        )
+
+
+def populate_media(conn, program, root, event, args):
+    # Same rows, same order as populate_pdf_video_paths.SQL
+    rows = sorted(
+        ((s.code, s.paper_id, s.pdf_path, s.video_path)
+         for s in program.submissions if s.state == 'confirmed'),
+        key=lambda row: (row[1] is None, row[1] or '')
+    )
+    populate_pdf_video_paths.populate(
+        conn, rows,
+        ftp_root=Path(args.ftp_root),
+        html_root=Path(root, event, 'talk'),
+        media_url_root=Path(args.media_url_root),
+        manifest_path=Path(args.manifest),
+        force=args.force,
+        jobs=args.jobs,
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--event', '-e', type=str, default=EVENT,
+                        help='event name')
+    parser.add_argument('--export_root', type=str, default=EXPORT_ROOT)
+    parser.add_argument('--staging_root', type=str, default=STAGING_ROOT)
+    parser.add_argument('--prod_root', type=str, default=PROD_ROOT)
+    parser.add_argument('--ftp_root', type=str,
+                        default=populate_pdf_video_paths.FTP_ROOT)
+    parser.add_argument('--media_url_root', type=str,
+                        default=populate_pdf_video_paths.MEDIA_URL_ROOT)
+    parser.add_argument('--manifest', type=str,
+                        default=populate_pdf_video_paths.MANIFEST_PATH)
+    parser.add_argument('--force', action='store_true',
+                        help='ignore the PDF/MP4 manifest')
+    parser.add_argument('--room', '-r', type=str, action='append',
+                        help='room to remove from the calendars '
+                             f'[defaults to {", ".join(ROOMS_TO_REMOVE)}]')
+    parser.add_argument('--engine', type=str, default='bs4',
+                        choices=list(fix_titles_authors.ENGINES),
+                        help='HTML engine used to fix titles and authors')
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count(),
+                        help='number of processes editing the talk pages')
+    args = parser.parse_args()
+
+    event = args.event
+    root = args.staging_root
+    rooms = args.room or ROOMS_TO_REMOVE
+    timer = Timer()
+
+    with pretalx_db.connection() as conn:
+        with timer.stage('rsync export -> staging'):
+            rsync(args.export_root, root)
+
+        with timer.stage('fetch submissions'):
+            program = pretalx_model.Program.load()
+
+        with timer.stage('fix titles and authors'):
+            fix_titles(program, root, event, args.engine)
+
+        with timer.stage('fix calendars'):
+            fix_calendars.fix_calendars(root, event, jobs=args.jobs)
+
+        with timer.stage('remove rooms from calendars'):
+            cal_files = glob.glob(
+                os.path.join(root, event, 'schedule', 'export', 'schedule.*')
+            )
+            remove_room_from_cals.process(cal_files, rooms=rooms)
+
+        with timer.stage('populate PDF/MP4 paths'):
+            populate_media(conn, program, root, event, args)
+
+    with timer.stage('rsync staging -> prod'):
+        rsync(root, args.prod_root)
+
+    timer.report()
@@ -0,0 +1,90 @@
+import os
+import shutil
+import socket
+import ssl
+import subprocess
+import sys
+
+import pytest
+
+# The tools are plain scripts in the root of the repository.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import fake_pretalx  # noqa: E402
+import pretalx_db  # noqa: E402
+
+
+@pytest.fixture
+def conference(tmp_path, monkeypatch):
+    """A small fake conference (see fake_pretalx.py), read with --snapshot."""
+    paths = fake_pretalx.generate(tmp_path / 'conference', talks=60,
+                                  rooms=2, days=2)
+    monkeypatch.setattr(pretalx_db, '_snapshot', None)
+    pretalx_db.use_snapshot(str(paths['sqlite']))
+    # Some scripts read files relative to the tools directory.
+    monkeypatch.chdir(ROOT)
+    return paths
+
+
+class SMTPHandler:
+    """
+    aiosmtpd handler keeping the messages it accepts. `failures` maps a
+    recipient to the number of times its message gets a temporary (451)
+    error before being accepted.
+    """
+    def __init__(self):
+        self.messages = []
+        self.attempts = {}
+        self.failures = {}
+
+    async def handle_DATA(self, server, session, envelope):
+        rcpt = envelope.rcpt_tos[0]
+        self.attempts[rcpt] = self.attempts.get(rcpt, 0) + 1
+        if self.failures.get(rcpt):
+            self.failures[rcpt] -= 1
+            return '451 4.3.0 Try again later'
+        self.messages.append(envelope)
+        return '250 OK'
+
+
+@pytest.fixture(scope='session')
+def tls_context(tmp_path_factory):
+    """Server side SSL context with a throwaway self-signed certificate."""
+    if shutil.which('openssl') is None:
+        pytest.skip('openssl is needed for the SMTP tests')
+    tmp = tmp_path_factory.mktemp('tls')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048',
+                    '-nodes', '-days', '1', '-subj', '/CN=localhost',
+                    '-keyout', str(tmp / 'key.pem'),
+                    '-out', str(tmp / 'cert.pem')],
+                   check=True, capture_output=True)
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(tmp / 'cert.pem', tmp / 'key.pem')
+    return context
+
+
+@pytest.fixture
+def smtp_server(tls_context):
+    """
+    Local stand-in for the SMTP_SSL server used by email_groups.py. Yield the
+    send_all() keyword arguments to reach it; the handler is in ['handler'].
+    """
+    controller_mod = pytest.importorskip('aiosmtpd.controller')
+    from aiosmtpd.smtp import AuthResult
+
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        port = s.getsockname()[1]
+    handler = SMTPHandler()
+    controller = controller_mod.Controller(
+        handler, hostname='localhost', port=port, ssl_context=tls_context,
+        authenticator=lambda *args: AuthResult(success=True),
+        auth_require_tls=False,
+    )
+    controller.start()
+    try:
+        yield {'host': 'localhost', 'port': port, 'user': 'loc',
+               'passwd': 'secret', 'handler': handler}
+    finally:
+        controller.stop()
@@ -0,0 +1,59 @@
+from fractions import Fraction
+from itertools import product
+import random
+
+import pytest
+
+import adass_themes
+
+
+def _abstracts(theme_sets):
+    return {pk: adass_themes.Abstract(pk, f'Title {pk}', 3, themes=list(t))
+            for pk, t in theme_sets.items()}
+
+
+def _key(themes, targets):
+    """What balance_exact optimises: largest relative size, then smallest."""
+    sizes = [Fraction(len(pks), targets[tid]) for tid, pks in themes.items()]
+    return max(sizes), -min(sizes)
+
+
+def _brute_force(themes, spares, targets):
+    best = None
+    for choice in product(*(sorted(set(a.themes)) for a in spares)):
+        sizes = {tid: list(pks) for tid, pks in themes.items()}
+        for a, tid in zip(spares, choice):
+            sizes[tid].append(a.pk)
+        key = _key(sizes, targets)
+        if best is None or key < best:
+            best = key
+    return best
+
+
+def _random_case(rng):
+    theme_ids = list(range(1, rng.randint(2, 5) + 1))
+    theme_sets = {}
+    for pk in range(1, rng.randint(1, 9) + 1):
+        k = 1 if rng.random() < 0.5 else rng.randint(2, len(theme_ids))
+        theme_sets[pk] = rng.sample(theme_ids, k)
+    targets = {tid: rng.randint(1, 3) for tid in theme_ids}
+    return theme_sets, targets
+
+
+CASES = [
+    ({1: [1], 2: [3], 3: [3], 4: [4], 5: [4], 6: [4], 7: [1, 2, 4]},
+     {1: 3, 2: 1, 3: 1, 4: 3}),
+]
+rng = random.Random(0)
+CASES += [_random_case(rng) for _ in range(300)]
+
+
+@pytest.mark.parametrize('theme_sets, targets', CASES)
+def test_exact_matches_brute_force(theme_sets, targets):
+    abstracts = _abstracts(theme_sets)
+    themes, spares = adass_themes.split_spares(abstracts, targets)
+    best = _brute_force(themes, spares, targets)
+    balanced = adass_themes.balance(themes, spares, targets, exact=True)
+    assert sorted(pk for pks in balanced.values() for pk in pks) == \
+        sorted(abstracts)
+    assert _key(balanced, targets) == best
@@ -0,0 +1,32 @@
+from functools import partial
+
+import pytest
+
+import deliver_spool
+import email_groups
+
+
+@pytest.mark.parametrize('name', ['spool', 'spool.mbox'])
+def test_drain(smtp_server, tmp_path, monkeypatch, name):
+    spool = str(tmp_path / name)
+    records = [{'name': f'Person {i}', 'email': f'person{i}@example.org',
+                'ticket_id': str(i)} for i in range(3)]
+    journal = email_groups.SendJournal(str(tmp_path / 'journal.sqlite'))
+    try:
+        email_groups.spool_email(spool, records=records, journal=journal,
+                                 campaign='test', jobs=1)
+        # Spooled twice, already sent once: dropped without sending it.
+        journal.log('test', 'person1@example.org', email_groups.SENT)
+
+        conf = {k: v for k, v in smtp_server.items() if k != 'handler'}
+        monkeypatch.setattr(deliver_spool, 'send_all',
+                            partial(email_groups.send_all, **conf))
+        deliver_spool.drain(spool, journal)
+
+        handler = smtp_server['handler']
+        assert sorted(m.rcpt_tos[0] for m in handler.messages) == [
+            'person0@example.org', 'person2@example.org']
+        assert len(email_groups.open_spool(spool)) == 0
+        assert set(journal.statuses('test').values()) == {email_groups.SENT}
+    finally:
+        journal.close()
@@ -0,0 +1,57 @@
+import email_groups
+
+
+def _send(smtp_server, records, **kwargs):
+    conf = dict(smtp_server)
+    del conf['handler']
+    jobs = [('test', email_groups.make_message(rec), rec['email'])
+            for rec in records]
+    return dict(email_groups.send_all(jobs, **conf, **kwargs))
+
+
+def _records(n):
+    return [{'name': f'Person {i}', 'email': f'person{i}@example.org',
+             'ticket_id': str(i)} for i in range(n)]
+
+
+def test_send_all_delivers(smtp_server):
+    results = _send(smtp_server, _records(5), connections=2)
+    assert results == {f'person{i}@example.org': None for i in range(5)}
+    handler = smtp_server['handler']
+    assert sorted(m.rcpt_tos[0] for m in handler.messages) == \
+        sorted(results)
+    assert b'Dear Person 3,' in next(
+        m.content for m in handler.messages
+        if m.rcpt_tos == ['person3@example.org'])
+
+
+def test_temporary_errors_are_retried_with_backoff(smtp_server, monkeypatch):
+    backoffs = []
+
+    class Throttle(email_groups.Throttle):
+        def backoff(self):
+            super().backoff()
+            backoffs.append(self.delay)
+
+    monkeypatch.setattr(email_groups, 'Throttle', Throttle)
+    handler = smtp_server['handler']
+    handler.failures['person1@example.org'] = 2
+
+    results = _send(smtp_server, _records(3), connections=1)
+    assert all(error is None for error in results.values())
+    assert handler.attempts['person1@example.org'] == 3
+    assert len(handler.messages) == 3
+    # Two temporary errors: the delay went up twice
+    assert len(backoffs) == 2 and backoffs[1] > backoffs[0] > 0
+
+
+def test_journal(smtp_server, tmp_path):
+    journal = email_groups.SendJournal(str(tmp_path / 'journal.sqlite'))
+    try:
+        _send(smtp_server, _records(2), journal=journal)
+        assert journal.statuses('test') == {
+            'person0@example.org': email_groups.SENT,
+            'person1@example.org': email_groups.SENT,
+        }
+    finally:
+        journal.close()
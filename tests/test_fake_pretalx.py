@@ -0,0 +1,30 @@
+import adass_themes
+import create_panelist_csvs
+import pretalx_db
+import schedule_helper
+
+
+def test_time_answers(conference):
+    talks = schedule_helper.fetch_talks(schedule_helper.SCHEDULE_TYPES)
+    assert talks
+    answers = [answer for _, _, _, answer, _ in talks if answer is not None]
+    assert answers
+    assert all(schedule_helper.availability(answer) for answer in answers)
+
+
+def test_theme_answers(conference):
+    abstracts = adass_themes.fetch_abstracts()
+    assert abstracts
+    for abstract in abstracts.values():
+        assert set(abstract.themes) <= set(adass_themes.THEMES)
+    themes, spares = adass_themes.split_spares(abstracts, adass_themes.THEMES)
+    assert sum(map(len, themes.values())) + len(spares) == len(abstracts)
+
+
+def test_panelists(conference):
+    rows = pretalx_db.query(create_panelist_csvs.SQL)
+    assert rows
+    sessions = create_panelist_csvs.Sessions.load(
+        create_panelist_csvs.SESSIONS_PATH)
+    panelists = create_panelist_csvs.group_panelists(rows, sessions)
+    assert sum(map(len, panelists.values())) == len(rows)
@@ -0,0 +1,53 @@
+import os
+
+import fake_pretalx
+import fix_calendars
+
+ICS = ('BEGIN:VEVENT\r\n'
+       'SUMMARY:Caf\xe9 - Ada\r\n'
+       'DTSTART;TZID=Europe/Madrid:20201109T070000\r\n'
+       'URL:https://pretalx.adass2020.es/adass2020/talk/ABC/\r\n'
+       'END:VEVENT\r\n').encode('latin-1')
+
+
+def test_normalise_bytes(tmp_path):
+    path = str(tmp_path / 'talk.ics')
+    with open(path, 'wb') as f:
+        f.write(ICS)
+    state, written = fix_calendars.normalise(path)
+    assert written
+    with open(path, 'rb') as f:
+        assert f.read() == (
+            ICS.replace(b';TZID=Europe/Madrid:20201109T070000',
+                        b':20201109T070000Z')
+               .replace(b'https://pretalx.', b'https://schedule.'))
+    assert state[2] == fix_calendars._sha1(path)
+
+
+def test_known_files_are_not_read(tmp_path, monkeypatch):
+    path = str(tmp_path / 'talk.ics')
+    with open(path, 'wb') as f:
+        f.write(ICS)
+    state, _ = fix_calendars.normalise(path)
+    assert fix_calendars.normalise(path, state) == (state, False)
+
+    # Same content, new mtime: hashed once, not rewritten
+    os.utime(path, ns=(1, 1))
+    new_state, written = fix_calendars.normalise(path, state)
+    assert not written
+    assert new_state == [1, state[1], state[2]]
+
+    def fail(path):
+        raise AssertionError('hashed again')
+    monkeypatch.setattr(fix_calendars, '_sha1', fail)
+    assert fix_calendars.normalise(path, new_state) == (new_state, False)
+
+
+def test_second_run_changes_nothing(conference, tmp_path):
+    root = str(conference['html'])
+    state_path = str(tmp_path / 'calendars.json')
+    changed = fix_calendars.fix_calendars(root, fake_pretalx.EVENT, state_path,
+                                          jobs=2, rebuild=False)
+    assert changed
+    assert fix_calendars.fix_calendars(root, fake_pretalx.EVENT, state_path,
+                                       jobs=2, rebuild=False) == []
@@ -0,0 +1,45 @@
+from lxml import html as lxml_html
+import pytest
+
+import fake_pretalx
+import fix_titles_authors
+import pretalx_model
+
+
+def _normalise(text):
+    return ' '.join((text or '').split())
+
+
+def _elements(document):
+    """The elements of `document`, whitespace and attribute order aside."""
+    tree = lxml_html.document_fromstring(document)
+    return [
+        (el.tag, sorted(el.attrib.items()), _normalise(el.text),
+         _normalise(el.tail))
+        for el in tree.iter() if isinstance(el.tag, str)
+    ]
+
+
+@pytest.mark.parametrize('page', range(3))
+def test_lxml_engine_matches_bs4(conference, page):
+    program = pretalx_model.Program.load()
+    changes = fix_titles_authors.compute_changes(program.submissions)
+    subs_to_hide = fix_titles_authors.hidden_codes(program)
+    assert changes and subs_to_hide
+
+    args = (changes, subs_to_hide, subs_to_hide)[page]
+    root = str(conference['html'])
+    bs4_out = fix_titles_authors.ENGINES['bs4'][page](
+        fake_pretalx.EVENT, args, root)
+    lxml_out = fix_titles_authors.ENGINES['lxml'][page](
+        fake_pretalx.EVENT, args, root)
+    assert _elements(lxml_out) == _elements(bs4_out)
+
+
+def test_titles_are_fixed(conference):
+    program = pretalx_model.Program.load()
+    changes = fix_titles_authors.compute_changes(program.submissions)
+    html = fix_titles_authors.edit_index_lxml(
+        fake_pretalx.EVENT, changes, str(conference['html']))
+    for code, (new_title, _) in changes.items():
+        assert new_title in html
@@ -0,0 +1,147 @@
+import pytest
+
+import registrations
+
+pytest.importorskip('pyarrow')
+
+HEADER = ['Name', 'Surname', 'Email', 'Affiliation', 'INVITED', 'Amount',
+          'Updated']
+OLD = '2020-10-01T10:00:00'
+NEW = '2020-10-02T10:00:00'
+
+
+class FakeWorksheet:
+    """The worksheet calls of gspread, keeping the data requests made."""
+    def __init__(self, values):
+        self.values = values
+        self.requests = []
+
+    def get_all_values(self):
+        self.requests.append('all')
+        return [list(row) for row in self.values]
+
+    def row_values(self, row):
+        return list(self.values[row - 1])
+
+    def batch_get(self, ranges):
+        """A1 ranges like 'A5:G' or 'G2:G' (single letter columns)."""
+        self.requests.append(ranges)
+        result = []
+        for a1 in ranges:
+            start, end = a1.split(':')
+            first, last = ord(start[0]) - ord('A'), ord(end[0]) - ord('A')
+            top = int(start[1:]) - 1
+            bottom = int(end[1:]) if end[1:] else len(self.values)
+            result.append([row[first:last + 1]
+                           for row in self.values[top:bottom]])
+        return result
+
+
+class FakeSpreadsheet:
+    def __init__(self, values):
+        self.sheet1 = FakeWorksheet(values)
+        self.lastUpdateTime = '2020-10-01T10:00:00.000Z'
+
+
+class FakeClient:
+    """Local stand-in for the gspread client: just the calls we use."""
+    def __init__(self, values):
+        self.spreadsheet = FakeSpreadsheet(values)
+
+    @property
+    def sheet(self):
+        return self.spreadsheet.sheet1
+
+    def open(self, name):
+        return self.spreadsheet
+
+    def edit(self, row, column, value, stamp=True):
+        """Edit a cell as the sheet would: the row stamp changes too."""
+        header = self.sheet.values[0]
+        self.sheet.values[row][header.index(column)] = value
+        if stamp and 'Updated' in header:
+            self.sheet.values[row][header.index('Updated')] = NEW
+        self.spreadsheet.lastUpdateTime = f'{NEW}.000Z'
+
+    def append(self, row):
+        self.sheet.values.append(row)
+        self.spreadsheet.lastUpdateTime = f'{NEW}.000Z'
+
+
+ROWS = [
+    HEADER,
+    ['Test', 'Row', 'test@example.org', '', 'no', '0', OLD],
+    ['Ada', 'Lovelace', 'ada@example.org', 'IRAM', 'no', '150', OLD],
+    ['Alan', 'Turing', 'alan@example.org', 'IAA', 'yes', '', OLD],
+    ['Emmy', 'Noether', 'emmy@example.org', 'IAC', 'no', '150', OLD],
+]
+
+
+@pytest.fixture
+def client():
+    return FakeClient([list(row) for row in ROWS])
+
+
+@pytest.fixture
+def client_without_stamps():
+    return FakeClient([row[:-1] for row in ROWS])
+
+
+def _load(client, tmp_path):
+    return registrations.load_registrations(
+        client, cache=str(tmp_path / 'registrations.parquet'))
+
+
+def test_unchanged_revision_does_not_fetch(client, tmp_path):
+    first = _load(client, tmp_path)
+    assert client.sheet.requests == ['all']
+    second = _load(client, tmp_path)
+    assert client.sheet.requests == ['all']
+    assert second.equals(first)
+    assert second['Amount'].tolist()[0] == 150
+
+
+def test_only_appended_rows_are_fetched(client, tmp_path):
+    _load(client, tmp_path)
+    client.append(['Grace', 'Hopper', 'grace@example.org', 'ESO', 'no',
+                   '1,200', NEW])
+    df = _load(client, tmp_path)
+    assert client.sheet.requests == ['all', ['G2:G'], ['A6:G6']]
+    assert df['Email'].tolist() == [
+        'ada@example.org', 'alan@example.org', 'emmy@example.org',
+        'grace@example.org']
+    assert df['Amount'].tolist()[-1] == 1200
+
+
+def test_only_edited_rows_are_fetched(client, tmp_path):
+    _load(client, tmp_path)
+    client.edit(2, 'Affiliation', 'CAB')
+    client.edit(4, 'Surname', 'A. Noether')
+    df = _load(client, tmp_path)
+    assert client.sheet.requests == ['all', ['G2:G'], ['A3:G3', 'A5:G5']]
+    assert df['Affiliation'].tolist() == ['CAB', 'IAA', 'IAC']
+    assert df['Surname'].tolist() == ['Lovelace', 'Turing', 'A. Noether']
+    # Same as fetching it all
+    (tmp_path / 'fresh').mkdir()
+    fresh = _load(FakeClient(client.sheet.values), tmp_path / 'fresh')
+    assert df.equals(fresh)
+
+
+def test_removed_rows_refetch_the_sheet(client, tmp_path):
+    _load(client, tmp_path)
+    del client.sheet.values[2]
+    client.edit(3, 'INVITED', 'yes')
+    df = _load(client, tmp_path)
+    assert client.sheet.requests[-1] == 'all'
+    assert df['Email'].tolist() == ['alan@example.org', 'emmy@example.org']
+    assert df['INVITED'].tolist() == ['yes', 'yes']
+
+
+def test_sheet_without_stamps_is_fetched_whole(client_without_stamps,
+                                               tmp_path):
+    client = client_without_stamps
+    _load(client, tmp_path)
+    client.edit(3, 'INVITED', 'no')
+    df = _load(client, tmp_path)
+    assert client.sheet.requests == ['all', 'all']
+    assert df['INVITED'].tolist() == ['no', 'no', 'no']